@@ -0,0 +1,2 @@
+# Benchmarks for the Course Manager CLI and web app
+# Run from the artifacts folder with: python -m benchmarks.run --help
@@ -0,0 +1,76 @@
+# Deterministic synthetic course catalogs for the benchmarks
+import csv
+import random
+
+DEPARTMENTS = [
+    "CS", "MATH", "PHYS", "CHEM", "BIO", "ENG", "HIST", "ECON", "PSYC", "PHIL",
+    "ART", "MUS", "STAT", "GEOG", "POLS", "SOC", "LING", "ASTR", "MECH", "ELEC"
+]
+
+TOPICS = [
+    "Foundations", "Principles", "Methods", "Theory", "Systems", "Analysis",
+    "Design", "Applications", "Topics", "Seminar", "Laboratory", "Modeling"
+]
+
+SUBJECTS = [
+    "Programming", "Algorithms", "Data Structures", "Calculus", "Mechanics",
+    "Chemistry", "Genetics", "Writing", "Markets", "Cognition", "Ethics",
+    "Composition", "Probability", "Networks", "Statistics", "Optimization"
+]
+
+# Chance of a course having 0, 1, 2 or 3 prerequisites
+PREREQ_WEIGHTS = [0.3, 0.35, 0.25, 0.1]
+
+# How far back in a department prerequisites are picked from; a small window builds deep chains
+PREREQ_WINDOW = 12
+
+
+def course_number(index):
+    """Course number of the index-th generated course, unique for any catalog size."""
+    department = DEPARTMENTS[index % len(DEPARTMENTS)]
+    return f"{department}{100 + index // len(DEPARTMENTS)}"
+
+
+def generate_catalog(size, seed=0, shuffle=True):
+    """Returns size courses as (course_number, course_title, prerequisites) tuples.
+
+    The same size and seed always give the same catalog. Prerequisites are earlier courses
+    of the same department, so the graph is acyclic with chains roughly size / (20 * 6) deep.
+    """
+    rng = random.Random(seed)
+    per_department = len(DEPARTMENTS)
+    courses = []
+    for index in range(size):
+        title = f"{rng.choice(TOPICS)} of {rng.choice(SUBJECTS)}"
+
+        # earlier courses in the same department sit at index - k * per_department
+        available = min(index // per_department, PREREQ_WINDOW)
+        count = rng.choices(range(len(PREREQ_WEIGHTS)), PREREQ_WEIGHTS)[0]
+        steps = rng.sample(range(1, available + 1), min(count, available))
+        prerequisites = [
+            course_number(index - step * per_department)
+            for step in sorted(steps)
+        ]
+
+        courses.append((course_number(index), title, prerequisites))
+
+    if shuffle:
+        rng.shuffle(courses)
+    return courses
+
+
+def write_csv(path, catalog):
+    """Writes a catalog in the course_number,course_title,prereq,... format the apps load."""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        for number, title, prerequisites in catalog:
+            writer.writerow([number, title] + prerequisites)
+
+
+def to_documents(catalog):
+    """Returns a catalog as MongoDB course documents."""
+    return [{
+        "course_number": number,
+        "course_title": title,
+        "prerequisites": list(prerequisites)
+    } for number, title, prerequisites in catalog]
@@ -0,0 +1,385 @@
+# Times the CourseBST, CSV loading, database sync and web routes on synthetic catalogs
+#
+#   python -m benchmarks.run --sizes 1000 10000 --output results.json
+#   python -m benchmarks.run --sizes 1000 10000 --compare results.json
+#
+# Everything runs against the in-memory (or SQLite) storage backend, so no MongoDB server is needed.
+import argparse
+import contextlib
+import datetime
+import importlib.util
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.catalog import generate_catalog, to_documents, write_csv
+
+ARTIFACTS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI_DIR = os.path.join(ARTIFACTS, "course-manager-cli")
+WEB_DIR = os.path.join(ARTIFACTS, "course-manager-web")
+
+# Modules both apps ship their own copy of
+SHARED_MODULES = ("mongo_crud", "storage_backends", "prereq_graph",
+                  "async_crud", "metrics", "course_search")
+
+# Rows per upload; /upload imports at most this many
+UPLOAD_ROWS = 1000
+
+
+def load_app_module(directory, name, filename):
+    """Imports an app module with its own copies of the shared modules.
+
+    The CLI and the web app each have a mongo_crud.py, so the copies already imported
+    for one app are moved out of the way while the other is imported.
+    """
+    saved = {
+        module: sys.modules.pop(module)
+        for module in SHARED_MODULES if module in sys.modules
+    }
+    sys.path.insert(0, directory)
+    try:
+        spec = importlib.util.spec_from_file_location(
+            name, os.path.join(directory, filename))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+        return module
+    finally:
+        sys.path.remove(directory)
+        for shared in SHARED_MODULES:
+            sys.modules.pop(shared, None)
+        sys.modules.update(saved)
+
+
+def measure(function, repeat):
+    """Runs function repeat times and returns timing statistics in seconds."""
+    timings = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+    return {
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.fmean(timings),
+        "runs": repeat
+    }
+
+
+def bench_tree(cli, catalog, repeat):
+    courses = [
+        cli.Course(number, title, prerequisites)
+        for number, title, prerequisites in catalog
+    ]
+    lookups = [course.course_number for course in courses]
+    random.Random(1).shuffle(lookups)
+
+    def insert():
+        bst = cli.CourseBST()
+        for course in courses:
+            bst.insert(course)
+
+    def bulk_load():
+        cli.CourseBST().bulk_load(courses)
+
+    bst = cli.CourseBST()
+    bst.bulk_load(courses)
+
+    def find():
+        for course_number in lookups:
+            bst.find_course(course_number)
+
+    def traverse():
+        for _ in bst.in_order():
+            pass
+
+    titles = [course.course_title for course in courses[:100]]
+
+    def search():
+        # typed-out titles, a half-typed word and a typo, through an already built index
+        for title in titles:
+            bst.search_index.search(title)
+            bst.search_index.search(title[:-3])
+            bst.search_index.search(title.replace("o", "a", 1))
+
+    return {
+        "tree.insert": measure(insert, repeat),
+        "tree.bulk_load": measure(bulk_load, repeat),
+        "tree.find_course": measure(find, repeat),
+        "tree.in_order": measure(traverse, repeat),
+        "tree.search_index": measure(
+            lambda: cli.SearchIndex.from_documents(courses), repeat),
+        "tree.search": measure(search, repeat)
+    }
+
+
+def bench_cli_io(cli, catalog, repeat, workdir):
+    csv_path = os.path.join(workdir, f"catalog_{len(catalog)}.csv")
+    write_csv(csv_path, catalog)
+
+    # parses the CSV every time; the snapshot path is timed on its own below
+    cli.SNAPSHOTS_ENABLED = False
+
+    def load_file():
+        cli.load_courses_from_file(csv_path, cli.CourseBST())
+
+    # the same catalog split over several files, loaded together through a glob
+    parts = 4
+    for part in range(parts):
+        write_csv(os.path.join(workdir, f"part_{len(catalog)}_{part}.csv"),
+                  catalog[part::parts])
+    parts_pattern = os.path.join(workdir, f"part_{len(catalog)}_*.csv")
+
+    def load_files():
+        cli.load_courses_from_files([parts_pattern], cli.CourseBST())
+
+    bst = cli.CourseBST()
+    with contextlib.redirect_stdout(io.StringIO()):
+        cli.load_courses_from_file(csv_path, bst)
+        mongo = cli.CRUD(None, None, "benchCLI", f"courses_{len(catalog)}")
+
+    snapshot_path = f"{csv_path}.snap"
+
+    def write_snapshot():
+        cli.write_snapshot(snapshot_path, bst)
+
+    def load_snapshot():
+        # a cold start: open the snapshot and look up a few courses
+        tree = cli.CourseBST()
+        cli.load_snapshot(snapshot_path, tree)
+        for course in catalog[:100]:
+            tree.find_course(course[0])
+        tree.detach_snapshot()
+
+    def save():
+        mongo.collection.delete_many({})
+        cli.save_courses_to_mongodb(bst, mongo)
+
+    def load():
+        cli.load_courses_from_mongodb(mongo, cli.CourseBST())
+
+    def sync():
+        # a routine sync, where the collection already matches the tree
+        cli.sync_courses_to_mongodb(bst, mongo)
+
+    # a batch of lookups as the find command reads them, one in ten unknown
+    lookups = "".join(f"{number}\n" if i % 10 else f"{number}X\n"
+                      for i, (number, _, _) in enumerate(catalog))
+
+    def find_batch():
+        cli.find_courses_batch(bst, cli.iter_course_numbers(io.StringIO(lookups)),
+                               io.StringIO(), "csv")
+
+    return {
+        "cli.load_courses_from_file": measure(load_file, repeat),
+        "cli.load_courses_from_files": measure(load_files, repeat),
+        "cli.write_snapshot": measure(write_snapshot, repeat),
+        "cli.load_snapshot": measure(load_snapshot, repeat),
+        "cli.save_courses_to_mongodb": measure(save, repeat),
+        "cli.load_courses_from_mongodb": measure(load, repeat),
+        "cli.sync_courses_to_mongodb": measure(sync, repeat),
+        "cli.find_courses_batch": measure(find_batch, repeat)
+    }
+
+
+def bench_web(web, catalog, repeat):
+    client = web.app.test_client()
+    # the first request of a session opens its own collection
+    with contextlib.redirect_stdout(io.StringIO()):
+        client.get("/")
+    with client.session_transaction() as session:
+        mongo = web.tenants.get(session["tenant"]).mongo
+
+    upload_rows = catalog[:UPLOAD_ROWS]
+    upload_body = io.StringIO()
+    for number, title, prerequisites in upload_rows:
+        upload_body.write(",".join([number, title] + prerequisites) + "\n")
+    upload_bytes = upload_body.getvalue().encode("utf-8")
+
+    def upload():
+        mongo.delete_all()
+        response = client.post(
+            "/upload",
+            data={"file": (io.BytesIO(upload_bytes), "catalog.csv")},
+            headers={"Accept": "application/json"})
+        assert response.status_code == 202, response.status_code
+        # the import runs on a worker thread, so this times the upload until it finishes
+        web.import_jobs.get(response.get_json()["id"]).future.result()
+
+    results = {"web.upload": measure(upload, repeat)}
+
+    # the rest of the catalog goes straight in so the listing and export see all of it
+    with contextlib.redirect_stdout(io.StringIO()):
+        mongo.bulk_create(to_documents(catalog))
+
+    def index():
+        assert client.get("/").status_code == 200
+
+    def index_revalidate():
+        # a polling client that already holds the current page
+        etag = client.get("/").headers["ETag"]
+        for _ in range(10):
+            response = client.get("/", headers={"If-None-Match": etag})
+            assert response.status_code == 304, response.status_code
+
+    def deep_page():
+        after = sorted(number for number, _, _ in catalog)[len(catalog) // 2]
+        assert client.get(f"/?after={after}").status_code == 200
+
+    batch = [number for number, _, _ in catalog[:100]]
+
+    def api_batch():
+        # 100 courses read, retitled and read again in three calls instead of 300
+        response = client.post("/api/courses/get", json={"course_numbers": batch})
+        assert response.status_code == 200, response.status_code
+        titles = {
+            result["course_number"]: result["course"]["course_title"]
+            for result in response.get_json()["results"]
+        }
+        patches = [{
+            "course_number": number,
+            "course_title": title[::-1]
+        } for number, title in titles.items()]
+        assert client.post("/api/courses/patch",
+                           json={"patches": patches}).status_code == 200
+        client.post("/api/courses/get",
+                    json={"course_numbers": batch, "fields": ["course_title"]})
+
+    edited = catalog[len(catalog) // 3]
+
+    def edit():
+        # one guarded find_one_and_update per save, the version comes from the loaded form
+        number, title, prerequisites = edited
+        version = mongo.find_course(number).get("version", 0)
+        response = client.post(f"/edit/{number}",
+                               data={
+                                   "course_title": title,
+                                   "prerequisites": ",".join(prerequisites),
+                                   "version": str(version)
+                               })
+        assert response.status_code == 302, response.status_code
+
+    def export():
+        response = client.get("/export")
+        assert response.status_code == 200
+        for _ in response.response:
+            pass
+
+    results["web.index"] = measure(index, repeat)
+    results["web.index_revalidate_x10"] = measure(index_revalidate, repeat)
+    results["web.index_deep_page"] = measure(deep_page, repeat)
+    results["web.export_courses"] = measure(export, repeat)
+    results["web.api_batch_100"] = measure(api_batch, repeat)
+    results["web.edit_course"] = measure(edit, repeat)
+    mongo.drop()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Prints benchmarks whose median got slower than baseline by more than threshold."""
+    regressions = []
+    for size, benchmarks in results["sizes"].items():
+        for name, timing in benchmarks.items():
+            old = baseline.get("sizes", {}).get(size, {}).get(name)
+            if not old:
+                continue
+            change = timing["median"] / old["median"] - 1
+            marker = "REGRESSION" if change > threshold else ""
+            print(f"{size:>8} {name:<32} {old['median']:.4f}s -> "
+                  f"{timing['median']:.4f}s ({change:+.1%}) {marker}")
+            if change > threshold:
+                regressions.append((size, name, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the Course Manager CLI and web app")
+    parser.add_argument("--sizes",
+                        type=int,
+                        nargs="+",
+                        default=[1000, 10000],
+                        help="catalog sizes to run, e.g. 1000 100000 1000000")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend",
+                        choices=["memory", "sqlite"],
+                        default="memory")
+    parser.add_argument("--suites",
+                        nargs="+",
+                        choices=["tree", "cli", "web"],
+                        default=["tree", "cli", "web"])
+    parser.add_argument("--output", help="write the JSON results here")
+    parser.add_argument("--compare",
+                        help="JSON results of an earlier run to compare with")
+    parser.add_argument("--threshold",
+                        type=float,
+                        default=0.10,
+                        help="slowdown that counts as a regression")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="course-bench-")
+    os.environ["COURSE_BACKEND"] = args.backend
+    os.environ["COURSE_SQLITE_DIR"] = workdir
+    # times the database path rather than the read-through cache
+    os.environ.setdefault("COURSE_CACHE_SIZE", "0")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        cli = load_app_module(CLI_DIR, "course_manager_cli",
+                              "course-manager-cli.py")
+        web = load_app_module(WEB_DIR, "course_manager_web", "app.py")
+
+    results = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "backend": args.backend,
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "sizes": {}
+    }
+
+    # the web app resolves uploads/ and sample.csv against the working directory
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    os.makedirs("uploads", exist_ok=True)
+    try:
+        for size in args.sizes:
+            catalog = generate_catalog(size, args.seed)
+            benchmarks = {}
+            if "tree" in args.suites:
+                benchmarks.update(bench_tree(cli, catalog, args.repeat))
+            if "cli" in args.suites:
+                benchmarks.update(
+                    bench_cli_io(cli, catalog, args.repeat, workdir))
+            if "web" in args.suites:
+                benchmarks.update(bench_web(web, catalog, args.repeat))
+            results["sizes"][str(size)] = benchmarks
+
+            for name, timing in benchmarks.items():
+                print(f"{size:>8} {name:<32} median {timing['median']:.4f}s")
+    finally:
+        os.chdir(cwd)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,139 +3,282 @@
 # SNHU
 
 # Imports mongo_crud.py file to load and use CRUD functionality with a database
-from mongo_crud import CRUD
+from mongo_crud import CRUD, VERSION_FIELD, content_hash
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import PyMongoError
+# Picks the storage backend from the COURSE_BACKEND environment variable
+from storage_backends import get_backend
+# Imports the prerequisite graph that resolves prerequisite chains
+from prereq_graph import PrereqGraph
+# Imports the title search index used by the course search
+from course_search import SearchIndex
+# Collects CRUD and MongoDB command timings for the optional timing summary
+from metrics import registry
+# Compact columnar storage for the courses held in memory
+from course_store import CourseStore
+# Memory-mapped catalog snapshots for fast startup
+from course_snapshot import Snapshot, save_snapshot, file_fingerprint, collection_fingerprint, source_matches
+# Parses CSV files in chunks across a process pool
+from csv_loader import expand_paths, gc_paused, load_rows
+import argparse
+import contextlib
+import csv
+import json
+import sys
 # Uses getpass to hide user password when authenticating to a mongoDB database
 from getpass import getpass
+from itertools import islice
+import os
+import time
+
+# Number of courses sent to MongoDB in each bulk write
+DEFAULT_BATCH_SIZE = 500
+
+# Snapshots are written next to each CSV file as <file>.snap, and for MongoDB collections
+# into this directory. Set COURSE_SNAPSHOTS=0 to turn them off
+SNAPSHOTS_ENABLED = os.getenv("COURSE_SNAPSHOTS", "1") != "0"
+SNAPSHOT_DIR = os.getenv("COURSE_SNAPSHOT_DIR", ".course-snapshots")
+# Collection snapshots are checked against the collection's stored write count. Set
+# COURSE_SNAPSHOT_VERIFY=1 to hash its contents instead, which also sees outside writes
+SNAPSHOT_VERIFY = os.getenv("COURSE_SNAPSHOT_VERIFY", "0") == "1"
+
+# Time taken to read a CSV file into the tree, shown with the other timings
+import_latency = registry.histogram("course_import_seconds",
+                                    "Time taken to load a CSV file.",
+                                    ["source"])
 
 # Creates a Course Class and adds an init method to initialize a course
+# __slots__ keeps each course to three fixed fields instead of a per-object dict
 class Course:
+    __slots__ = ("course_number", "course_title", "prerequisites", "_hash")
+
     def __init__(self, course_number, course_title, prerequisites=None):
         self.course_number = course_number
         self.course_title = course_title
         self.prerequisites = prerequisites if prerequisites else []
-
-# Creates a node that is added to the binary search tree
-class Node:
-    def __init__(self, course):
-        self.course = course
-        self.left = None
-        self.right = None
-        self.height = 1
-
-# Uses an AVL Tree to save courses in program
+        self._hash = None
+
+    # hash of the course's fields, worked out the first time a sync needs it
+    @property
+    def content_hash(self):
+        if self._hash is None:
+            self._hash = content_hash(self.course_number, self.course_title, self.prerequisites)
+        return self._hash
+
+    def to_document(self):
+        return {
+            "course_number": self.course_number,
+            "course_title": self.course_title,
+            "prerequisites": self.prerequisites,
+            "content_hash": self.content_hash
+        }
+
+# Keeps the courses in a compact columnar store and answers lookups in course number order
 class CourseBST:
     def __init__(self):
-        self.root = None
-
-    # Utility methods for AVL tree
-    def _height(self, node):
-        return node.height if node else 0
-
-    def _balance(self, node):
-        return self._height(node.left) - self._height(node.right) if node else 0
-
-    # Adds rotations for AVL tree
-    def _rotate_left(self, x):
-        y = x.right
-        T2 = y.left
-        y.left = x
-        x.right = T2
-        x.height = 1 + max(self._height(x.left), self._height(x.right))
-        y.height = 1 + max(self._height(y.left), self._height(y.right))
-        return y
-
-    def _rotate_right(self, y):
-        x = y.left
-        T2 = x.right
-        x.right = y
-        y.left = T2
-        y.height = 1 + max(self._height(y.left), self._height(y.right))
-        x.height = 1 + max(self._height(x.left), self._height(x.right))
-        return x
-
-   # Creates an insert function to insert courses in tree
-    def _insert(self, node, course):
-        if not node:
-            return Node(course)
-
-        if course.course_number < node.course.course_number:
-            node.left = self._insert(node.left, course)
-        elif course.course_number > node.course.course_number:
-            node.right = self._insert(node.right, course)
-        else:
-            # skips if it is a duplicate course
-            return node
-
-        node.height = 1 + max(self._height(node.left), self._height(node.right))
-        balance = self._balance(node)
-
-        # Rotates tree based on where it is unbalanced
-        if balance > 1 and course.course_number < node.left.course.course_number:
-            return self._rotate_right(node)
-        
-        if balance < -1 and course.course_number > node.right.course.course_number:
-            return self._rotate_left(node)
-    
-        if balance > 1 and course.course_number > node.left.course.course_number:
-            node.left = self._rotate_left(node.left)
-            return self._rotate_right(node)
-    
-        if balance < -1 and course.course_number < node.right.course.course_number:
-            node.right = self._rotate_right(node.right)
-            return self._rotate_left(node)
-
-        return node
-
+        self.store = CourseStore(Course)
+        # prerequisite graph, only built once something asks for it and then kept in step
+        self._graph = None
+        # title search index, only built once the first search runs
+        self._search = None
+        # memory-mapped snapshot answering lookups until the catalog is first changed
+        self.snapshot = None
+
+    # Serves the courses of a snapshot without loading them, replacing what the store held
+    def attach_snapshot(self, snapshot):
+        self.detach_snapshot()
+        self.store = CourseStore(Course)
+        self.snapshot = snapshot
+        self._graph = None
+        self._search = None
+
+    # Copies the snapshot, which is already sorted, into the store and closes the snapshot
+    def _materialize(self):
+        if self.snapshot is None:
+            return
+        for course in self.snapshot.iter_from(0):
+            self.store.add(course.course_number, course.course_title, course.prerequisites)
+        self.detach_snapshot()
+
+    def detach_snapshot(self):
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+    # Reads go to the snapshot while one is attached, both offer the same lookups
+    @property
+    def _courses(self):
+        return self.snapshot if self.snapshot is not None else self.store
+
+    @property
+    def graph(self):
+        if self._graph is None:
+            self._graph = PrereqGraph()
+            for course in self.in_order():
+                self._graph.set_course(course.course_number, course.prerequisites)
+        return self._graph
+
+    @property
+    def search_index(self):
+        if self._search is None:
+            self._search = SearchIndex.from_documents(self.in_order())
+        return self._search
+
+    # Adds a course, returns False if it is a duplicate
     def insert(self, course):
-        self.root = self._insert(self.root, course)
+        self._materialize()
+        if not self.store.add(course.course_number, course.course_title, course.prerequisites):
+            return False
+        if self._graph is not None:
+            self._graph.set_course(course.course_number, course.prerequisites)
+        if self._search is not None:
+            self._search.set_course(course.course_number, course.course_title)
+        return True
+
+    # Adds many courses at once, keeping the existing course when a course number shows up
+    # twice just like insert() does, and returns how many were added. Takes any iterable, so
+    # a generator never holds more than one Course at a time
+    def bulk_load(self, courses):
+        added = 0
+        for course in courses:
+            if self.insert(course):
+                added += 1
+        return added
+
+    # counts the courses
+    def size(self):
+        return len(self._courses)
+
+    # yields courses in alphabetic and numerical order
+    def in_order(self):
+        return self._courses.iter_from(0)
+
+    # yields courses from the first course number >= lower onward
+    def _in_order_from(self, lower):
+        courses = self._courses
+        return courses.iter_from(courses.bisect(lower))
+
+    # lazily yields the courses between low and high (both inclusive), e.g. CS200 to CS299
+    def range_courses(self, low, high):
+        for course in self._in_order_from(low):
+            if course.course_number > high:
+                return
+            yield course
+
+    # lazily yields every course whose number starts with prefix, e.g. MATH
+    def prefix_courses(self, prefix):
+        for course in self._in_order_from(prefix):
+            if not course.course_number.startswith(prefix):
+                return
+            yield course
+
+    # returns how many courses sort before course_number
+    def rank(self, course_number):
+        return self._courses.bisect(course_number)
+
+    # returns the course at position index (0-based) in sorted order, or None
+    def select(self, index):
+        if index < 0 or index >= self.size():
+            return None
+        return self._courses.course(index)
+
+    # returns up to page_size courses starting at position start
+    def page(self, start, page_size):
+        if start < 0 or start >= self.size():
+            return []
+        return list(islice(self._courses.iter_from(start), page_size))
 
     # prints courses in alphabetic and numerical order
     def print_in_order(self):
-        def _in_order(node):
-            if node:
-                _in_order(node.left)
-                print(f"{node.course.course_number}: {node.course.course_title}")
-                _in_order(node.right)
-        _in_order(self.root)
+        for course in self.in_order():
+            print(f"{course.course_number}: {course.course_title}")
 
     # finds a course based on the course_number
     def find_course(self, course_number):
-        def _search(node, course_number):
-            if not node:
-                return None
-            if course_number == node.course.course_number:
-                return node.course
-            elif course_number < node.course.course_number:
-                return _search(node.left, course_number)
-            else:
-                return _search(node.right, course_number)
-        return _search(self.root, course_number)
+        return self._courses.find(course_number)
 
 
-def split(line, delimiter):
-    """Splits a line into tokens."""
-    return [token.strip() for token in line.split(delimiter)]
+def load_snapshot(path, bst, source_path=None, collection=None):
+    """Serves the tree from a snapshot if it exists and still matches its source."""
+    if not os.path.exists(path):
+        return False
+    try:
+        snapshot = Snapshot(path, Course)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable snapshot {path}: {e}")
+        return False
 
+    # a snapshot saved from the menu has no source and is loaded as is from the menu only
+    if (source_path is not None or collection is not None) and not source_matches(
+            snapshot.source, source_path, collection, SNAPSHOT_VERIFY):
+        snapshot.close()
+        print(f"Snapshot {path} is out of date, reloading from the source.")
+        return False
 
-def load_courses_from_file(filename, bst):
-    """Loads courses from a CSV file into the AVL tree."""
+    bst.attach_snapshot(snapshot)
+    print(f"Loaded {len(snapshot)} course(s) from snapshot {path}.")
+    return True
+
+
+def write_snapshot(path, bst, source=None):
+    """Saves the tree to a snapshot file, reporting instead of failing if it can't."""
     try:
-        with open(filename, 'r') as file:
-            for line in file:
-                tokens = split(line.strip(), ',')
-                if len(tokens) < 2:
-                    continue
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        count = save_snapshot(path, bst.in_order(), source)
+        print(f"Saved {count} course(s) to snapshot {path}.")
+    except OSError as e:
+        print(f"Couldn't save snapshot {path}: {e}")
 
-                course_number = tokens[0]
-                course_title = tokens[1]
-                prerequisites = tokens[2:] if len(tokens) > 2 else []
 
-                course = Course(course_number, course_title, prerequisites)
-                bst.insert(course)
+def load_courses_from_file(filename, bst):
+    """Loads courses from a CSV file into the course list."""
+    load_courses_from_files([filename], bst)
 
-        print("Courses successfully loaded and balanced with AVL Tree!")
-    except FileNotFoundError:
-        print(f"Error: Could not open file '{filename}'.")
+
+def load_courses_from_files(patterns, bst, workers=None):
+    """Loads courses from CSV files and glob patterns into the course list.
+
+    Large loads are parsed in parallel by csv_loader. A course number found in more than one
+    file keeps the first file's course, like one already in the tree does.
+    """
+    paths = expand_paths(patterns)
+    if not paths:
+        print("No files given.")
+        return
+
+    # An up to date snapshot of a single file replaces parsing it when the tree is empty
+    snapshot_path = f"{paths[0]}.snap" if len(paths) == 1 else None
+    was_empty = bst.size() == 0
+    if SNAPSHOTS_ENABLED and snapshot_path and was_empty and load_snapshot(
+            snapshot_path, bst, source_path=paths[0]):
+        return
+
+    try:
+        start = time.perf_counter()
+        # fingerprints the file before reading it, so a change made meanwhile invalidates the snapshot
+        source = file_fingerprint(paths[0]) if SNAPSHOTS_ENABLED and snapshot_path and was_empty else None
+        with gc_paused():
+            rows, rejected = load_rows(paths, workers)
+            bst.bulk_load(Course(number, title, prerequisites) for number, title, prerequisites in rows)
+
+        elapsed = time.perf_counter() - start
+        import_latency.observe(elapsed, "csv")
+        print("Courses successfully loaded!")
+        if rejected:
+            print(f"Skipped {rejected} row(s) without a course number and title.")
+        if elapsed > 0:
+            print(f"Loaded {len(rows)} course(s) from {len(paths)} file(s) in {elapsed:.3f}s "
+                  f"({len(rows) / elapsed:,.0f} rows/s).")
+
+        # Only a tree holding nothing but this file matches the file
+        if source is not None:
+            write_snapshot(snapshot_path, bst, source)
+    except FileNotFoundError as e:
+        print(f"Error: Could not open file '{e.filename}'.")
+    except (UnicodeDecodeError, csv.Error) as e:
+        print(f"Error: Could not read CSV data: {e}")
 
 
 def display_course_info(bst):
@@ -153,6 +296,91 @@ def display_course_info(bst):
         print("Prerequisites:", ", ".join(course.prerequisites))
 
 
+def print_course_range(bst):
+    """Prints every course between two course numbers."""
+    low = input("Enter the first course number of the range (e.g. CS200): ").strip()
+    high = input("Enter the last course number of the range (e.g. CS299): ").strip()
+
+    found = False
+    for course in bst.range_courses(low, high):
+        print(f"{course.course_number}: {course.course_title}")
+        found = True
+    if not found:
+        print("No courses found in that range.")
+
+
+def print_course_prefix(bst):
+    """Prints every course whose number starts with a prefix."""
+    prefix = input("Enter the course number prefix (e.g. MATH): ").strip()
+
+    found = False
+    for course in bst.prefix_courses(prefix):
+        print(f"{course.course_number}: {course.course_title}")
+        found = True
+    if not found:
+        print("No courses found with that prefix.")
+
+
+def print_course_page(bst):
+    """Prints one page of the course list."""
+    page_number = input("Enter the page number: ").strip()
+    page_size = input("Enter the page size (leave blank for 20): ").strip()
+    page_number = int(page_number) if page_number.isdigit() and int(page_number) > 0 else 1
+    page_size = int(page_size) if page_size.isdigit() and int(page_size) > 0 else 20
+
+    total = bst.size()
+    pages = max(1, (total + page_size - 1) // page_size)
+    print(f"\nPage {page_number} of {pages} ({total} courses):")
+    for course in bst.page((page_number - 1) * page_size, page_size):
+        print(f"{course.course_number}: {course.course_title}")
+
+
+def search_courses(bst):
+    """Prints the courses whose title or number best match a search."""
+    query = input("Enter words from the course title or a course number: ").strip()
+    if not query:
+        print("Please enter something to search for.")
+        return
+
+    results = bst.search_index.search(query, 10)
+    if not results:
+        print("No courses match that search.")
+    for number, title, score in results:
+        print(f"{number}: {title}")
+
+
+def display_prerequisite_chain(bst):
+    """Prints every prerequisite of a course and an order to take them in."""
+    course_number = input("Enter the course number: ").strip()
+    if not bst.graph.has_course(course_number):
+        print("Course not found.")
+        return
+
+    all_prereqs = sorted(bst.graph.all_prerequisites(course_number))
+    print(f"All prerequisites of {course_number}: {', '.join(all_prereqs) if all_prereqs else 'None'}")
+    print("Study order:")
+    for step, course in enumerate(bst.graph.study_order(course_number), start=1):
+        print(f"  {step}. {course}")
+
+    for cycle in bst.graph.find_cycles():
+        if course_number in cycle:
+            print("Warning: prerequisite cycle", " -> ".join(cycle))
+
+
+def check_prerequisites(bst):
+    """Reports prerequisite cycles and prerequisites that are not in the course list."""
+    cycles = bst.graph.find_cycles()
+    dangling = bst.graph.dangling_references()
+
+    if not cycles and not dangling:
+        print("All prerequisites are valid.")
+        return
+    for cycle in cycles:
+        print("Prerequisite cycle:", " -> ".join(cycle))
+    for missing, users in dangling.items():
+        print(f"Missing course {missing} is required by: {', '.join(users)}")
+
+
 def show_menu():
     """Displays the main menu."""
     print("\nMenu Options:")
@@ -163,9 +391,24 @@ def show_menu():
     print("5. Save courses to MongoDB")
     print("6. Update a course in MongoDB")
     print("7. Delete a course from MongoDB")
+    print("8. Print courses in a range")
+    print("10. Print courses by prefix")
+    print("11. Print a page of the course list")
+    print("12. Print prerequisite chain and study order")
+    print("13. Check prerequisites for cycles and missing courses")
+    print("14. Show timing summary")
+    print("15. Save course snapshot")
+    print("16. Load course snapshot")
+    print("17. Sync changes to MongoDB")
+    print("18. Search courses by title")
     print("9. Exit")
 
 def prompt_for_user_and_pass():
+    # No credentials are needed for the in-memory or SQLite backends (COURSE_BACKEND)
+    if get_backend() != "mongo":
+        print(f"Using the {get_backend()} storage backend.")
+        return CRUD(None, None, "coursesDB", "courses")
+
     print("\n--- MongoDB Connection Setup ---")
     username = input("Enter MongoDB username (leave blank for no authentication): ").strip()
     password = getpass("Enter MongoDB password (leave blank if none exists): ").strip()
@@ -173,49 +416,103 @@ def prompt_for_user_and_pass():
     if username and password:
         return CRUD(username, password, "coursesDB", "courses")
     else:
-        return CRUD("coursesDB", "courses")
+        return CRUD(None, None, "coursesDB", "courses")
 
 
-def save_courses_to_mongodb(bst, mongo):
+def save_courses_to_mongodb(bst, mongo, batch_size=DEFAULT_BATCH_SIZE):
     """Saves courses to MongoDB in sorted (in numerical order) order."""
-    def _save(node):
-        if node:
-            # Visit the leftmost node to get smallest course number
-            _save(node.left)
-
-            # Checks if the courses already exists in the database
-            existing = mongo.collection.find_one(
-                {"course_number": node.course.course_number}
-            )
-
-            if existing:
-                print(f"Skipped pre-existing course in database: {node.course.course_number}")
-            else:
-              # Insert new course document
-              doc = {
-                  "course_number": node.course.course_number,
-                  "course_title": node.course.course_title,
-                  "prerequisites": node.course.prerequisites
-              }
-
-            mongo.create(doc)
-            # Visit the right subtree for the larger course numbers
-            _save(node.right)
-
-    _save(bst.root)
+    # Streams the in-order traversal so only one batch is held in memory at a time
+    docs = (course.to_document() for course in bst.in_order())
+
+    stats = mongo.bulk_create(docs, batch_size)
+
+    inserted = sum(batch["inserted"] for batch in stats)
+    skipped = sum(batch["skipped"] for batch in stats)
+    rejected = sum(batch["rejected"] for batch in stats)
+
+    print(f"Sync summary ({len(stats)} batch(es) of up to {batch_size}):")
+    print(f"  Inserted: {inserted}")
+    print(f"  Skipped pre-existing: {skipped}")
+    print(f"  Rejected: {rejected}")
     print("Courses have been saved to MongoDB in alphabetical and numerical order.")
+    return {"batches": len(stats), "inserted": inserted, "skipped": skipped, "rejected": rejected}
+
+
+def diff_courses(local, remote, delete_missing=False):
+    """Yields the writes that make the collection match the tree in one merge pass.
+
+    local and remote are both sorted by course number. remote holds documents with just the
+    course number and stored content hash, so unchanged courses are never read or written.
+    """
+    local_course = next(local, None)
+    remote_doc = next(remote, None)
+    while local_course is not None or remote_doc is not None:
+        if remote_doc is None or (local_course is not None and
+                                  local_course.course_number < remote_doc["course_number"]):
+            # only in the tree
+            yield UpdateOne({"course_number": local_course.course_number},
+                            {"$set": local_course.to_document()}, upsert=True)
+            local_course = next(local, None)
+        elif local_course is None or local_course.course_number > remote_doc["course_number"]:
+            # only in MongoDB
+            if delete_missing:
+                yield DeleteOne({"course_number": remote_doc["course_number"]})
+            remote_doc = next(remote, None)
+        else:
+            # in both, rewritten only when the content differs or was never hashed
+            if local_course.content_hash != remote_doc.get("content_hash"):
+                # counted as an edit, so a web editor holding the older version gets a conflict
+                yield UpdateOne({"course_number": local_course.course_number},
+                                {"$set": local_course.to_document(), "$inc": {VERSION_FIELD: 1}})
+            local_course = next(local, None)
+            remote_doc = next(remote, None)
+
+
+def sync_courses_to_mongodb(bst, mongo, batch_size=DEFAULT_BATCH_SIZE, delete_missing=False):
+    """Pushes only the courses that were added or changed since the collection was last synced."""
+    remote = mongo.collection.find({}, {"_id": 0, "course_number": 1, "content_hash": 1}).sort("course_number", 1)
+    operations = diff_courses(bst.in_order(), iter(remote), delete_missing)
+    counts = mongo.write_changes(operations, batch_size)
+
+    print("Sync summary:")
+    print(f"  Inserted: {counts['inserted']}")
+    print(f"  Updated: {counts['updated']}")
+    print(f"  Deleted: {counts['deleted']}")
+    print(f"  Failed: {counts['failed']}")
+    return counts
+
+
+def prompt_for_batch_size():
+    """Asks how many courses to send to MongoDB per round trip."""
+    size = input(f"Enter the batch size (leave blank for {DEFAULT_BATCH_SIZE}): ").strip()
+    if size.isdigit() and int(size) > 0:
+        return int(size)
+    return DEFAULT_BATCH_SIZE
 
 
 def load_courses_from_mongodb(mongo, bst):
-    documents = mongo.read({})
-    for doc in documents:
-        course = Course(
+    # An up to date snapshot of the collection replaces reading it when the tree is empty
+    snapshot_path = os.path.join(SNAPSHOT_DIR, f"{mongo.db.name}.{mongo.collection.name}.snap")
+    source = None
+    if SNAPSHOTS_ENABLED and bst.size() == 0:
+        if load_snapshot(snapshot_path, bst, collection=mongo.collection):
+            return
+        source = collection_fingerprint(mongo.collection, SNAPSHOT_VERIFY)
+
+    # Reads the courses already sorted by the course_number index so ordering the store is a linear pass
+    documents = mongo.collection.find({}, {"_id": 0}).sort("course_number", 1)
+    bst.bulk_load(
+        Course(
             doc["course_number"],
             doc["course_title"],
             doc.get("prerequisites", [])
         )
-        bst.insert(course)
-    print("Courses loaded from MongoDB and balanced with an AVL Tree!")
+        for doc in documents
+    )
+    print("Courses loaded from MongoDB!")
+
+    if source is not None:
+        write_snapshot(snapshot_path, bst, source)
 
 
 def update_course_db(mongo):
@@ -231,11 +528,13 @@ def update_course_db(mongo):
         new_data["prerequisites"] = [p.strip() for p in new_prereqs.split(",")]
 
     if new_data:
-        updated_count = mongo.update({"course_number": course_number}, new_data)
-        if updated_count > 0:
-            print(f"{updated_count} course(s) updated successfully.")
-        else:
+        status, course = mongo.update_course(course_number, new_data)
+        if status == "updated":
+            print(f"Course updated successfully: {format_document(course)}")
+        elif status == "not_found":
             print("No matching course was found.")
+        else:
+            print("The course could not be updated, see the error above.")
     else:
         print("No updates were provided.")
 
@@ -243,11 +542,333 @@ def update_course_db(mongo):
 def delete_mongo_course(mongo):
     """Deletes a course directly in MongoDB"""
     course_number = input("Enter the course number to delete: ").strip()
-    deleted_count = mongo.delete({"course_number": course_number})
-    if deleted_count > 0:
-        print(f"{deleted_count} course(s) deleted successfully.")
-    else:
+    status, course = mongo.delete_course(course_number)
+    if status == "deleted":
+        print(f"Course deleted successfully: {format_document(course)}")
+    elif status == "not_found":
         print("No matching course found.")
+    else:
+        print("The course could not be deleted, see the error above.")
+
+
+def format_document(doc):
+    """One line description of a course document."""
+    prerequisites = ", ".join(doc.get("prerequisites", [])) or "None"
+    return f"{doc['course_number']}, {doc['course_title']} (Prerequisites: {prerequisites})"
+
+
+# Batch mode reads MongoDB settings from these environment variables, or from a file of
+# KEY=VALUE lines using the same names given with --credentials or COURSE_MONGO_CREDENTIALS
+CREDENTIAL_SETTINGS = {
+    "COURSE_MONGO_USER": "username",
+    "COURSE_MONGO_PASSWORD": "password",
+    "COURSE_MONGO_DB": "db_name",
+    "COURSE_MONGO_COLLECTION": "collection_name",
+    "COURSE_MONGO_HOST": "host",
+    "COURSE_MONGO_PORT": "port"
+}
+
+
+def read_credentials(path=None):
+    """Returns the CRUD connection settings from the environment and an optional credentials file.
+
+    Values in the file win over the environment. Blank lines and lines starting with # are skipped.
+    """
+    values = {key: os.environ[key] for key in CREDENTIAL_SETTINGS if os.environ.get(key)}
+    if path:
+        with open(path, encoding="utf-8") as f:
+            for number, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                key, separator, value = line.partition("=")
+                key = key.strip()
+                if not separator or key not in CREDENTIAL_SETTINGS:
+                    raise ValueError(f"{path}, line {number}: expected one of "
+                                     f"{', '.join(CREDENTIAL_SETTINGS)} as KEY=VALUE")
+                values[key] = value.strip().strip("\"'")
+
+    settings = {"username": None, "password": None, "db_name": "coursesDB",
+                "collection_name": "courses", "host": "localhost", "port": 27017}
+    for key, value in values.items():
+        settings[CREDENTIAL_SETTINGS[key]] = value
+    settings["port"] = int(settings["port"])
+    return settings
+
+
+def connect_batch(args):
+    """Opens the collection for a batch command without prompting. Returns None if it can't."""
+    settings = read_credentials(args.credentials)
+    # connection messages stay off stdout, which may be carrying the command's output
+    with contextlib.redirect_stdout(sys.stderr):
+        mongo = CRUD(**settings)
+    if mongo.collection is None:
+        print("Error: could not connect to MongoDB, check the COURSE_MONGO_* settings.", file=sys.stderr)
+        return None
+    return mongo
+
+
+def load_batch_tree(args):
+    """Loads the course list for a batch command from --csv files, or from MongoDB otherwise."""
+    bst = CourseBST()
+    if args.csv:
+        load_courses_from_files(args.csv, bst, args.workers)
+    else:
+        mongo = connect_batch(args)
+        if mongo is None:
+            return None
+        load_courses_from_mongodb(mongo, bst)
+    return bst
+
+
+def iter_course_numbers(lines):
+    """Yields one course number per line, skipping blank lines.
+
+    Anything after a comma is ignored, so a course CSV file can be used as the input too.
+    """
+    for line in lines:
+        number = line.split(",", 1)[0].strip()
+        if number:
+            yield number
+
+
+def write_courses(courses, output, output_format):
+    """Streams courses as CSV rows in the load format or as one JSON object per line."""
+    if output_format == "json":
+        encode = json.JSONEncoder(ensure_ascii=False).encode
+        for course in courses:
+            output.write(encode({"course_number": course.course_number,
+                                 "course_title": course.course_title,
+                                 "prerequisites": course.prerequisites}))
+            output.write("\n")
+        return
+    csv.writer(output, lineterminator="\n").writerows(
+        [course.course_number, course.course_title, *course.prerequisites] for course in courses)
+
+
+def find_courses_batch(bst, numbers, output, output_format):
+    """Looks up every course number and streams one result per number.
+
+    CSV output has a header and course_number, found, course_title and prerequisites columns,
+    with the prerequisites separated by spaces. Returns the found and missing counts.
+    """
+    found = missing = 0
+    find = bst.find_course
+    if output_format == "json":
+        encode = json.JSONEncoder(ensure_ascii=False).encode
+        for number in numbers:
+            course = find(number)
+            if course is None:
+                missing += 1
+                output.write(encode({"course_number": number, "found": False}))
+            else:
+                found += 1
+                output.write(encode({"course_number": number,
+                                     "found": True,
+                                     "course_title": course.course_title,
+                                     "prerequisites": course.prerequisites}))
+            output.write("\n")
+        return found, missing
+
+    writer = csv.writer(output, lineterminator="\n")
+    writer.writerow(["course_number", "found", "course_title", "prerequisites"])
+    for number in numbers:
+        course = find(number)
+        if course is None:
+            missing += 1
+            writer.writerow([number, "false", "", ""])
+        else:
+            found += 1
+            writer.writerow([number, "true", course.course_title, " ".join(course.prerequisites)])
+    return found, missing
+
+
+@contextlib.contextmanager
+def open_output(path):
+    """Opens the output file, or uses stdout for - and no path."""
+    if not path or path == "-":
+        yield sys.stdout
+        return
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        yield f
+
+
+@contextlib.contextmanager
+def open_input(path):
+    """Opens the input file, or uses stdin for - and no path."""
+    if not path or path == "-":
+        yield sys.stdin
+        return
+    with open(path, encoding="utf-8-sig") as f:
+        yield f
+
+
+def run_load(args):
+    bst = load_batch_tree(args)
+    if bst is None:
+        return 2
+    mongo = connect_batch(args)
+    if mongo is None:
+        return 2
+    stats = save_courses_to_mongodb(bst, mongo, args.batch_size)
+    return 1 if stats["rejected"] else 0
+
+
+def run_sync(args):
+    bst = load_batch_tree(args)
+    if bst is None:
+        return 2
+    mongo = connect_batch(args)
+    if mongo is None:
+        return 2
+    counts = sync_courses_to_mongodb(bst, mongo, args.batch_size, args.delete_missing)
+    return 1 if counts["failed"] else 0
+
+
+def run_export(args):
+    with contextlib.redirect_stdout(sys.stderr):
+        bst = load_batch_tree(args)
+    if bst is None:
+        return 2
+    with open_output(args.output) as output:
+        write_courses(bst.in_order(), output, args.format)
+    return 0
+
+
+def run_find(args):
+    with contextlib.redirect_stdout(sys.stderr):
+        bst = load_batch_tree(args)
+    if bst is None:
+        return 2
+    start = time.perf_counter()
+    with open_input(args.input) as lines, open_output(args.output) as output:
+        found, missing = find_courses_batch(bst, iter_course_numbers(lines), output, args.format)
+    elapsed = time.perf_counter() - start
+    print(f"Found {found} of {found + missing} course(s) in {elapsed:.3f}s.", file=sys.stderr)
+    return 1 if missing and args.fail_missing else 0
+
+
+def run_update(args):
+    new_data = {}
+    if args.title is not None:
+        new_data["course_title"] = args.title.strip()
+    if args.prerequisites is not None:
+        new_data["prerequisites"] = [p.strip() for p in args.prerequisites.split(",") if p.strip()]
+    if not new_data:
+        print("Error: give --title and/or --prerequisites.", file=sys.stderr)
+        return 2
+    mongo = connect_batch(args)
+    if mongo is None:
+        return 2
+    with contextlib.redirect_stdout(sys.stderr):
+        status, course = mongo.update_course(args.course_number, new_data)
+    if status == "error":
+        return 1
+    if status == "not_found":
+        print(f"No course found with number: {args.course_number}", file=sys.stderr)
+        return 1
+    print(f"Updated: {format_document(course)}")
+    return 0
+
+
+def run_delete(args):
+    mongo = connect_batch(args)
+    if mongo is None:
+        return 2
+    failed = 0
+    for course_number in args.course_numbers:
+        with contextlib.redirect_stdout(sys.stderr):
+            status, course = mongo.delete_course(course_number)
+        if status == "deleted":
+            print(f"Deleted: {format_document(course)}")
+            continue
+        failed += 1
+        if status == "not_found":
+            print(f"No course found with number: {course_number}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Course Manager. Runs the interactive menu when no command is given.")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+
+    # options shared by several commands
+    connection = argparse.ArgumentParser(add_help=False)
+    connection.add_argument("--credentials",
+                            default=os.getenv("COURSE_MONGO_CREDENTIALS"),
+                            help="file of COURSE_MONGO_* KEY=VALUE lines, overriding the environment")
+    workers = argparse.ArgumentParser(add_help=False)
+    workers.add_argument("--workers", type=int, default=None,
+                         help="worker processes for parsing large CSV files")
+    source = argparse.ArgumentParser(add_help=False, parents=[workers])
+    source.add_argument("--csv", nargs="+", metavar="FILE",
+                        help="CSV files or glob patterns to read the course list from "
+                             "instead of MongoDB")
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument("--format", choices=("csv", "json"), default="csv",
+                        help="csv, or json for one object per line (default csv)")
+    output.add_argument("--output", "-o", default="-", help="output file (default stdout)")
+    batch = argparse.ArgumentParser(add_help=False, parents=[workers])
+    batch.add_argument("csv", nargs="+", metavar="FILE", help="CSV files or glob patterns")
+    batch.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                       help=f"courses per bulk write (default {DEFAULT_BATCH_SIZE})")
+
+    command = commands.add_parser("load", parents=[connection, batch],
+                                  help="insert the courses of CSV files into MongoDB")
+    command.set_defaults(run=run_load)
+
+    command = commands.add_parser("sync", parents=[connection, batch],
+                                  help="write only the courses of CSV files that changed to MongoDB")
+    command.add_argument("--delete-missing", action="store_true",
+                         help="also delete courses that are not in the files")
+    command.set_defaults(run=run_sync)
+
+    command = commands.add_parser("export", parents=[connection, source, output],
+                                  help="write the whole course list")
+    command.set_defaults(run=run_export)
+
+    command = commands.add_parser("find", parents=[connection, source, output],
+                                  help="look up course numbers read one per line")
+    command.add_argument("--input", "-i", default="-",
+                         help="file of course numbers (default stdin)")
+    command.add_argument("--fail-missing", action="store_true",
+                         help="exit with status 1 if any course was not found")
+    command.set_defaults(run=run_find)
+
+    command = commands.add_parser("update", parents=[connection],
+                                  help="update one course in MongoDB")
+    command.add_argument("course_number")
+    command.add_argument("--title", help="new course title")
+    command.add_argument("--prerequisites", help="new comma-separated prerequisites")
+    command.set_defaults(run=run_update)
+
+    command = commands.add_parser("delete", parents=[connection],
+                                  help="delete courses from MongoDB")
+    command.add_argument("course_numbers", nargs="+", metavar="course_number")
+    command.set_defaults(run=run_delete)
+    return parser
+
+
+def run(argv):
+    """Runs one batch command, or the interactive menu when argv names none. Returns the exit status."""
+    args = build_parser().parse_args(argv)
+    if args.command is None:
+        main()
+        return 0
+
+    try:
+        status = args.run(args)
+    except BrokenPipeError:
+        # the reader went away, e.g. piped into head, which is not an error
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    except (OSError, ValueError, PyMongoError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    if os.getenv("COURSE_TIMINGS") == "1":
+        print(registry.summary(), file=sys.stderr)
+    return status
 
 
 def main():
@@ -268,8 +889,9 @@ def main():
                 filename = "sample.csv"
                 load_courses_from_file(filename, bst)
             else:
-                filename = input("Enter the file name (including the extension): ").strip()
-                load_courses_from_file(filename, bst)
+                # several files or wildcards such as exports/*.csv can be loaded at once
+                filenames = input("Enter the file name(s) (including the extension), separated by commas: ")
+                load_courses_from_files([name.strip() for name in filenames.split(",") if name.strip()], bst)
 
         elif choice == '2':
             # Triggered if user tries to access MongoDB without being authenticated to a database first
@@ -278,7 +900,7 @@ def main():
             load_courses_from_mongodb(mongo, bst)
 
         elif choice == '3':
-            print("\nCourse List (Balanced AVL Order):")
+            print("\nCourse List:")
             bst.print_in_order()
 
         elif choice == '4':
@@ -288,7 +910,7 @@ def main():
             # Triggered if user tries to access MongoDB without being authenticated to a databse first
             if mongo is None:
                 mongo = prompt_for_user_and_pass()
-            save_courses_to_mongodb(bst, mongo)
+            save_courses_to_mongodb(bst, mongo, prompt_for_batch_size())
 
         elif choice == '6':
             # Triggered if user tries to access MongoDB without being authenticated to a databse first
@@ -302,7 +924,49 @@ def main():
                 mongo = prompt_for_user_and_pass()
             delete_mongo_course(mongo)
 
+        elif choice == '8':
+            print_course_range(bst)
+
+        elif choice == '10':
+            print_course_prefix(bst)
+
+        elif choice == '11':
+            print_course_page(bst)
+
+        elif choice == '12':
+            display_prerequisite_chain(bst)
+
+        elif choice == '13':
+            check_prerequisites(bst)
+
+        elif choice == '14':
+            print(registry.summary())
+
+        elif choice == '15':
+            path = input("Enter the snapshot file name (leave blank for courses.snap): ").strip()
+            write_snapshot(path or "courses.snap", bst)
+
+        elif choice == '16':
+            path = input("Enter the snapshot file name (leave blank for courses.snap): ").strip() or "courses.snap"
+            if os.path.exists(path):
+                load_snapshot(path, bst)
+            else:
+                print("Snapshot not found.")
+
+        elif choice == '17':
+            # Triggered if user tries to access MongoDB without being authenticated to a databse first
+            if mongo is None:
+                mongo = prompt_for_user_and_pass()
+            delete_missing = input("Also delete courses from MongoDB that are not in the course list? (y/n) ").strip() == "y"
+            sync_courses_to_mongodb(bst, mongo, prompt_for_batch_size(), delete_missing)
+
+        elif choice == '18':
+            search_courses(bst)
+
         elif choice == '9':
+            # COURSE_TIMINGS=1 prints the timing summary on the way out
+            if os.getenv("COURSE_TIMINGS") == "1":
+                print(registry.summary())
             print("Exiting program, Goodbye!")
             break
         else:
@@ -310,6 +974,6 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(run(sys.argv[1:]))
 
 
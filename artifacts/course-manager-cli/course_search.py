@@ -0,0 +1,237 @@
+# Course title search shared by the CLI and the web app
+# Keeps an inverted index of title words and a trigram index of those words for typo-tolerant matching
+import heapq
+import re
+from bisect import bisect_left
+from math import log
+
+# Words too common to narrow a search down
+STOPWORDS = frozenset(
+    ["a", "an", "and", "for", "in", "of", "on", "or", "the", "to", "with"])
+
+# Smallest trigram similarity (Dice coefficient) that counts as a typo of a word
+FUZZY_THRESHOLD = 0.5
+
+# Weights of an exact word, a word starting with the last query word, and a fuzzy match
+EXACT_WEIGHT = 1.0
+PREFIX_WEIGHT = 0.8
+FUZZY_WEIGHT = 0.6
+
+
+def tokenize(text):
+    """Splits text into lowercase words, dropping stopwords."""
+    return [
+        word for word in re.findall(r"[0-9a-z]+", text.lower())
+        if word not in STOPWORDS
+    ]
+
+
+def trigrams(word):
+    padded = f"${word}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+
+    def __init__(self):
+        # course number -> (title, frozenset of title words)
+        self.courses = {}
+        # title word -> set of course numbers whose title contains it
+        self.postings = {}
+        # trigram -> set of title words containing it
+        self.grams = {}
+        # sorted title words and course numbers for prefix matches, rebuilt after changes
+        self._words = None
+        self._numbers = None
+
+    @classmethod
+    def from_documents(cls, documents):
+        """Builds an index from course documents or Course objects."""
+        index = cls()
+        for doc in documents:
+            if isinstance(doc, dict):
+                index.set_course(doc["course_number"],
+                                 doc.get("course_title") or "")
+            else:
+                index.set_course(doc.course_number, doc.course_title)
+        return index
+
+    def __len__(self):
+        return len(self.courses)
+
+    def set_course(self, course_number, course_title):
+        """Adds a course or reindexes its new title."""
+        current = self.courses.get(course_number)
+        if current is not None and current[0] == course_title:
+            return
+        if current is None:
+            self._numbers = None
+        else:
+            self._unlink(course_number, current[1])
+
+        words = frozenset(tokenize(course_title))
+        self.courses[course_number] = (course_title, words)
+        for word in words:
+            posting = self.postings.get(word)
+            if posting is None:
+                posting = self.postings[word] = set()
+                for gram in trigrams(word):
+                    self.grams.setdefault(gram, set()).add(word)
+                self._words = None
+            posting.add(course_number)
+
+    def remove_course(self, course_number):
+        current = self.courses.pop(course_number, None)
+        if current is not None:
+            self._unlink(course_number, current[1])
+            self._numbers = None
+
+    def clear(self):
+        self.__init__()
+
+    def _unlink(self, course_number, words):
+        for word in words:
+            posting = self.postings[word]
+            posting.discard(course_number)
+            # words no longer used by any course leave the vocabulary
+            if not posting:
+                del self.postings[word]
+                for gram in trigrams(word):
+                    users = self.grams[gram]
+                    users.discard(word)
+                    if not users:
+                        del self.grams[gram]
+                self._words = None
+
+    def _prefixed(self, sorted_values, prefix):
+        start = bisect_left(sorted_values, prefix)
+        for value in sorted_values[start:start + 50]:
+            if not value.startswith(prefix):
+                return
+            yield value
+
+    def _word_matches(self, term, last):
+        """Returns (title word, weight) pairs that a query word matches."""
+        if term in self.postings:
+            matches = [(term, EXACT_WEIGHT)]
+        else:
+            matches = []
+
+        # the last word may still be being typed, so words it starts also count
+        if last:
+            if self._words is None:
+                self._words = sorted(self.postings)
+            matches.extend((word, PREFIX_WEIGHT)
+                           for word in self._prefixed(self._words, term)
+                           if word != term)
+
+        if not matches:
+            query_grams = trigrams(term)
+            shared = {}
+            for gram in query_grams:
+                for word in self.grams.get(gram, ()):
+                    shared[word] = shared.get(word, 0) + 1
+            for word, count in shared.items():
+                similarity = 2 * count / (len(query_grams) +
+                                          len(trigrams(word)))
+                if similarity >= FUZZY_THRESHOLD:
+                    matches.append((word, FUZZY_WEIGHT * similarity))
+        return matches
+
+    def search(self, query, limit=10):
+        """Returns up to limit (course number, title, score) tuples, best match first.
+
+        Courses matching every query word are preferred. When no course does, courses
+        matching any of them are ranked instead. Course numbers can be searched as well.
+        """
+        query = query.strip()
+        if not query or limit <= 0:
+            return []
+
+        terms = tokenize(query)
+        term_matches = [
+            self._word_matches(term, i == len(terms) - 1)
+            for i, term in enumerate(terms)
+        ]
+        blocks = self._score_blocks([m for m in term_matches if m])
+
+        # Every course of a block has the same score, so whole blocks are ranked instead of
+        # courses and only the best block's first courses are ever sorted
+        if self._numbers is None:
+            self._numbers = sorted(self.courses)
+        best = []
+        for score, members in sorted(blocks, key=lambda block: -block[0]):
+            if len(best) >= limit:
+                break
+            best.extend((number, score)
+                        for number in self._first(members, limit - len(best)))
+
+        # a query that names course numbers, e.g. CS1, matches them directly
+        number_query = query.upper()
+        scores = dict(best)
+        for number in self._prefixed(self._numbers, number_query):
+            title_score = next(
+                (score for score, members in blocks if number in members), 0.0)
+            scores[number] = title_score + (2.0 if number == number_query else 1.5)
+
+        ranked = heapq.nsmallest(limit,
+                                 scores.items(),
+                                 key=lambda item: (-item[1], item[0]))
+        return [(number, self.courses[number][0], round(score, 4))
+                for number, score in ranked]
+
+    def _first(self, members, count):
+        """Returns the count smallest course numbers of a set."""
+        # a large share of the catalog is quicker to find by walking the sorted numbers
+        if len(members) * 20 < len(self._numbers):
+            return heapq.nsmallest(count, members)
+        first = []
+        for number in self._numbers:
+            if number in members:
+                first.append(number)
+                if len(first) == count:
+                    break
+        return first
+
+    def _score_blocks(self, term_matches):
+        """Groups the matching courses into (score, set of course numbers) blocks.
+
+        Works with set operations only: each query word splits the blocks by which of its
+        matched title words a course has, so scoring never loops over single courses.
+        """
+        if not term_matches:
+            return []
+
+        total = len(self.courses)
+        term_sets = [
+            self.postings[matches[0][0]] if len(matches) == 1 else set().union(
+                *(self.postings[word] for word, _ in matches))
+            for matches in term_matches
+        ]
+        candidates = set.intersection(*sorted(term_sets, key=len))
+        if not candidates:
+            candidates = set.union(*term_sets)
+
+        blocks = [(0.0, candidates)]
+        for matches in term_matches:
+            # rarer words say more about a course, so they weigh more
+            weighted = sorted(
+                ((weight * log(1 + total / len(self.postings[word])), word)
+                 for word, weight in matches),
+                reverse=True)
+            split = []
+            for score, members in blocks:
+                for weight, word in weighted:
+                    if not members:
+                        break
+                    hit = members & self.postings[word]
+                    if len(hit) == len(members):
+                        split.append((score + weight, members))
+                        members = None
+                    elif hit:
+                        split.append((score + weight, hit))
+                        members = members - hit
+                if members:
+                    split.append((score, members))
+            blocks = split
+        return blocks
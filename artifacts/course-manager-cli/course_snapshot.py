@@ -0,0 +1,270 @@
+# Binary snapshots of the course catalog that are memory-mapped instead of parsed on startup
+#
+# Layout (little-endian, every section 4-byte aligned):
+#   header        magic, format version, course count, string count, prerequisite count,
+#                 length of the metadata JSON
+#   metadata      JSON describing the source the snapshot was taken from
+#   string index  string count + 1 offsets into the string data
+#   courses       one (number id, title id, first prerequisite, prerequisite count) record
+#                 per course, sorted by course number
+#   prerequisites string ids of every course's prerequisites, course by course
+#   string data   UTF-8 text of every distinct string, stored once
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from mongo_crud import COLLECTION_VERSIONS
+from storage_backends import keyed_collection
+
+MAGIC = b"CRSSNAP\0"
+VERSION = 1
+HEADER = struct.Struct("<8sIIIII")
+# Fields of one course record
+RECORD_FIELDS = 4
+
+
+def file_fingerprint(path):
+    """Describes a source file by size, modification time and content hash."""
+    stat = os.stat(path)
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return {
+        "kind": "file",
+        "path": os.path.abspath(path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": digest.hexdigest()
+    }
+
+
+def collection_fingerprint(collection, full=False):
+    """Describes the current contents of a course collection.
+
+    By default this is the collection's stored write count (see mongo_crud.COLLECTION_VERSIONS)
+    and its document count, two small reads. Writes that bypass the course managers don't
+    count, so full=True hashes the contents instead, with the server's dbHash command when it
+    is available and by reading every course otherwise.
+    """
+    fingerprint = {
+        "kind": "collection",
+        "database": collection.database.name,
+        "collection": collection.name
+    }
+    if not full:
+        version = keyed_collection(collection.database, COLLECTION_VERSIONS).find_one(
+            {"_id": collection.name}, {"_id": 0, "epoch": 1, "count": 1})
+        fingerprint["version"] = f"{version['epoch']}.{version['count']}" if version else None
+        fingerprint["count"] = collection.estimated_document_count()
+        return fingerprint
+
+    try:
+        result = collection.database.command("dbHash",
+                                             collections=[collection.name])
+        digest = result["collections"][collection.name]
+    except Exception:
+        hasher = hashlib.sha256()
+        documents = collection.find({}, {
+            "_id": 0,
+            "course_number": 1,
+            "course_title": 1,
+            "prerequisites": 1
+        }).sort("course_number", 1)
+        for doc in documents:
+            hasher.update(
+                json.dumps([
+                    doc.get("course_number"),
+                    doc.get("course_title"),
+                    doc.get("prerequisites", [])
+                ]).encode("utf-8"))
+        digest = hasher.hexdigest()
+    fingerprint["hash"] = digest
+    return fingerprint
+
+
+def source_matches(saved, path=None, collection=None, full=False):
+    """Checks a snapshot's recorded source against the file or collection it came from.
+
+    full is passed on to collection_fingerprint().
+    """
+    if not saved:
+        return False
+
+    if saved.get("kind") == "file" and path is not None:
+        if not os.path.exists(path):
+            return False
+        stat = os.stat(path)
+        if stat.st_size != saved.get("size"):
+            return False
+        # an untouched file is trusted without reading it, a touched one is hashed
+        if stat.st_mtime_ns == saved.get("mtime_ns"):
+            return True
+        return file_fingerprint(path)["sha256"] == saved.get("sha256")
+
+    if saved.get("kind") == "collection" and collection is not None:
+        return collection_fingerprint(collection, full) == saved
+
+    return False
+
+
+def to_little_endian(values):
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def save_snapshot(path, courses, source=None):
+    """Writes courses, sorted by course number, to a snapshot file at path.
+
+    courses are objects with course_number, course_title and prerequisites, such as the
+    Course objects of CourseBST.in_order(). Returns the number of courses written.
+    """
+    strings = {}
+    offsets = array("I", [0])
+    blob = bytearray()
+
+    def intern(text):
+        string_id = strings.get(text)
+        if string_id is None:
+            string_id = strings[text] = len(strings)
+            blob.extend(text.encode("utf-8"))
+            offsets.append(len(blob))
+        return string_id
+
+    records = array("I")
+    prerequisites = array("I")
+    last = None
+    for course in courses:
+        if last is not None and course.course_number <= last:
+            raise ValueError("Courses must be sorted by course number")
+        last = course.course_number
+        records.extend((intern(course.course_number),
+                        intern(course.course_title), len(prerequisites),
+                        len(course.prerequisites)))
+        prerequisites.extend(intern(prereq) for prereq in course.prerequisites)
+
+    metadata = json.dumps({"source": source}).encode("utf-8")
+    metadata += b" " * (-len(metadata) % 4)
+
+    # writes next to the target and swaps it in, so readers never see half a snapshot
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(
+            HEADER.pack(MAGIC, VERSION,
+                        len(records) // RECORD_FIELDS, len(strings),
+                        len(prerequisites), len(metadata)))
+        f.write(metadata)
+        to_little_endian(offsets).tofile(f)
+        to_little_endian(records).tofile(f)
+        to_little_endian(prerequisites).tofile(f)
+        f.write(blob)
+    os.replace(temp_path, path)
+    return len(records) // RECORD_FIELDS
+
+
+class Snapshot:
+    """Read-only view of a snapshot file.
+
+    The file is memory-mapped and nothing is decoded up front: lookups binary search the
+    sorted course records and only decode the strings they touch.
+    """
+
+    def __init__(self, path, course_class):
+        self.path = path
+        self.course_class = course_class
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            (magic, version, self.count, string_count, prereq_count,
+             metadata_size) = HEADER.unpack_from(self.map, 0)
+        except struct.error:
+            self.map.close()
+            raise ValueError(f"{path} is not a course snapshot")
+        if magic != MAGIC or version != VERSION:
+            self.map.close()
+            raise ValueError(f"{path} is not a version {VERSION} course snapshot")
+
+        position = HEADER.size
+        self.metadata = json.loads(
+            self.map[position:position + metadata_size].decode("utf-8"))
+        position += metadata_size
+
+        self.offsets = self._array(position, string_count + 1)
+        position += (string_count + 1) * 4
+        self.records = self._array(position, self.count * RECORD_FIELDS)
+        position += self.count * RECORD_FIELDS * 4
+        self.prerequisites = self._array(position, prereq_count)
+        position += prereq_count * 4
+        self.strings_start = position
+
+    def _array(self, position, length):
+        view = memoryview(self.map)[position:position + length * 4]
+        if sys.byteorder == "little":
+            return view.cast("I")
+        # big-endian machines copy the section and swap it instead of mapping it
+        values = array("I")
+        values.frombytes(view)
+        values.byteswap()
+        return values
+
+    @property
+    def source(self):
+        return self.metadata.get("source")
+
+    def close(self):
+        """Releases the memory map. Views handed out earlier must not be used afterwards."""
+        for name in ("offsets", "records", "prerequisites"):
+            view = getattr(self, name)
+            if isinstance(view, memoryview):
+                view.release()
+        self.map.close()
+
+    def string(self, string_id):
+        start = self.strings_start + self.offsets[string_id]
+        end = self.strings_start + self.offsets[string_id + 1]
+        return self.map[start:end].decode("utf-8")
+
+    def course_number(self, index):
+        return self.string(self.records[index * RECORD_FIELDS])
+
+    def course(self, index):
+        """Builds the course at position index in course number order."""
+        base = index * RECORD_FIELDS
+        first = self.records[base + 2]
+        prerequisites = [
+            self.string(string_id) for string_id in
+            self.prerequisites[first:first + self.records[base + 3]]
+        ]
+        return self.course_class(self.string(self.records[base]),
+                                 self.string(self.records[base + 1]),
+                                 prerequisites)
+
+    def __len__(self):
+        return self.count
+
+    def bisect(self, course_number):
+        """Returns the position of the first course number >= course_number."""
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if self.course_number(mid) < course_number:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def find(self, course_number):
+        index = self.bisect(course_number)
+        if index < self.count and self.course_number(index) == course_number:
+            return self.course(index)
+        return None
+
+    def iter_from(self, index=0):
+        """Yields courses in course number order starting at position index."""
+        for position in range(index, self.count):
+            yield self.course(position)
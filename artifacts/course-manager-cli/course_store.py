@@ -0,0 +1,134 @@
+# Compact in-memory course catalog
+# Course numbers and prerequisite codes are interned once and referred to by integer ids,
+# titles share one UTF-8 buffer and every per-course field is a column in a flat array, so a
+# course costs a few dozen bytes instead of a Course object, a list and a tree node
+import heapq
+from array import array
+
+# Slot of a code that is only used as a prerequisite
+NO_COURSE = -1
+
+
+class CourseStore:
+    """Append-only store of courses, read through the same methods as a Snapshot.
+
+    Courses live in slots numbered in the order they were added. Positions passed to
+    course() and iter_from() and returned by bisect() are in course number order instead,
+    which is worked out from the slots the first time an ordered read follows new courses.
+    Course objects are only built when a read hands one out.
+    """
+
+    def __init__(self, course_class):
+        self.course_class = course_class
+        # code id -> course number or prerequisite code, and back
+        self.codes = []
+        self.code_ids = {}
+        # code id -> slot of the course with that number, or NO_COURSE
+        self.slots = array("i")
+        # slot -> code id of the course number
+        self.numbers = array("I")
+        # slot -> end of the title in titles, starting with a 0 so slot s spans [s, s + 1]
+        self.title_offsets = array("Q", [0])
+        self.titles = bytearray()
+        # slot -> end of the course's prerequisite code ids in prerequisites, same layout
+        self.prereq_offsets = array("Q", [0])
+        self.prerequisites = array("I")
+        # slots in course number order, courses added since the last ordered read are missing
+        self.order = array("I")
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def intern(self, code):
+        """Returns the id of a course code, adding it if it is new."""
+        code_id = self.code_ids.get(code)
+        if code_id is None:
+            code_id = self.code_ids[code] = len(self.codes)
+            self.codes.append(code)
+            self.slots.append(NO_COURSE)
+        return code_id
+
+    def add(self, course_number, course_title, prerequisites):
+        """Stores a course. Returns False if a course with that number is already stored."""
+        code_id = self.intern(course_number)
+        if self.slots[code_id] != NO_COURSE:
+            return False
+        self.slots[code_id] = len(self.numbers)
+        self.numbers.append(code_id)
+        self.titles += course_title.encode("utf-8")
+        self.title_offsets.append(len(self.titles))
+        self.prerequisites.extend(self.intern(prereq) for prereq in prerequisites)
+        self.prereq_offsets.append(len(self.prerequisites))
+        return True
+
+    def course_number(self, slot):
+        return self.codes[self.numbers[slot]]
+
+    def _course(self, slot):
+        first = self.prereq_offsets[slot]
+        last = self.prereq_offsets[slot + 1]
+        title = self.titles[self.title_offsets[slot]:self.title_offsets[slot + 1]]
+        return self.course_class(
+            self.codes[self.numbers[slot]], title.decode("utf-8"),
+            [self.codes[code_id] for code_id in self.prerequisites[first:last]])
+
+    def _courses(self, slots):
+        """Builds the courses in the given slots, one at a time."""
+        # the same as _course() with everything bound to locals, every ordered read runs this loop
+        course_class = self.course_class
+        code = self.codes.__getitem__
+        numbers = self.numbers
+        titles = self.titles
+        title_offsets = self.title_offsets
+        prerequisites = self.prerequisites
+        prereq_offsets = self.prereq_offsets
+        for slot in slots:
+            first = prereq_offsets[slot]
+            last = prereq_offsets[slot + 1]
+            yield course_class(
+                code(numbers[slot]),
+                titles[title_offsets[slot]:title_offsets[slot + 1]].decode("utf-8"),
+                list(map(code, prerequisites[first:last])) if first != last else [])
+
+    def sorted_slots(self):
+        """Returns the slots in course number order, sorting in the courses added since last time."""
+        order = self.order
+        if len(order) < len(self.numbers):
+            key = self.course_number
+            # Timsort is linear when courses were added in order, as sorted files and cursors are
+            added = sorted(range(len(order), len(self.numbers)), key=key)
+            if not order or key(order[-1]) < key(added[0]):
+                order.extend(added)
+            else:
+                self.order = order = array("I", heapq.merge(order, added, key=key))
+        return order
+
+    def course(self, index):
+        """Builds the course at position index in course number order."""
+        return self._course(self.sorted_slots()[index])
+
+    def bisect(self, course_number):
+        """Returns the position of the first course number >= course_number."""
+        order = self.sorted_slots()
+        codes = self.codes
+        numbers = self.numbers
+        low, high = 0, len(order)
+        while low < high:
+            mid = (low + high) // 2
+            if codes[numbers[order[mid]]] < course_number:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def find(self, course_number):
+        code_id = self.code_ids.get(course_number)
+        if code_id is None or self.slots[code_id] == NO_COURSE:
+            return None
+        return self._course(self.slots[code_id])
+
+    def iter_from(self, index=0):
+        """Yields courses in course number order starting at position index."""
+        # reads the order in place from index on, a slice would copy the rest of it per page
+        order = self.sorted_slots()
+        return self._courses(map(order.__getitem__, range(index, len(order))))
@@ -0,0 +1,172 @@
+# Parallel CSV loading for large course catalogs
+# Files are memory-mapped, cut into chunks that end on a row boundary and parsed by a pool of
+# worker processes, each of which maps the file itself so no file data is copied between them
+import csv
+import gc
+import glob
+import heapq
+import io
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+# Bytes of CSV parsed by each worker task
+CHUNK_BYTES = int(os.getenv("COURSE_LOAD_CHUNK_BYTES", 16 * 1024 * 1024))
+# Loads smaller than this are parsed in this process, a pool would only add startup time
+PARALLEL_MIN_BYTES = int(os.getenv("COURSE_LOAD_PARALLEL_BYTES", 8 * 1024 * 1024))
+# Number of worker processes, defaults to one per core
+LOAD_WORKERS = int(os.getenv("COURSE_LOAD_WORKERS", os.cpu_count() or 1))
+
+
+class CourseDialect(csv.excel):
+    """Comma separated, double-quoted fields, spaces after a comma ignored."""
+    skipinitialspace = True
+
+
+@contextmanager
+def gc_paused():
+    """Turns off the cyclic garbage collector while a load creates millions of objects.
+
+    Parsed rows never form reference cycles, but every allocation still counts towards the
+    next collection, which would otherwise walk the growing row list again and again.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def expand_paths(patterns):
+    """Expands file names and glob patterns into a list of files, keeping their order.
+
+    A pattern that matches nothing is kept as is, so opening it reports the missing file.
+    """
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else []
+        for path in matches or [pattern]:
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def _scan_quotes(data, start, end):
+    """Returns the number of double quotes in data[start:end], reading 1 MiB at a time."""
+    count = 0
+    for position in range(start, end, 1024 * 1024):
+        count += data[position:min(end, position + 1024 * 1024)].count(b'"')
+    return count
+
+
+def chunk_ranges(data, chunk_bytes=CHUNK_BYTES):
+    """Splits a mapped CSV file into (start, end) byte ranges that each end on a row boundary.
+
+    A newline only ends a row outside a quoted field, which is when an even number of
+    quotes came before it, so files with quotes are checked as the boundaries are placed.
+    """
+    size = len(data)
+    quoted = data.find(b'"') != -1
+    ranges = []
+    start = 0
+    while start < size:
+        end = start + chunk_bytes
+        quotes = 0
+        scanned = start
+        while end < size:
+            end = data.find(b"\n", end)
+            if end == -1:
+                end = size
+                break
+            end += 1
+            if not quoted:
+                break
+            quotes += _scan_quotes(data, scanned, end)
+            scanned = end
+            if quotes % 2 == 0:
+                break
+        end = min(end, size)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def parse_rows(text):
+    """Parses CSV text into (course number, title, prerequisites) rows, sorted by course number.
+
+    Returns the rows and the number of rows rejected for having no title.
+    """
+    rows = []
+    rejected = 0
+    # the dialect already drops spaces after commas, so fields only need stripping when
+    # something else could pad them
+    padded = " ," in text or " \n" in text or " \r" in text or "\t" in text or text.endswith(" ")
+    for fields in csv.reader(io.StringIO(text, newline=""), CourseDialect):
+        if padded:
+            fields = [field.strip() for field in fields]
+        if len(fields) < 2 or not fields[0] or not fields[1]:
+            if any(fields):
+                rejected += 1
+            continue
+        prerequisites = fields[2:]
+        if "" in prerequisites:
+            prerequisites = [prereq for prereq in prerequisites if prereq]
+        rows.append((fields[0], fields[1], prerequisites))
+    # stable, so a course number repeated in the file keeps its first row first
+    rows.sort(key=lambda row: row[0])
+    return rows, rejected
+
+
+def parse_chunk(path, start, end):
+    """Parses one byte range of a CSV file. Runs in the worker processes."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0,
+                                          access=mmap.ACCESS_READ) as data:
+        encoding = "utf-8-sig" if start == 0 else "utf-8"
+        with gc_paused():
+            return parse_rows(data[start:end].decode(encoding))
+
+
+def plan_chunks(paths, chunk_bytes=CHUNK_BYTES):
+    """Returns the (path, start, end) chunks of every file and their total size in bytes."""
+    chunks = []
+    total = 0
+    for path in paths:
+        size = os.path.getsize(path)
+        total += size
+        # empty files can't be mapped and hold no courses anyway
+        if size == 0:
+            continue
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0,
+                                              access=mmap.ACCESS_READ) as data:
+            chunks.extend((path, start, end)
+                          for start, end in chunk_ranges(data, chunk_bytes))
+    return chunks, total
+
+
+def load_rows(paths, workers=None, chunk_bytes=CHUNK_BYTES):
+    """Parses CSV files into (course number, title, prerequisites) rows.
+
+    Returns the rows merged into course number order and the number of rejected rows. When
+    a course number appears more than once, the row from the earliest file and line comes
+    first. Raises FileNotFoundError if a file is missing.
+    """
+    workers = LOAD_WORKERS if workers is None else workers
+    chunks, total = plan_chunks(paths, chunk_bytes)
+
+    with gc_paused():
+        if workers > 1 and len(chunks) > 1 and total >= PARALLEL_MIN_BYTES:
+            with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+                results = list(pool.map(parse_chunk, *zip(*chunks)))
+        else:
+            results = [parse_chunk(*chunk) for chunk in chunks]
+
+        rejected = sum(count for _, count in results)
+        if len(results) == 1:
+            return results[0][0], rejected
+        # every chunk is already sorted, and merge() keeps equal keys in chunk order
+        rows = list(heapq.merge(*(rows for rows, _ in results),
+                                key=lambda row: row[0]))
+    return rows, rejected
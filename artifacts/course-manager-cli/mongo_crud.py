@@ -1,11 +1,60 @@
-from pymongo import MongoClient
+import hashlib
+import time
+import uuid
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from storage_backends import get_backend, keyed_collection, open_collection
+from metrics import command_timer, record_error, timed
+from itertools import islice
+from urllib.parse import quote_plus
+
+def content_hash(course_number, course_title, prerequisites):
+    """Short hash of a course's fields, stored with each course so syncs can skip unchanged ones."""
+    # the unit separator can't appear in a CSV field, so different courses can't join the same way
+    text = "\x1f".join([course_number, course_title, *prerequisites])
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+# Field counting the edits made to a course, shared with the web app's optimistic edits
+VERSION_FIELD = "version"
+
+
+def edit_update(changes):
+    """Returns the update that sets changes on a course and counts the edit."""
+    # the stored content hash no longer matches, so it is dropped and the next sync rewrites the course
+    return {"$set": changes, "$inc": {VERSION_FIELD: 1}, "$unset": {"content_hash": ""}}
+
+# Collection counting the writes made to each course collection, shared with the web app.
+# Its documents are keyed by _id, holding the collection name.
+COLLECTION_VERSIONS = "collection_versions"
+
+
+def bump_collection_version(collection):
+    """Counts a write to collection in its stored version, which tells snapshots it changed."""
+    # the epoch is new whenever the version document is, so a restarted count never repeats
+    keyed_collection(collection.database, COLLECTION_VERSIONS).update_one(
+        {"_id": collection.name},
+        {"$inc": {"count": 1}, "$set": {"modified": time.time()},
+         "$setOnInsert": {"epoch": uuid.uuid4().hex[:8]}},
+        upsert=True)
+
 
 class CRUD:
-    def __init__(self, username, password, db_name, collection_name, host="localhost", port=27017):
+    def __init__(self, username, password, db_name, collection_name, host="localhost", port=27017, backend=None):
         try:
-          # attempts to connect to MongoDB server
-          uri = f"mongodb://{username}:{password}@{host}:{port}/{db_name}"
-          self.client = MongoClient(uri)
+          # uses the in-memory or SQLite backend instead of MongoDB when one is selected
+          self.backend = get_backend(backend)
+          if self.backend != "mongo":
+            self.client = None
+            self.collection = open_collection(self.backend, db_name, collection_name)
+            self.db = self.collection.database
+            return
+          # attempts to connect to MongoDB server, without authenticating when no username is given
+          if username:
+            uri = f"mongodb://{quote_plus(username)}:{quote_plus(password or '')}@{host}:{port}/{db_name}"
+          else:
+            uri = f"mongodb://{host}:{port}/{db_name}"
+          # times every command the client sends for the timing summary
+          self.client = MongoClient(uri, event_listeners=[command_timer])
           # selects the database
           self.db = self.client[db_name]
           # selects the collection
@@ -14,20 +63,94 @@ class CRUD:
           self.collection.create_index("course_number", unique=True)
         except Exception as e:
             print(f"Error connecting to MongoDB: {e}")
+            # a failed connection has no usable collection, callers check for None
+            if getattr(self, "client", None) is not None:
+                self.client.close()
             self.client = None
+            self.collection = None
 
+    @timed("create")
     def create(self, document):
         """Insert a document into the collection."""
         try:
             # inserts document into collection
             result = self.collection.insert_one(document)
+            self.bump_version()
             # verifies the inserted ID to check if insertion was successful
             return result.inserted_id is not None
         # returns false if insertion is unsuccessful
         except Exception as e:
-            print(f"Couldn't insert: {e}")
+            record_error("create", e, f"Couldn't insert: {e}")
             return False
 
+    @timed("bulk_create")
+    def bulk_create(self, documents, batch_size=500):
+        """Insert documents in unordered batches, skipping existing course numbers."""
+        stats = []
+        batch = []
+        for doc in documents:
+          # $setOnInsert only writes the document if the course number is new
+          batch.append(UpdateOne({"course_number": doc["course_number"]},
+                                 {"$setOnInsert": doc}, upsert=True))
+          # sends the batch once it is full
+          if len(batch) >= batch_size:
+            stats.append(self._write_batch(batch))
+            batch = []
+
+        # sends whatever is left over
+        if batch:
+          stats.append(self._write_batch(batch))
+        if any(batch_stats["inserted"] for batch_stats in stats):
+          self.bump_version()
+        # returns the inserted, skipped and rejected counts of every batch
+        return stats
+
+    def _write_batch(self, operations):
+        """Writes one batch with a single bulk_write."""
+        try:
+          result = self.collection.bulk_write(operations, ordered=False)
+          inserted = result.upserted_count
+          rejected = 0
+        # unordered batches keep going after an error so the rest still counts
+        except BulkWriteError as e:
+          inserted = e.details.get("nUpserted", 0)
+          rejected = len(e.details.get("writeErrors", []))
+        except Exception as e:
+            record_error("bulk_create", e, f"Couldn't write batch: {e}")
+            inserted = 0
+            rejected = len(operations)
+
+        return {"inserted": inserted,
+                "skipped": len(operations) - inserted - rejected,
+                "rejected": rejected}
+
+    @timed("write_changes")
+    def write_changes(self, operations, batch_size=500):
+        """Sends write operations in unordered batches and counts what they did."""
+        counts = {"inserted": 0, "updated": 0, "deleted": 0, "failed": 0}
+        operations = iter(operations)
+        while True:
+          batch = list(islice(operations, batch_size))
+          if not batch:
+            if counts["inserted"] or counts["updated"] or counts["deleted"]:
+              self.bump_version()
+            return counts
+          try:
+            result = self.collection.bulk_write(batch, ordered=False)
+            counts["inserted"] += result.inserted_count + result.upserted_count
+            counts["updated"] += result.modified_count
+            counts["deleted"] += result.deleted_count
+          # unordered batches keep going after an error so the rest still counts
+          except BulkWriteError as e:
+            counts["inserted"] += e.details.get("nInserted", 0) + e.details.get("nUpserted", 0)
+            counts["updated"] += e.details.get("nModified", 0)
+            counts["deleted"] += e.details.get("nRemoved", 0)
+            counts["failed"] += len(e.details.get("writeErrors", []))
+          except Exception as e:
+            record_error("write_changes", e, f"Couldn't write changes: {e}")
+            counts["failed"] += len(batch)
+
+    @timed("read")
     def read(self, query):
         """Find documents that match a given query."""
         try:
@@ -35,32 +158,82 @@ class CRUD:
           return list(self.collection.find(query))
         # returns an empty list if read fails
         except Exception as e:
-            print(f"Error reading documents: {e}")
+            record_error("read", e, f"Error reading documents: {e}")
             return ["hi"]
     
+    @timed("update")
     def update(self, query, new_data):
         """Update documents in the collection."""
         try:
           # updates the selected document with new data
-          result = self.collection.update_many(query, {"$set": new_data})
+          result = self.collection.update_many(query, edit_update(new_data))
+          if result.modified_count:
+            self.bump_version()
           # returns the number of updated documents
           return result.modified_count
         except Exception as e:
-            print(f"Error updating documents: {e}")
+            record_error("update", e, f"Error updating documents: {e}")
             return 0
 
+    @timed("update_course")
+    def update_course(self, course_number, changes):
+        """Updates one course in a single round trip.
+
+        Returns ("updated", course) with the updated course, ("not_found", None) or ("error", None).
+        """
+        try:
+          course = self.collection.find_one_and_update({"course_number": course_number},
+                                                       edit_update(changes),
+                                                       {"_id": 0},
+                                                       return_document=ReturnDocument.AFTER)
+        except Exception as e:
+            record_error("update_course", e, f"Error updating course: {e}")
+            return "error", None
+        if course is None:
+            return "not_found", None
+        self.bump_version()
+        return "updated", course
+
+    @timed("delete_course")
+    def delete_course(self, course_number):
+        """Deletes one course in a single round trip.
+
+        Returns ("deleted", course) with the removed course, ("not_found", None) or ("error", None).
+        """
+        try:
+          course = self.collection.find_one_and_delete({"course_number": course_number}, {"_id": 0})
+        except Exception as e:
+            record_error("delete_course", e, f"Error deleting course: {e}")
+            return "error", None
+        if course is None:
+            return "not_found", None
+        self.bump_version()
+        return "deleted", course
+
+    @timed("delete")
     def delete(self, query):
         """Delete documents that match a given query."""
         try:
           # deletes the documents that match the search
           result = self.collection.delete_many(query)
+          if result.deleted_count:
+            self.bump_version()
           # returns deleted documents count
           return result.deleted_count
         except Exception as e:
-           print(f"Error deleting documents: {e}")
+           record_error("delete", e, f"Error deleting documents: {e}")
            return 0
         
+    @timed("delete_all")
     def delete_all(self):
       """Deletes all documents in the current collection."""
       result = self.collection.delete_many({})
-      print(f"Deleted {result.deleted_count} existing document(s) from MongoDB.")
\ No newline at end of file
+      self.bump_version()
+      print(f"Deleted {result.deleted_count} existing document(s) from MongoDB.")
+
+    def bump_version(self):
+        """Counts a write in the collection's stored version, so snapshots taken before it go stale."""
+        try:
+          bump_collection_version(self.collection)
+        except Exception as e:
+            record_error("bump_version", e, f"Couldn't record the write: {e}")
\ No newline at end of file
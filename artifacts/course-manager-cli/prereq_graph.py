@@ -0,0 +1,206 @@
+# Prerequisite graph shared by the CLI and the web app
+# Keeps every course's prerequisites as edges and memoizes the answers that need a walk of the graph
+
+
+class PrereqGraph:
+
+    def __init__(self, courses=None):
+        # course number -> tuple of prerequisite course numbers
+        self.prereqs = {}
+        # course number -> set of courses that list it as a prerequisite
+        self.dependents = {}
+        # missing course number -> set of courses that still reference it
+        self.missing = {}
+        # course number -> frozenset of all its transitive prerequisites
+        self._closure = {}
+        # whole-catalog answers that are thrown away on any change
+        self._cycles = None
+        self._order = None
+
+        for course_number, prerequisites in courses or []:
+            self.set_course(course_number, prerequisites)
+
+    @classmethod
+    def from_documents(cls, documents):
+        """Builds a graph from course documents or Course objects."""
+        graph = cls()
+        for doc in documents:
+            if isinstance(doc, dict):
+                graph.set_course(doc["course_number"],
+                                 doc.get("prerequisites") or [])
+            else:
+                graph.set_course(doc.course_number, doc.prerequisites)
+        return graph
+
+    def has_course(self, course_number):
+        return course_number in self.prereqs
+
+    def set_course(self, course_number, prerequisites):
+        """Adds a course or replaces its prerequisites."""
+        prerequisites = tuple(p for p in dict.fromkeys(prerequisites) if p)
+        is_new = course_number not in self.prereqs
+        if not is_new and self.prereqs[course_number] == prerequisites:
+            return
+
+        self._invalidate(course_number)
+        if not is_new:
+            self._unlink(course_number)
+
+        self.prereqs[course_number] = prerequisites
+        for prereq in prerequisites:
+            self.dependents.setdefault(prereq, set()).add(course_number)
+            if prereq not in self.prereqs:
+                self.missing.setdefault(prereq, set()).add(course_number)
+
+        # a course that used to be referenced while missing is no longer dangling
+        if is_new:
+            self.missing.pop(course_number, None)
+
+    def remove_course(self, course_number):
+        """Removes a course, leaving references to it as dangling."""
+        if course_number not in self.prereqs:
+            return
+
+        self._invalidate(course_number)
+        self._unlink(course_number)
+        del self.prereqs[course_number]
+
+        referenced_by = self.dependents.get(course_number)
+        if referenced_by:
+            self.missing[course_number] = set(referenced_by)
+
+    def clear(self):
+        """Removes every course."""
+        self.__init__()
+
+    def _unlink(self, course_number):
+        """Drops the edges from a course to its current prerequisites."""
+        for prereq in self.prereqs[course_number]:
+            users = self.dependents.get(prereq)
+            if users:
+                users.discard(course_number)
+                if not users:
+                    del self.dependents[prereq]
+            users = self.missing.get(prereq)
+            if users:
+                users.discard(course_number)
+                if not users:
+                    del self.missing[prereq]
+
+    def _invalidate(self, course_number):
+        """Forgets memoized closures of the course and every course that depends on it."""
+        self._cycles = None
+        self._order = None
+
+        stack = [course_number]
+        seen = set()
+        while stack:
+            current = stack.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            self._closure.pop(current, None)
+            stack.extend(self.dependents.get(current, ()))
+
+    def all_prerequisites(self, course_number):
+        """Returns every course that has to be taken before course_number."""
+        cached = self._closure.get(course_number)
+        if cached is not None:
+            return cached
+
+        # Walks the graph, reusing any closure that was already worked out
+        seen = set()
+        stack = list(self.prereqs.get(course_number, ()))
+        while stack:
+            current = stack.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            known = self._closure.get(current)
+            if known is not None:
+                seen |= known
+            else:
+                stack.extend(self.prereqs.get(current, ()))
+
+        # a course in a cycle reaches itself, but it is not its own prerequisite
+        seen.discard(course_number)
+        closure = frozenset(seen)
+        self._closure[course_number] = closure
+        return closure
+
+    def study_order(self, course_number=None):
+        """Returns courses in an order where every prerequisite comes first.
+
+        With a course number only that course and its prerequisites are ordered,
+        otherwise the whole catalog is. Courses caught in a cycle are left out,
+        see find_cycles().
+        """
+        if course_number is None:
+            if self._order is None:
+                self._order = self._topological_order(self.prereqs)
+            return list(self._order)
+
+        wanted = set(self.all_prerequisites(course_number))
+        wanted.add(course_number)
+        return self._topological_order(wanted)
+
+    def _topological_order(self, wanted):
+        """Kahn's algorithm over the wanted courses, sorted for a stable order."""
+        remaining = {}
+        for course in wanted:
+            remaining[course] = sum(1 for p in self.prereqs.get(course, ())
+                                    if p in wanted)
+
+        ready = sorted((c for c, count in remaining.items() if count == 0),
+                       reverse=True)
+        order = []
+        while ready:
+            course = ready.pop()
+            order.append(course)
+            unlocked = []
+            for user in self.dependents.get(course, ()):
+                if user in remaining:
+                    remaining[user] -= 1
+                    if remaining[user] == 0:
+                        unlocked.append(user)
+            if unlocked:
+                ready.extend(unlocked)
+                ready.sort(reverse=True)
+        return order
+
+    def find_cycles(self):
+        """Returns each prerequisite cycle as a list of course numbers."""
+        if self._cycles is not None:
+            return [list(cycle) for cycle in self._cycles]
+
+        cycles = []
+        state = {}  # 1 while a course is on the walk, 2 once it is finished
+        for start in sorted(self.prereqs):
+            if start in state:
+                continue
+            state[start] = 1
+            path = [start]
+            stack = [iter(self.prereqs[start])]
+            while stack:
+                prereq = next(stack[-1], None)
+                if prereq is None:
+                    state[path.pop()] = 2
+                    stack.pop()
+                elif prereq not in self.prereqs or state.get(prereq) == 2:
+                    continue
+                elif state.get(prereq) == 1:
+                    cycles.append(path[path.index(prereq):] + [prereq])
+                else:
+                    state[prereq] = 1
+                    path.append(prereq)
+                    stack.append(iter(self.prereqs[prereq]))
+
+        self._cycles = [tuple(cycle) for cycle in cycles]
+        return cycles
+
+    def dangling_references(self):
+        """Maps each missing course number to the courses that reference it."""
+        return {
+            missing: sorted(users)
+            for missing, users in sorted(self.missing.items())
+        }
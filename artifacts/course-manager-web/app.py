@@ -1,201 +1,724 @@
 # Creates a flask front end web interface so users can operate the Course Manager program through the front end
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session, Response
+from flask import Flask, render_template, request, redirect, url_for, flash, session, Response, stream_with_context, jsonify, g
 from mongo_crud import CRUD
+from async_crud import AsyncCRUD
+from prereq_graph import PrereqGraph
+from course_search import SearchIndex
+from metrics import record_error, registry
+from upload_stream import iter_lines, open_csv_upload, read_chunks
+from import_jobs import ImportJob, ImportJobs, JobLimitError
+from tenants import TenantRegistry, is_tenant_id, new_tenant_id
+from http_cache import BodyCache, COMPRESS_MIN_BYTES, choose_encoding, compress, compress_stream, last_modified, make_etag, not_modified
+from pymongo import ASCENDING, DESCENDING
+from collections import Counter
 import csv
 import io
+from itertools import islice
+import json
 import os
+import tempfile
+import time
 from werkzeug.exceptions import RequestEntityTooLarge
 
 
+def get_tenant():
+    """Returns the tenant of the current browser session, starting a new one for a new session"""
+    tenant = g.get("tenant")
+    if tenant is None:
+        tenant_id = session.get("tenant")
+        new = not is_tenant_id(tenant_id)
+        if new:
+            tenant_id = session["tenant"] = new_tenant_id()
+        tenant = g.tenant = tenants.get(tenant_id, new=new)
+    return tenant
+
+
 def get_mongo():
-    global mongo
+    """Returns the current session's connection"""
+    return get_tenant().mongo
+
+
+def get_async_mongo():
+    """Returns an AsyncCRUD for the current connection that shares its caches"""
+    tenant = get_tenant()
+    if tenant.async_mongo is None:
+        tenant.async_mongo = AsyncCRUD.from_crud(tenant.mongo)
+    return tenant.async_mongo
+
+
+def get_graph():
+    """Returns the prerequisite graph of the current collection, building it on first use"""
+    tenant = get_tenant()
+    if tenant.graph is None:
+        documents = tenant.mongo.collection.find({}, {
+            "_id": 0,
+            "course_number": 1,
+            "prerequisites": 1
+        })
+        tenant.graph = PrereqGraph.from_documents(documents)
+    return tenant.graph
+
+
+def cached_graph():
+    """Returns the prerequisite graph only if it was already built for the current collection
+
+    Write paths use this to keep the graph in step without building it just to update it.
+    """
+    return get_tenant().graph
+
+
+def get_search_index():
+    """Returns the title search index of the current collection, building it on first use"""
+    tenant = get_tenant()
+    if tenant.search_index is None:
+        documents = tenant.mongo.collection.find({}, {
+            "_id": 0,
+            "course_number": 1,
+            "course_title": 1
+        })
+        tenant.search_index = SearchIndex.from_documents(documents)
+    return tenant.search_index
+
+
+def cached_search_index():
+    """Returns the search index only if it was already built for the current collection"""
+    return get_tenant().search_index
+
+
+def iter_course_rows(reader, max_rows=None, counts=None):
+    """Yields course documents from CSV rows as the reader produces them.
+
+    Stops after max_rows rows. Rejected rows and whether max_rows cut the file short are
+    tallied in counts.
+    """
+    if counts is None:
+        counts = {}
+    counts.setdefault("rejected", 0)
+    counts.setdefault("truncated", False)
+
+    for i, row in enumerate(reader):
+        if max_rows is not None and i >= max_rows:
+            counts["truncated"] = True
+            return
+
+        # skips blank lines and rejects rows without a course number and title
+        if not row:
+            continue
+        if len(row) < 2 or not row[0].strip():
+            counts["rejected"] += 1
+            continue
+
+        yield {
+            "course_number":
+            row[0].strip(),
+            "course_title":
+            row[1].strip(),
+            "prerequisites":
+            [p.strip() for p in row[2:]] if len(row) > 2 else []
+        }
+
+
+def parse_course_rows(reader, max_rows=None):
+    """Builds course documents from CSV rows.
+
+    Returns the documents, the number of rejected rows and whether max_rows cut the file short.
+    """
+    counts = {}
+    docs = list(iter_course_rows(reader, max_rows, counts))
+    return docs, counts["rejected"], counts["truncated"]
+
+
+def ingest_courses(docs, rejected=0, batch_size=500, source="sample"):
+    """Writes parsed courses with bulk upserts and flashes the counts of each batch"""
+    start = time.perf_counter()
+    inserted = []
+    stats = get_mongo().bulk_create(docs, batch_size, inserted)
+    record_import(source, len(docs), time.perf_counter() - start)
+    add_to_graph(inserted)
+    return report_ingest(rejected, stats)
+
+
+def spool_upload(chunks, max_rows=None):
+    """Copies the CSV rows of an upload into a spool for an import worker, up to max_rows
+
+    One row past max_rows is kept so the worker still reports the upload as truncated, and
+    the rest of the body is never read. Raises ValueError for a body that isn't CSV text.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES)
+
+    def copied(lines):
+        for line in lines:
+            spool.write(line.encode("utf-8"))
+            yield line
+
+    # csv.reader only pulls the lines of the rows it hands out
+    rows = csv.reader(copied(iter_lines(chunks)))
+    try:
+        for _ in islice(rows, None if max_rows is None else max_rows + 1):
+            pass
+    except (UnicodeDecodeError, csv.Error) as e:
+        spool.close()
+        raise ValueError(f"Could not read the CSV file: {e}")
+    spool.seek(0)
+    return spool
+
+
+def run_import(job, mongo):
+    """Parses a queued upload and writes it batch by batch, keeping the job's progress current
+
+    Runs on an import worker thread. Reading waits for each batch to be written, so only one
+    batch of parsed rows is held in memory, and cancelling stops it between batches.
+    """
+    counts = {"rejected": 0, "truncated": False}
+    docs = iter_course_rows(csv.reader(iter_lines(read_chunks(job.upload))),
+                            UPLOAD_MAX_ROWS or None, counts)
+    start = time.perf_counter()
     try:
-        if mongo is None:
-            return default_mongo
-    except Exception:
-        pass
-    return default_mongo
+        while not job.cancelled:
+            batch = list(islice(docs, UPLOAD_BATCH_SIZE))
+            if not batch:
+                break
+            stats = mongo.bulk_create(batch, UPLOAD_BATCH_SIZE)
+            job.add_batch(len(batch), stats, counts["rejected"])
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise ValueError(f"Could not read the CSV file: {e}")
+    finally:
+        job.truncated = counts["truncated"]
+        record_import("upload", job.parsed, time.perf_counter() - start)
+        drop_graph(mongo)
+
+
+def drop_graph(source):
+    """Forgets the prerequisite graph and search index of source so the next request rebuilds them
+
+    Import workers use this instead of updating them while requests may be reading them.
+    """
+    tenants.forget(source)
+
+
+def record_import(source, rows, seconds):
+    """Feeds the CSV import metrics"""
+    import_rows.inc(source, amount=rows)
+    import_latency.observe(seconds, source)
+    if seconds > 0:
+        import_rate.set(rows / seconds, source)
+
+
+def add_to_graph(docs):
+    """Adds courses bulk_create inserted to the prerequisite graph and search index if they are built"""
+    graph = cached_graph()
+    if graph is not None:
+        for doc in docs:
+            graph.set_course(doc["course_number"], doc["prerequisites"])
+    index = cached_search_index()
+    if index is not None:
+        for doc in docs:
+            index.set_course(doc["course_number"], doc["course_title"])
+
+
+def report_ingest(rejected, stats):
+    """Flashes the counts of a bulk ingest and returns the number of inserted courses"""
+    if rejected:
+        flash(f"Rejected {rejected} malformed row(s).")
+
+    # only reports per batch when the upload actually needed more than one
+    if len(stats) > 1:
+        for number, batch in enumerate(stats, start=1):
+            flash(f"Batch {number}: {batch['inserted']} inserted, "
+                  f"{batch['skipped']} duplicate(s) skipped, "
+                  f"{batch['rejected']} rejected")
+
+    skipped = sum(batch["skipped"] for batch in stats)
+    failed = sum(batch["rejected"] for batch in stats)
+    if skipped:
+        flash(f"Skipped {skipped} course(s) that already exist.")
+    if failed:
+        flash(f"MongoDB rejected {failed} course(s).")
+
+    return sum(batch["inserted"] for batch in stats)
+
+
+def conditional_get(version):
+    """Answers a GET whose body only depends on the collection, its version and the URL
+
+    Returns a 304 when the client's copy is current, the cached body when this version was
+    already built for this URL, or None when the caller has to build the body and send it
+    with send_page() or send_stream(). Must run before the collection is read, so a write
+    made meanwhile always ends up with a newer version than the body it may be missing.
+    """
+    g.representation = None
+    if version is None:
+        return None
+
+    try:
+        # every worker reads the same stored count, so none vouches for a copy another one changed
+        stamp = version.read()
+    except Exception as e:
+        record_error("conditional_get", e, f"Couldn't read the collection version: {e}")
+        return None
+    if stamp is None:
+        # nothing to validate a copy against until the app's first write counts one
+        return None
+    encoding = choose_encoding(request)
+    # pages and validators are never shared between sessions, even on the same collection
+    scope = f"{get_tenant().id}/{version.scope}"
+    etag = make_etag(stamp.tag, scope, request.full_path, encoding)
+    modified = last_modified(stamp, time.time())
+    g.representation = (etag, encoding, modified)
+
+    if not_modified(request, etag, modified):
+        return validated(Response(status=304))
+    cached = page_cache.get(etag)
+    if cached is not None:
+        body, mimetype, headers = cached
+        return validated(Response(body, mimetype=mimetype, headers=headers))
+    return None
+
+
+def validated(response):
+    """Adds the validators of the current representation so clients can revalidate it"""
+    etag, _, modified = g.representation
+    response.set_etag(etag)
+    if modified is not None:
+        response.last_modified = modified
+    # lets clients keep the body but makes them check it with the ETag before every use
+    response.headers["Cache-Control"] = "no-cache"
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def send_page(body, mimetype, headers=None):
+    """Compresses and caches a page built after conditional_get() and sends it"""
+    if g.get("representation") is None:
+        return Response(body, mimetype=mimetype, headers=headers)
+
+    etag, encoding, _ = g.representation
+    data = body.encode("utf-8")
+    headers = dict(headers or {})
+    if encoding and len(data) >= COMPRESS_MIN_BYTES:
+        data = compress(data, encoding)
+        headers["Content-Encoding"] = encoding
+    page_cache.put(etag, data, mimetype, headers)
+    return validated(Response(data, mimetype=mimetype, headers=headers))
+
+
+def send_stream(chunks, mimetype, headers=None):
+    """Streams text chunks, compressed, and caches the whole body if it turns out small enough"""
+    headers = dict(headers or {})
+    body = (chunk.encode("utf-8") for chunk in chunks)
+    if g.get("representation") is None:
+        return Response(stream_with_context(body), mimetype=mimetype, headers=headers)
+
+    etag, encoding, _ = g.representation
+    if encoding:
+        body = compress_stream(body, encoding)
+        headers["Content-Encoding"] = encoding
+    body = cache_stream(body, etag, mimetype, headers)
+    return validated(
+        Response(stream_with_context(body), mimetype=mimetype, headers=headers))
+
+
+def cache_stream(chunks, key, mimetype, headers):
+    """Passes a streamed body through and caches it once it has been sent in full"""
+    parts = []
+    size = 0
+    for chunk in chunks:
+        if parts is not None:
+            size += len(chunk)
+            # too big to cache, stops holding on to it
+            if size > page_cache.max_entry_bytes:
+                parts = None
+            else:
+                parts.append(chunk)
+        yield chunk
+    if parts is not None:
+        page_cache.put(key, b"".join(parts), mimetype, headers)
 
 
 app = Flask(__name__)
 app.secret_key = "supersecretkey"
 
-# Created to limit CSV upload file size to 2 MB
-app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024
+# Upload limits
+# Largest accepted request body in bytes, 0 for no limit
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 2 * 1024 * 1024))
+# Rows read from one upload before the rest is ignored, 0 for no limit
+UPLOAD_MAX_ROWS = int(os.getenv("UPLOAD_MAX_ROWS", 1000))
+# Courses per bulk write
+UPLOAD_BATCH_SIZE = int(os.getenv("UPLOAD_BATCH_SIZE", 500))
+
+app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_BYTES or None
+
+# Uploads are imported in the background by a pool of IMPORT_WORKERS threads, with at most
+# IMPORT_MAX_JOBS queued or running per session and IMPORT_MAX_TOTAL_JOBS for all sessions
+# together, 0 for no overall cap. Finished jobs are kept for IMPORT_JOB_TTL seconds.
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", 2))
+IMPORT_MAX_JOBS = int(os.getenv("IMPORT_MAX_JOBS", 8))
+IMPORT_MAX_TOTAL_JOBS = int(os.getenv("IMPORT_MAX_TOTAL_JOBS", 64))
+IMPORT_JOB_TTL = float(os.getenv("IMPORT_JOB_TTL", 3600))
+# Bytes of a queued upload kept in memory before the rest goes to an anonymous temp file
+IMPORT_SPOOL_BYTES = int(os.getenv("IMPORT_SPOOL_BYTES", 1024 * 1024))
+
+import_jobs = ImportJobs(IMPORT_WORKERS, IMPORT_MAX_JOBS, IMPORT_JOB_TTL,
+                         IMPORT_MAX_TOTAL_JOBS)
+
+# Number of courses shown per page on the index page
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Only fetches the fields shown in the course table
+LISTING_PROJECTION = {
+    "_id": 0,
+    "course_number": 1,
+    "course_title": 1,
+    "prerequisites": 1,
+    "version": 1
+}
+
+# Most courses one batch API call may name
+API_MAX_BATCH = int(os.getenv("API_MAX_BATCH", 1000))
+# Course fields the batch API reads and writes
+API_FIELDS = ("course_number", "course_title", "prerequisites")
+API_PATCH_FIELDS = ("course_title", "prerequisites")
+
+# Number of search results returned by default and at most
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 200
+
+# Rendered course pages and exports kept per collection version, bounded by total bytes.
+# Exports larger than PAGE_CACHE_MAX_ENTRY_BYTES are streamed every time
+PAGE_CACHE_BYTES = int(os.getenv("PAGE_CACHE_BYTES", 32 * 1024 * 1024))
+PAGE_CACHE_MAX_ENTRY_BYTES = int(
+    os.getenv("PAGE_CACHE_MAX_ENTRY_BYTES", 4 * 1024 * 1024))
+page_cache = BodyCache(PAGE_CACHE_BYTES, PAGE_CACHE_MAX_ENTRY_BYTES)
+
+# Number of documents fetched per cursor round trip when exporting
+EXPORT_BATCH_SIZE = 1000
+MAX_EXPORT_BATCH_SIZE = 10000
+
+# Route and CSV import metrics served at /metrics, next to the CRUD and MongoDB ones
+request_latency = registry.histogram("course_http_request_seconds",
+                                     "Latency of each route.",
+                                     ["endpoint", "method"])
+request_count = registry.counter("course_http_requests_total",
+                                 "Requests answered by each route.",
+                                 ["endpoint", "method", "status"])
+import_rows = registry.counter("course_import_rows_total",
+                               "CSV rows written to the database.",
+                               ["source"])
+import_latency = registry.histogram("course_import_seconds",
+                                    "Time taken to write a parsed CSV.",
+                                    ["source"])
+import_rate = registry.gauge("course_import_rows_per_second",
+                             "Rows per second of the latest CSV import.",
+                             ["source"])
+
+# Read-through cache settings for course lookups and listings, 0 turns caching off
+CACHE_SIZE = int(os.getenv("COURSE_CACHE_SIZE", 1024))
+CACHE_TTL = float(os.getenv("COURSE_CACHE_TTL", 30))
 
 # Use MongoDB Atlas if available
 mongo_uri = os.getenv("MONGO_URI")
 
 if mongo_uri:
     print("Connecting to MongoDB Atlas via MONGO_URI...")
-    default_mongo = CRUD(db_name="webappDB", collection_name="courses")
 else:
     print("No MONGO_URI found. Using local MongoDB connection.")
+
+
+def open_default(collection_name, create_index=True, **options):
+    """Opens a collection of the default MongoDB database"""
+    if mongo_uri:
+        return CRUD(db_name="webappDB",
+                    collection_name=collection_name,
+                    cache_size=CACHE_SIZE,
+                    cache_ttl=CACHE_TTL,
+                    create_index=create_index,
+                    **options)
     # Connects to a default MongoDB database otherwise
-    default_mongo = CRUD("webapp_user", "securepassword123", "webappDB",
-                         "courses")
+    return CRUD("webapp_user",
+                "securepassword123",
+                "webappDB",
+                collection_name,
+                cache_size=CACHE_SIZE,
+                cache_ttl=CACHE_TTL,
+                create_index=create_index,
+                **options)
 
-mongo = default_mongo
 
+# Each browser session works in its own collection of the default database, with its own
+# connection, graph and search index. Sessions unused for TENANT_TTL seconds are dropped
+# in the background.
+tenants = TenantRegistry(open_default)
 
-@app.route("/")
-def index():
-    """Lists all courses from the current MongoDB connection"""
-    global mongo
 
-    # Checks for a new user session
-    if "visited" not in session:
-        session["visited"] = True
-        try:
-            default_mongo.collection.delete_many({})
-            print(" Cleared default MongoDB for new user session")
-        except Exception as e:
-            print(f"Could not clear default MongoDB: {e}")
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
 
-    # Checks if user is logged in to their MongoDB database first
-    if mongo is None:
+
+@app.before_request
+def claim_tenant():
+    """Claims the session's tenant on its first write, so sessions that only read store nothing"""
+    if request.method not in ("GET", "HEAD", "OPTIONS"):
+        tenants.claim(get_tenant())
+
+
+@app.after_request
+def record_request(response):
+    """Times every route, labelled by its rule so course numbers don't each get a series"""
+    start = g.pop("request_start", None)
+    if start is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        request_latency.observe(time.perf_counter() - start, endpoint,
+                                request.method)
+        request_count.inc(endpoint, request.method, str(response.status_code))
+    return response
+
+
+@app.route("/")
+async def index():
+    """Lists all courses from the current MongoDB connection"""
+    # Checks the session has a working MongoDB connection first
+    if getattr(get_mongo(), "collection", None) is None:
         flash("Please connect to MongoDB first:")
         return redirect(url_for("connect"))
 
-    # Shows courses
-    courses = list(get_mongo().collection.find({}))
-    return render_template("index.html", courses=courses)
+    # Shows one page of courses at a time
+    page_size = request.args.get("page_size", PAGE_SIZE, type=int)
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    after = request.args.get("after")
+    before = request.args.get("before")
+
+    current = get_async_mongo()
+
+    # Unchanged pages are answered without reading the collection, unless there are
+    # messages to show, which only this one response will carry
+    if "_flashes" not in session:
+        response = conditional_get(current.version)
+        if response is not None:
+            return response
+
+    courses, has_prev, has_next = await current.cached_listing(
+        ("page", page_size, after, before),
+        lambda: fetch_course_page(current, page_size, after, before))
+    return send_page(render_template("index.html",
+                                     courses=courses,
+                                     page_size=page_size,
+                                     has_prev=has_prev,
+                                     has_next=has_next),
+                     "text/html")
+
+
+async def fetch_course_page(mongo, page_size, after=None, before=None):
+    """Reads one page of courses with keyset pagination on course_number
+
+    after/before are the course numbers at the edges of the neighbouring page, so every
+    page is a single index range scan instead of a skip over all the earlier pages.
+    Returns the courses along with whether a previous and a next page exist.
+    """
+    if before:
+        query = {"course_number": {"$lt": before}}
+        direction = DESCENDING
+    elif after:
+        query = {"course_number": {"$gt": after}}
+        direction = ASCENDING
+    else:
+        query = {}
+        direction = ASCENDING
+
+    # Fetches one extra course to find out if there is another page past this one
+    courses = await mongo.read(query,
+                               LISTING_PROJECTION,
+                               sort=[("course_number", direction)],
+                               limit=page_size + 1)
+    has_more = len(courses) > page_size
+    courses = courses[:page_size]
+
+    if before:
+        courses.reverse()
+        return courses, has_more, True
+    return courses, bool(after), has_more
 
 
 @app.route("/upload", methods=["GET", "POST"])
 def upload():
-    """Uploads CSV file and saves courses to MongoDB"""
-    global mongo
-
-    if mongo is None:
-        mongo = default_mongo
-        flash("Using default MongoDB database (webappDB):")
-
+    """Uploads a CSV file and queues it to be imported into MongoDB in the background"""
     if request.method == "POST":
-        file = request.files["file"]
+        # Reads the file straight from the request body, request.files would parse it all first
+        filename, chunks = open_csv_upload(request)
 
         # will prompt user for a .csv file if one was not entered
-        if not file or not file.filename:
+        if not filename:
             flash("No file selected. Please upload a CSV file.")
             return redirect(url_for("upload"))
 
-        if not file.filename.lower().endswith(".csv"):
+        if not filename.lower().endswith(".csv"):
             flash("Please upload a valid CSV file.")
             return redirect(url_for("upload"))
 
-        # saves file temporarily
-        filepath = os.path.join("uploads", file.filename)
-        file.save(filepath)
-
-        # limits number of rows to 1000
-        max_rows = 1000
-        inserted = 0
-
-        # Loads the CSV and inserts into MongoDB
-        with open(filepath, "r", newline='', encoding="utf-8") as f:
-            reader = csv.reader(f)
-            for i, row in enumerate(reader):
-                if i >= max_rows:
-                    flash(
-                        f"Upload limit reached ({max_rows} courses max). Subsequent rows are skipped"
-                    )
-
-                if len(row) < 2:
-                    continue
-
-                doc = {
-                    "course_number":
-                    row[0].strip(),
-                    "course_title":
-                    row[1].strip(),
-                    "prerequisites":
-                    [p.strip() for p in row[2:]] if len(row) > 2 else []
-                }
-
-                # Avoids duplicates
-                existing = get_mongo().collection.find_one(
-                    {"course_number": row[0]})
-                if not existing:
-                    mongo.create(doc)
-                    inserted += 1
-
-        flash(f"Uploaded {inserted} course(s) successfully!")
-        return redirect(url_for("index"))
+        # Holds the rows the worker will import, in memory up to IMPORT_SPOOL_BYTES
+        try:
+            spool = spool_upload(chunks, UPLOAD_MAX_ROWS or None)
+        except ValueError as e:
+            if wants_json():
+                return jsonify({"error": str(e)}), 400
+            flash(str(e))
+            return redirect(url_for("upload"))
+
+        job = ImportJob(filename, spool, owner=get_tenant().id)
+        current = get_mongo()
+        try:
+            import_jobs.submit(job, lambda job: run_import(job, current))
+        except JobLimitError as e:
+            spool.close()
+            if wants_json():
+                return jsonify({"error": str(e)}), 429
+            flash(str(e))
+            return redirect(url_for("upload"))
+
+        if wants_json():
+            response = jsonify(job.to_dict())
+            response.headers["Location"] = url_for("import_status",
+                                                   job_id=job.id)
+            return response, 202
+        return redirect(url_for("import_status", job_id=job.id))
 
     return render_template("upload.html")
 
 
+def wants_json():
+    """True when the client prefers a JSON answer to an HTML page"""
+    best = request.accept_mimetypes.best_match(
+        ["text/html", "application/json"])
+    return best == "application/json"
+
+
+@app.route("/imports")
+def list_imports():
+    """Lists the queued, running and recently finished import jobs as JSON"""
+    return jsonify(
+        [job.to_dict() for job in import_jobs.list(owner=get_tenant().id)])
+
+
+@app.route("/imports/<job_id>")
+def import_status(job_id):
+    """Shows the progress of an import job, as JSON when the client asks for it"""
+    job = import_jobs.get(job_id, owner=get_tenant().id)
+    if job is None:
+        if wants_json():
+            return jsonify({"error": "Unknown import job"}), 404
+        flash("That import job no longer exists.")
+        return redirect(url_for("upload"))
+
+    if wants_json():
+        return jsonify(job.to_dict())
+    return render_template("import.html",
+                           job=job.to_dict(),
+                           max_rows=UPLOAD_MAX_ROWS)
+
+
+@app.route("/imports/<job_id>/cancel", methods=["POST"])
+def cancel_import(job_id):
+    """Stops an import job after the batch it is writing"""
+    job = import_jobs.cancel(job_id, owner=get_tenant().id)
+    if wants_json():
+        if job is None:
+            return jsonify({"error": "Unknown import job"}), 404
+        return jsonify(job.to_dict())
+    if job is None:
+        return redirect(url_for("upload"))
+    return redirect(url_for("import_status", job_id=job_id))
+
+
 @app.route('/export')
-def export_courses():
-    """Exports all courses from the current MongoDB connection to CSV"""
-    try:
-        collection = get_mongo().collection
-        courses = list(collection.find({}, {"_id": 0}))
-    except Exception as e:
-        flash(f"Error accessing database: {str(e)}")
+async def export_courses():
+    """Streams all courses from the current MongoDB connection as CSV or NDJSON
+
+    Optional query parameters: format=csv|ndjson and batch_size=<rows>. The export is
+    compressed with brotli or gzip when the client accepts it, and an unchanged export is
+    answered with a 304 or from the page cache.
+    """
+    export_format = request.args.get("format", "csv").lower()
+    if export_format not in ("csv", "ndjson"):
+        flash(f"Unknown export format: {export_format}")
         return redirect(url_for("index"))
 
-    if not courses:
+    batch_size = request.args.get("batch_size", EXPORT_BATCH_SIZE, type=int)
+    batch_size = max(1, min(batch_size, MAX_EXPORT_BATCH_SIZE))
+
+    current = get_async_mongo()
+    response = conditional_get(current.version)
+    if response is not None:
+        return response
+
+    if not await current.read({}, {"_id": 1}, limit=1):
         flash("No courses to export.")
         return redirect(url_for('index'))
 
-    # Creates CSV in memory
+    # Server-side cursor that fetches batch_size documents per round trip
+    courses = current.stream({}, {"_id": 0}, batch_size)
+    if export_format == "ndjson":
+        body = stream_ndjson(courses, batch_size)
+        mimetype = "application/x-ndjson"
+        filename = "courses_export.ndjson"
+    else:
+        body = stream_csv(courses, batch_size)
+        mimetype = "text/csv"
+        filename = "courses_export.csv"
+
+    headers = {"Content-Disposition": f"attachment;filename={filename}"}
+    return send_stream(body, mimetype, headers)
+
+
+def stream_csv(courses, batch_size):
+    """Yields the CSV export one batch of rows at a time"""
     output = io.StringIO()
     writer = csv.writer(output)
     writer.writerow(["Course Number", "Course Title", "Prerequisites"])
 
-    for course in courses:
+    for i, course in enumerate(courses, start=1):
         prereqs = ", ".join(course.get("prerequisites", []))
         writer.writerow([
             course.get("course_number", ""),
             course.get("course_title", ""), prereqs
         ])
+        if i % batch_size == 0:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
 
-    output.seek(0)
+    if output.tell():
+        yield output.getvalue()
 
-    return Response(output,
-                    mimetype="text/csv",
-                    headers={
-                        "Content-Disposition":
-                        "attachment;filename=courses_export.csv"
-                    })
+
+def stream_ndjson(courses, batch_size):
+    """Yields the export as one JSON document per line"""
+    lines = []
+    for course in courses:
+        lines.append(json.dumps(course) + "\n")
+        if len(lines) >= batch_size:
+            yield "".join(lines)
+            lines = []
+
+    if lines:
+        yield "".join(lines)
 
 
 @app.route("/use-sample", methods=["POST"])
 def use_sample():
     """Loads sample.csv data into MongoDB"""
-    global mongo
-
     sample_path = os.path.join(os.getcwd(), "sample.csv")
 
     if not os.path.exists(sample_path):
         flash("Sample file not found.")
         return redirect(url_for("index"))
 
-    inserted = 0
     try:
         with open(sample_path, "r", newline="", encoding="utf-8") as f:
-            reader = csv.reader(f)
-            for row in reader:
-                if len(row) < 2:
-                    continue
-
-                doc = {
-                    "course_number":
-                    row[0].strip(),
-                    "course_title":
-                    row[1].strip(),
-                    "prerequisites":
-                    [p.strip() for p in row[2:]] if len(row) > 2 else []
-                }
-
-                existing = get_mongo().collection.find_one(
-                    {"course_number": row[0]})
-                if not existing:
-                    get_mongo().create(doc)
-                    inserted += 1
+            docs, rejected, _ = parse_course_rows(csv.reader(f))
 
+        inserted = ingest_courses(docs, rejected)
         flash(f"Loaded {inserted} sample course(s) successfully!")
     except Exception as e:
         flash(f"Error loading sample courses: {str(e)}")
@@ -206,12 +729,24 @@ def use_sample():
 # Allows users to delete a course on the front end
 @app.route("/delete/<course_number>", methods=["POST"])
 def delete_course(course_number):
-    """Deletes a course from MongoDB by the course number"""
+    """Deletes a course from MongoDB by the course number
+
+    The listing sends the version it showed, so a course someone changed since is kept.
+    """
     try:
-        result = get_mongo().collection.delete_one(
-            {"course_number": course_number})
-        if result.deleted_count > 0:
-            flash(f"Deleted course: {course_number}")
+        status, course = get_mongo().delete_course(
+            course_number, form_version())
+        if status == "deleted":
+            graph = cached_graph()
+            if graph is not None:
+                graph.remove_course(course_number)
+            index = cached_search_index()
+            if index is not None:
+                index.remove_course(course_number)
+            flash(f"Deleted course: {course_number} - {course['course_title']}")
+        elif status == "conflict":
+            flash(f"Course {course_number} was changed by someone else since "
+                  f"the list was loaded, so it was not deleted.")
         else:
             flash(f"No course found with number: {course_number}")
     except Exception as e:
@@ -224,6 +759,13 @@ def clear_courses():
     """Deletes all courses from the current MongoDB collection."""
     try:
         result = get_mongo().collection.delete_many({})
+        get_mongo().invalidate()
+        graph = cached_graph()
+        if graph is not None:
+            graph.clear()
+        index = cached_search_index()
+        if index is not None:
+            index.clear()
         flash(f"Deleted {result.deleted_count} course(s) successfully.")
     except Exception as e:
         flash(f"Error clearing courses: {str(e)}")
@@ -231,14 +773,13 @@ def clear_courses():
 
 
 @app.route("/edit/<course_number>", methods=["GET", "POST"])
-def edit_course(course_number):
-    """Displays and updates an existing course"""
-    collection = get_mongo().collection
-    course = collection.find_one({"course_number": course_number})
+async def edit_course(course_number):
+    """Displays and updates an existing course
 
-    if not course:
-        flash(f"No course found with number: {course_number}")
-        return redirect(url_for("index"))
+    Saving is a single find_one_and_update guarded by the version the form was loaded
+    with, so an edit never overwrites a change it hasn't seen.
+    """
+    current = get_async_mongo()
 
     if request.method == "POST":
         new_title = (request.form.get("course_title") or "").strip()
@@ -248,25 +789,351 @@ def edit_course(course_number):
                        for p in new_prereqs.split(",")] if new_prereqs else []
 
         try:
-            collection.update_one({"course_number": course_number}, {
-                "$set": {
+            status, course = await current.update_course(
+                course_number, {
                     "course_title": new_title,
                     "prerequisites": prereq_list
-                }
-            })
-            flash(f"Course {course_number} updated successfully.")
-            return redirect(url_for("index"))
+                }, form_version())
         except Exception as e:
             flash(f"Error updating course: {str(e)}")
+            return redirect(url_for("edit_course", course_number=course_number))
 
+        if status == "not_found":
+            flash(f"No course found with number: {course_number}")
+            return redirect(url_for("index"))
+        if status == "conflict":
+            # shows the other editor's version, the form now carries its number
+            flash(f"Course {course_number} was changed by someone else while you "
+                  f"were editing. Your changes were not saved, review the current "
+                  f"version below.")
+            return render_template("edit.html", course=course), 409
+
+        graph = cached_graph()
+        if graph is not None:
+            graph.set_course(course_number, prereq_list)
+        index = cached_search_index()
+        if index is not None:
+            index.set_course(course_number, new_title)
+        flash(f"Course {course_number} updated successfully.")
+        return redirect(url_for("index"))
+
+    course = await current.find_course(course_number)
+    if not course:
+        flash(f"No course found with number: {course_number}")
+        return redirect(url_for("index"))
     return render_template("edit.html", course=course)
 
 
+def form_version():
+    """Returns the course version a form was loaded with, or None if it sent none"""
+    version = request.form.get("version", type=int)
+    return version if version is not None and version >= 0 else None
+
+
+def api_error(message, status=400):
+    return jsonify({"error": message}), status
+
+
+def split_list(values):
+    """Flattens repeated and comma separated query parameters into one list"""
+    return [
+        item.strip() for value in values for item in value.split(",")
+        if item.strip()
+    ]
+
+
+def check_course_numbers(numbers):
+    """Returns why a list of course numbers can't be used in a batch, or None"""
+    if not isinstance(numbers, list) or not numbers:
+        return "Expected a non-empty list of course numbers."
+    if len(numbers) > API_MAX_BATCH:
+        return f"At most {API_MAX_BATCH} courses can be sent at once."
+    if not all(isinstance(number, str) and number for number in numbers):
+        return "Course numbers must be non-empty strings."
+    return None
+
+
+def check_patch(patch):
+    """Returns the fields a patch sets, or raises ValueError saying what is wrong with it"""
+    if not isinstance(patch, dict):
+        raise ValueError("A patch must be an object.")
+    unknown = set(patch) - set(API_PATCH_FIELDS) - {"course_number", "version"}
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(sorted(unknown))}")
+
+    fields = {}
+    if "course_title" in patch:
+        if not isinstance(patch["course_title"], str):
+            raise ValueError("course_title must be a string.")
+        fields["course_title"] = patch["course_title"].strip()
+    if "prerequisites" in patch:
+        prereqs = patch["prerequisites"]
+        if not isinstance(prereqs, list) or not all(
+                isinstance(prereq, str) for prereq in prereqs):
+            raise ValueError("prerequisites must be a list of strings.")
+        fields["prerequisites"] = [
+            prereq.strip() for prereq in prereqs if prereq.strip()
+        ]
+    if not fields:
+        raise ValueError("Nothing to change.")
+    return fields
+
+
+def check_version(version):
+    """Returns a course version sent by an API caller, or raises ValueError"""
+    if isinstance(version, bool) or not isinstance(version, int) or version < 0:
+        raise ValueError("version must be a non-negative integer.")
+    return version
+
+
+def batch_summary(results):
+    """Wraps per-course results with a count of each status"""
+    return jsonify({
+        "results": results,
+        "counts": Counter(result["status"] for result in results)
+    })
+
+
+@app.route("/api/courses/get", methods=["GET", "POST"])
+async def api_get_courses():
+    """Reads many courses with one query
+
+    GET takes course_number and fields query parameters, repeated or comma separated.
+    POST takes {"course_numbers": [...], "fields": [...]}. Answers one result per course.
+    """
+    if request.method == "POST":
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            return api_error("Expected a JSON object.")
+        numbers = body.get("course_numbers")
+        fields = body.get("fields")
+    else:
+        numbers = split_list(request.args.getlist("course_number"))
+        fields = split_list(request.args.getlist("fields")) or None
+
+    error = check_course_numbers(numbers)
+    if error:
+        return api_error(error)
+    if fields is not None and (not isinstance(fields, list) or not set(fields) <= set(API_FIELDS)):
+        return api_error(f"fields must be a list of: {', '.join(API_FIELDS)}")
+    numbers = list(dict.fromkeys(numbers))
+
+    try:
+        found = await get_async_mongo().find_courses(numbers, fields)
+    except Exception as e:
+        record_error("find_courses", e, f"Error reading courses: {e}")
+        return api_error(f"Error reading courses: {e}", 503)
+
+    return batch_summary([{
+        "course_number": number,
+        "status": "found",
+        "course": found[number]
+    } if number in found else {
+        "course_number": number,
+        "status": "not_found"
+    } for number in numbers])
+
+
+@app.route("/api/courses/patch", methods=["POST"])
+async def api_patch_courses():
+    """Updates many courses with one bulk write
+
+    Takes {"patches": [{"course_number": ..., "course_title": ..., "prerequisites": [...]}]}.
+    A patch may also carry the "version" of the course it was based on, and is answered
+    with conflict instead of applied if the course has changed since. Each patch is
+    checked on its own, so one bad patch doesn't stop the others.
+    """
+    body = request.get_json(silent=True)
+    patches = body.get("patches") if isinstance(body, dict) else None
+    if not isinstance(patches, list) or not patches:
+        return api_error("Expected {\"patches\": [...]} with at least one patch.")
+    if len(patches) > API_MAX_BATCH:
+        return api_error(f"At most {API_MAX_BATCH} courses can be sent at once.")
+
+    results = []
+    valid = {}
+    versions = {}
+    for patch in patches:
+        number = patch.get("course_number") if isinstance(patch, dict) else None
+        result = {"course_number": number}
+        results.append(result)
+        try:
+            if not isinstance(number, str) or not number:
+                raise ValueError("course_number must be a non-empty string.")
+            if number in valid:
+                raise ValueError("Course is patched more than once.")
+            fields = check_patch(patch)
+            if "version" in patch:
+                versions[number] = check_version(patch["version"])
+            valid[number] = fields
+        except ValueError as e:
+            result.update(status="invalid", error=str(e))
+
+    if valid:
+        try:
+            outcome = await get_async_mongo().patch_courses(valid, versions)
+        except Exception as e:
+            record_error("patch_courses", e, f"Error updating courses: {e}")
+            return api_error(f"Error updating courses: {e}", 503)
+
+        graph = cached_graph()
+        index = cached_search_index()
+        for result in results:
+            # invalid patches already have their status
+            if "status" in result:
+                continue
+            number = result["course_number"]
+            status, version = outcome[number]
+            if status not in ("updated", "unchanged", "conflict", "not_found"):
+                result.update(status="error", error=status)
+                continue
+            result["status"] = status
+            if version is not None:
+                result["version"] = version
+            if status == "updated":
+                fields = valid[number]
+                if graph is not None and "prerequisites" in fields:
+                    graph.set_course(number, fields["prerequisites"])
+                if index is not None and "course_title" in fields:
+                    index.set_course(number, fields["course_title"])
+
+    return batch_summary(results)
+
+
+@app.route("/api/courses/delete", methods=["POST"])
+async def api_delete_courses():
+    """Deletes many courses, each with its own find_one_and_delete sent together
+
+    Takes {"course_numbers": [...]} and optionally {"versions": {course_number: version}}
+    to only delete courses nobody changed since. Answers deleted with the removed course,
+    conflict with the current one, or not_found for each course.
+    """
+    body = request.get_json(silent=True)
+    numbers = body.get("course_numbers") if isinstance(body, dict) else None
+    error = check_course_numbers(numbers)
+    if error:
+        return api_error(error)
+    numbers = list(dict.fromkeys(numbers))
+    versions = body.get("versions") or {}
+    try:
+        if not isinstance(versions, dict):
+            raise ValueError("versions must map course numbers to versions.")
+        versions = {number: check_version(version) for number, version in versions.items()}
+    except ValueError as e:
+        return api_error(str(e))
+
+    try:
+        outcome = await get_async_mongo().delete_courses(numbers, versions)
+    except Exception as e:
+        record_error("delete_courses", e, f"Error deleting courses: {e}")
+        return api_error(f"Error deleting courses: {e}", 503)
+
+    graph = cached_graph()
+    index = cached_search_index()
+    results = []
+    for number in numbers:
+        status, course = outcome[number]
+        result = {"course_number": number, "status": status}
+        if status not in ("deleted", "conflict", "not_found"):
+            result.update(status="error", error=status)
+        if course is not None:
+            result["course"] = course
+        results.append(result)
+        if status != "deleted":
+            continue
+        if graph is not None:
+            graph.remove_course(number)
+        if index is not None:
+            index.remove_course(number)
+
+    return batch_summary(results)
+
+
+@app.route("/prerequisites")
+@app.route("/prerequisites/<course_number>")
+def prerequisites(course_number=None):
+    """Shows a course's full prerequisite chain or checks the whole catalog for problems"""
+    try:
+        graph = get_graph()
+    except Exception as e:
+        flash(f"Error accessing database: {str(e)}")
+        return redirect(url_for("index"))
+
+    if course_number is not None and not graph.has_course(course_number):
+        flash(f"No course found with number: {course_number}")
+        return redirect(url_for("index"))
+
+    if course_number is None:
+        return render_template("prerequisites.html",
+                               course_number=None,
+                               total=len(graph.prereqs),
+                               cycles=graph.find_cycles(),
+                               dangling=graph.dangling_references())
+
+    return render_template("prerequisites.html",
+                           course_number=course_number,
+                           all_prereqs=sorted(
+                               graph.all_prerequisites(course_number)),
+                           study_order=graph.study_order(course_number),
+                           cycles=[
+                               cycle for cycle in graph.find_cycles()
+                               if course_number in cycle
+                           ],
+                           dangling={
+                               missing: users
+                               for missing, users in
+                               graph.dangling_references().items()
+                               if missing in graph.all_prerequisites(
+                                   course_number)
+                           })
+
+
+@app.route("/search")
+def search():
+    """Ranks courses by how well their title or course number matches the query"""
+    query = (request.args.get("q") or "").strip()
+    limit = request.args.get("limit", SEARCH_LIMIT, type=int)
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+
+    results = []
+    if query:
+        try:
+            results = get_search_index().search(query, limit)
+        except Exception as e:
+            flash(f"Error searching courses: {str(e)}")
+
+    if wants_json():
+        return jsonify({
+            "query": query,
+            "results": [{
+                "course_number": number,
+                "course_title": title,
+                "score": score
+            } for number, title, score in results]
+        })
+    return render_template("search.html", query=query, results=results)
+
+
+@app.route("/metrics")
+def metrics():
+    """Exposes route, CRUD, MongoDB command and import metrics in the Prometheus text format"""
+    return Response(registry.render(),
+                    mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/cache-stats")
+def cache_stats():
+    """Reports the read-through and page cache hit and miss counters as JSON"""
+    stats = get_mongo().cache_stats() or {"enabled": False}
+    stats["pages"] = page_cache.stats()
+    return jsonify(stats)
+
+
 # Allows users to connect to their local databases on their machines
 @app.route("/connect", methods=["GET", "POST"])
 def connect():
-    """Allows users to connect to their MongoDB database"""
-    global mongo
+    """Allows users to connect to their MongoDB database, for this browser session only"""
+    tenant = get_tenant()
 
     if request.method == "POST":
         username = request.form.get("username", "").strip()
@@ -279,18 +1146,28 @@ def connect():
                 raise ValueError(
                     "Missing required fields for MongoDB connection")
 
-            temp_mongo = CRUD(username, password, db_name, collection_name)
-
-            _ = temp_mongo.collection.database.list_collection_names()
-
-            mongo = temp_mongo
+            temp_mongo = CRUD(username,
+                              password,
+                              db_name,
+                              collection_name,
+                              cache_size=CACHE_SIZE,
+                              cache_ttl=CACHE_TTL)
+
+            try:
+                _ = temp_mongo.collection.database.list_collection_names()
+            except Exception:
+                temp_mongo.close()
+                raise
+
+            # Releases the previous connection's client unless it is the session's own collection
+            tenant.connect(temp_mongo)
             flash(f"Connected successfully to MongoDB database: '{db_name}'")
 
             return redirect(url_for("index"))
 
         except Exception as e:
-            # defaults to default_mongo database instance if user connection fails
-            mongo = default_mongo
+            # falls back to the session's own collection in the default database if user connection fails
+            tenant.connect(None)
             flash(
                 f"Connection failed. Using default MongoDB instead. Error: {str(e)}"
             )
@@ -301,11 +1178,11 @@ def connect():
 
 @app.errorhandler(RequestEntityTooLarge)
 def handle_large_file(e):
-    flash("File is too large. Maximum allowed size is 2MB")
+    flash(f"File is too large. Maximum allowed size is "
+          f"{UPLOAD_MAX_BYTES / (1024 * 1024):g}MB")
     return redirect(url_for("upload"))
 
 
 if __name__ == "__main__":
-    os.makedirs("uploads", exist_ok=True)
     port = int(os.environ.get("PORT", 81))
     app.run(host="0.0.0.0", port=port, debug=True)
@@ -0,0 +1,545 @@
+# Asyncio version of mongo_crud.CRUD used by the async routes in app.py
+import asyncio
+import functools
+import itertools
+import threading
+import time
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from mongo_crud import COLLECTION_VERSIONS, CRUD, CLIENT_OPTIONS, CollectionVersion, LRUCache, VERSION_FIELD, build_uri, course_query, edit_update, insert_operations, registry, upserted_indexes
+from metrics import command_timer, crud_errors, crud_latency, record_error
+
+try:
+    from pymongo import AsyncMongoClient
+except ImportError:
+    # pymongo releases before 4.9 have no asyncio client, ThreadedCollection is used instead
+    AsyncMongoClient = None
+
+
+class LoopThread:
+    """Long-lived event loop in a background thread that runs every AsyncCRUD query.
+
+    Flask gives each async view its own short-lived loop, so queries are handed over to
+    this loop instead, where one client keeps the queries of every request in flight at once.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.lock = threading.Lock()
+
+    def get_loop(self):
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever,
+                                 name="async-crud-loop",
+                                 daemon=True).start()
+            return self.loop
+
+    async def run(self, coro):
+        """Awaits a coroutine on the background loop from any other loop."""
+        loop = self.get_loop()
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            return await coro
+        return await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(coro, loop))
+
+    def run_sync(self, coro):
+        """Runs a coroutine on the background loop from synchronous code and waits for it."""
+        return asyncio.run_coroutine_threadsafe(coro, self.get_loop()).result()
+
+
+loop_thread = LoopThread()
+
+# AsyncMongoClients keyed by URI, only ever used on the background loop
+async_clients = {}
+
+# Most deletes delete_courses() keeps in flight at once
+DELETE_CONCURRENCY = 32
+
+
+def on_loop(method):
+    """Makes an AsyncCRUD coroutine method run on the background loop, times it and counts its errors."""
+    operation = method.__name__
+
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await loop_thread.run(method(*args, **kwargs))
+        except Exception as error:
+            crud_errors.inc(operation, type(error).__name__)
+            raise
+        finally:
+            crud_latency.observe(time.perf_counter() - start, operation)
+
+    return wrapper
+
+
+class ThreadedCursor:
+    """Async cursor over a synchronous cursor that fetches each batch in a worker thread."""
+
+    def __init__(self, cursor, batch_size=100):
+        self.cursor = cursor
+        self.size = batch_size
+        self.buffer = []
+
+    def sort(self, *args, **kwargs):
+        self.cursor = self.cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, limit):
+        self.cursor = self.cursor.limit(limit)
+        return self
+
+    def batch_size(self, batch_size):
+        self.size = batch_size
+        self.cursor = self.cursor.batch_size(batch_size)
+        return self
+
+    async def to_list(self, length=None):
+        return await asyncio.to_thread(
+            lambda: list(itertools.islice(self.cursor, length)))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.buffer:
+            self.buffer = await self.to_list(self.size)
+            if not self.buffer:
+                raise StopAsyncIteration
+            self.buffer.reverse()
+        return self.buffer.pop()
+
+
+class ThreadedCollection:
+    """Async stand-in for a pymongo AsyncCollection wrapping any synchronous collection.
+
+    Each call runs in a worker thread. It is used when pymongo has no asyncio client and
+    lets AsyncCRUD run against a local in-process collection instead of a live server.
+    Each call is then a blocking query moved to another thread, which adds no concurrency
+    over the sync CRUD (see README.md).
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        return ThreadedCursor(self.collection.find(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+
+        return call
+
+
+class AsyncCRUD:
+    """Same operations as mongo_crud.CRUD as coroutines.
+
+    Pass collection to run against an async stand-in (see ThreadedCollection) instead of
+    connecting to MongoDB.
+    """
+
+    def __init__(self,
+                 username=None,
+                 password=None,
+                 db_name="coursesDB",
+                 collection_name="courses",
+                 host="localhost",
+                 port=27017,
+                 cache_size=0,
+                 cache_ttl=30,
+                 collection=None):
+        if cache_size:
+            self.course_cache = LRUCache(cache_size, cache_ttl)
+            self.listing_cache = LRUCache(cache_size, cache_ttl)
+        else:
+            self.course_cache = None
+            self.listing_cache = None
+
+        self.db_name = db_name
+        self.collection_name = collection_name
+        self.collection = collection
+        self.uri = None
+        self.version = None
+        self.lazy_index = False
+        if collection is None:
+            self.uri = build_uri(username, password, db_name, host, port)
+            # the version is also read by synchronous code, so it goes through a pooled client
+            _, client = registry.acquire(self.uri)
+            self.version = CollectionVersion(client[db_name][COLLECTION_VERSIONS],
+                                             collection_name, self.uri)
+
+    @classmethod
+    def from_crud(cls, crud):
+        """Builds an AsyncCRUD for the same collection as a CRUD, sharing its caches and version.
+
+        Falls back to running the CRUD's own collection in worker threads when pymongo
+        has no asyncio client or the CRUD runs on the memory or SQLite backend.
+        """
+        if AsyncMongoClient is None or crud.uri is None:
+            mongo = cls(db_name=crud.db_name,
+                        collection_name=crud.collection_name,
+                        collection=ThreadedCollection(crud.collection))
+        else:
+            mongo = cls.__new__(cls)
+            mongo.db_name = crud.db_name
+            mongo.collection_name = crud.collection_name
+            mongo.collection = None
+            mongo.uri = crud.uri
+        mongo.course_cache = crud.course_cache
+        mongo.listing_cache = crud.listing_cache
+        mongo.version = crud.version
+        mongo.lazy_index = crud.lazy_index
+        return mongo
+
+    # Cache bookkeeping is identical to the synchronous CRUD
+    drop_cached = CRUD.drop_cached
+    cache_stats = CRUD.cache_stats
+
+    async def invalidate(self, query=None):
+        """CRUD.invalidate() with the stored version bumped in a worker thread, off the loop."""
+        await asyncio.to_thread(CRUD.bump_version, self)
+        self.drop_cached(query)
+
+    async def get_collection(self):
+        """Returns the async collection, connecting on the background loop the first time."""
+        if self.collection is None:
+            client = async_clients.get(self.uri)
+            if client is None:
+                client = AsyncMongoClient(self.uri,
+                                          event_listeners=[command_timer],
+                                          **CLIENT_OPTIONS)
+                async_clients[self.uri] = client
+            collection = client[self.db_name][self.collection_name]
+            # recorded per URI, so new instances for the same collection skip the round trip
+            if not self.lazy_index:
+                await registry.ensure_async_index(self.uri, collection)
+            self.collection = collection
+        return self.collection
+
+    @on_loop
+    async def create(self, document):
+        """Insert a document into the collection."""
+        try:
+            collection = await self.get_collection()
+            result = await collection.insert_one(document)
+            await self.invalidate({"course_number": document.get("course_number")})
+            return result.inserted_id is not None
+        except Exception as e:
+            record_error("create", e, f"Couldn't insert: {e}")
+            return False
+
+    @on_loop
+    async def bulk_create(self, documents, batch_size=500, inserted=None):
+        """Inserts documents in unordered batches, skipping existing course numbers.
+
+        Unlike CRUD.bulk_create every batch is sent at once and they are awaited together.
+        """
+        documents = list(documents)
+        batches = [
+            documents[i:i + batch_size]
+            for i in range(0, len(documents), batch_size)
+        ]
+        stats = await asyncio.gather(
+            *(self._write_batch(batch, inserted) for batch in batches))
+
+        if any(batch_stats["inserted"] for batch_stats in stats):
+            await asyncio.to_thread(CRUD.bump_version, self)
+            if self.listing_cache is not None:
+                self.listing_cache.clear()
+        return list(stats)
+
+    async def _write_batch(self, documents, inserted=None):
+        """Sends one bulk_write of documents and counts what happened to each."""
+        try:
+            collection = await self.get_collection()
+            result = await collection.bulk_write(insert_operations(documents),
+                                                 ordered=False)
+            upserted = result.upserted_ids
+            rejected = 0
+        except BulkWriteError as e:
+            upserted = upserted_indexes(e.details)
+            rejected = len(e.details.get("writeErrors", []))
+        except Exception as e:
+            record_error("bulk_create", e, f"Couldn't write batch: {e}")
+            upserted = {}
+            rejected = len(documents)
+
+        if inserted is not None:
+            inserted.extend(documents[index] for index in sorted(upserted))
+        return {
+            "inserted": len(upserted),
+            "skipped": len(documents) - len(upserted) - rejected,
+            "rejected": rejected
+        }
+
+    @on_loop
+    async def read(self, query, projection=None, sort=None, limit=0):
+        """Find documents that match a given query."""
+        try:
+            collection = await self.get_collection()
+            cursor = collection.find(query, projection)
+            if sort:
+                cursor = cursor.sort(sort)
+            if limit:
+                cursor = cursor.limit(limit)
+            return await cursor.to_list(None)
+        except Exception as e:
+            record_error("read", e, f"Error reading documents: {e}")
+            return []
+
+    @on_loop
+    async def find_course(self, course_number):
+        """Finds one course by its course number, going through the cache when enabled."""
+        if self.course_cache is not None:
+            cached = self.course_cache.get(course_number)
+            if cached is not None:
+                return cached
+
+        collection = await self.get_collection()
+        course = await collection.find_one({"course_number": course_number})
+        if course is not None and self.course_cache is not None:
+            self.course_cache.put(course_number, course)
+        return course
+
+    async def cached_listing(self, key, load):
+        """Returns a cached listing for key, awaiting load() to read it on a miss."""
+        if self.listing_cache is None:
+            return await load()
+
+        cached = self.listing_cache.get(key)
+        if cached is not None:
+            return cached
+        listing = await load()
+        self.listing_cache.put(key, listing)
+        return listing
+
+    @on_loop
+    async def update(self, query, new_data):
+        """Update documents in the collection."""
+        try:
+            collection = await self.get_collection()
+            result = await collection.update_many(query, edit_update(new_data))
+            await self.invalidate(query)
+            return result.modified_count
+        except Exception as e:
+            record_error("update", e, f"Error updating documents: {e}")
+            return 0
+
+    @on_loop
+    async def update_course(self, course_number, changes, expected_version=None):
+        """Updates one course with a single find_one_and_update, see CRUD.update_course()."""
+        collection = await self.get_collection()
+        course = await collection.find_one_and_update(
+            course_query(course_number, expected_version),
+            edit_update(changes),
+            return_document=ReturnDocument.AFTER)
+        if course is None:
+            return await self._missed(course_number)
+        await self.invalidate({"course_number": course_number})
+        if self.course_cache is not None:
+            self.course_cache.put(course_number, course)
+        return "updated", course
+
+    @on_loop
+    async def delete_course(self, course_number, expected_version=None):
+        """Deletes one course with a single find_one_and_delete, see CRUD.delete_course()."""
+        collection = await self.get_collection()
+        course = await collection.find_one_and_delete(
+            course_query(course_number, expected_version))
+        if course is None:
+            return await self._missed(course_number)
+        await self.invalidate({"course_number": course_number})
+        return "deleted", course
+
+    async def _missed(self, course_number):
+        """Tells a version conflict from a missing course after a guarded write matched nothing."""
+        if self.course_cache is not None:
+            self.course_cache.invalidate(course_number)
+        collection = await self.get_collection()
+        course = await collection.find_one({"course_number": course_number})
+        if course is None:
+            return "not_found", None
+        return "conflict", course
+
+    @on_loop
+    async def delete(self, query):
+        """Delete documents that match a given query."""
+        try:
+            collection = await self.get_collection()
+            result = await collection.delete_many(query)
+            await self.invalidate(query)
+            return result.deleted_count
+        except Exception as e:
+            record_error("delete", e, f"Error deleting documents: {e}")
+            return 0
+
+    @on_loop
+    async def find_courses(self, course_numbers, projection=None):
+        """Reads many courses with one $in query. Returns a dict of course number -> document.
+
+        projection lists the fields to return, the course number and version are always included.
+        """
+        fields = {"_id": 0}
+        if projection:
+            fields.update({field: 1 for field in projection})
+            fields["course_number"] = 1
+            fields[VERSION_FIELD] = 1
+        collection = await self.get_collection()
+        cursor = collection.find({"course_number": {"$in": list(course_numbers)}}, fields)
+        found = {}
+        for doc in await cursor.to_list(None):
+            # courses never edited have no version field yet
+            doc.setdefault(VERSION_FIELD, 0)
+            found[doc["course_number"]] = doc
+        return found
+
+    @on_loop
+    async def patch_courses(self, patches, versions=None):
+        """Applies many course patches with one bulk_write.
+
+        patches maps course numbers to the fields to set, versions optionally maps them to
+        the version each patch was based on. Returns a dict of course number -> (status,
+        version) where status is "updated", "unchanged", "conflict", "not_found" or the error
+        MongoDB reported, and version is the course's version afterwards.
+        """
+        versions = versions or {}
+        collection = await self.get_collection()
+        fields = {"_id": 0, "course_number": 1, VERSION_FIELD: 1}
+        for patch in patches.values():
+            fields.update({field: 1 for field in patch})
+        cursor = collection.find({"course_number": {"$in": list(patches)}}, fields)
+        current = {doc["course_number"]: doc for doc in await cursor.to_list(None)}
+
+        # patches that would change nothing, hit no course or are out of date are answered
+        # without a write
+        results = {}
+        operations = []
+        numbers = []
+        for number, patch in patches.items():
+            doc = current.get(number)
+            if doc is None:
+                results[number] = ("not_found", None)
+                continue
+            version = doc.get(VERSION_FIELD, 0)
+            if versions.get(number, version) != version:
+                results[number] = ("conflict", version)
+            elif all(doc.get(field) == value for field, value in patch.items()):
+                results[number] = ("unchanged", version)
+            else:
+                # only applies if the course is still at the version just read
+                operations.append(
+                    UpdateOne(course_query(number, version), edit_update(patch)))
+                numbers.append(number)
+                results[number] = ("updated", version + 1)
+
+        if operations:
+            failed = set()
+            try:
+                result = await collection.bulk_write(operations, ordered=False)
+                matched = result.matched_count
+            except BulkWriteError as e:
+                for error in e.details.get("writeErrors", []):
+                    number = numbers[error["index"]]
+                    failed.add(number)
+                    results[number] = (error.get("errmsg", "write error"), None)
+                matched = e.details.get("nMatched", 0)
+            await self.invalidate()
+
+            if matched < len(operations) - len(failed):
+                # another writer got in between the read and the bulk write, the courses
+                # it changed were left alone
+                cursor = collection.find(
+                    {"course_number": {"$in": numbers}},
+                    {"_id": 0, "course_number": 1, VERSION_FIELD: 1})
+                now = {
+                    doc["course_number"]: doc.get(VERSION_FIELD, 0)
+                    for doc in await cursor.to_list(None)
+                }
+                for number in numbers:
+                    status, version = results[number]
+                    if status != "updated" or now.get(number) == version:
+                        continue
+                    if number in now:
+                        results[number] = ("conflict", now[number])
+                    else:
+                        results[number] = ("not_found", None)
+        return results
+
+    @on_loop
+    async def delete_courses(self, course_numbers, versions=None):
+        """Deletes many courses, each with its own find_one_and_delete. Returns a dict of course number -> (status, course).
+
+        status is "deleted" with the removed course, "conflict" with the course as it is
+        when versions names a version it is no longer at, "not_found" with None when there
+        is no such course or another request deleted it first, or the error MongoDB reported.
+        Each delete tells whether it removed its course, which one bulk write can't.
+        """
+        versions = versions or {}
+        collection = await self.get_collection()
+        in_flight = asyncio.Semaphore(DELETE_CONCURRENCY)
+
+        async def delete(number):
+            async with in_flight:
+                return await collection.find_one_and_delete(
+                    course_query(number, versions.get(number)),
+                    projection={"_id": 0})
+
+        removed = await asyncio.gather(
+            *(delete(number) for number in course_numbers),
+            return_exceptions=True)
+
+        results = {}
+        missed = []
+        for number, course in zip(course_numbers, removed):
+            if isinstance(course, Exception):
+                record_error("delete_courses", course, f"Couldn't delete {number}: {course}")
+                results[number] = (str(course), None)
+            elif course is None:
+                missed.append(number)
+            else:
+                results[number] = ("deleted", course)
+        if len(missed) < len(course_numbers):
+            await self.invalidate()
+
+        if missed:
+            # a course still there was at another version, the rest are gone
+            cursor = collection.find({"course_number": {"$in": missed}}, {"_id": 0})
+            current = {doc["course_number"]: doc for doc in await cursor.to_list(None)}
+            for number in missed:
+                doc = current.get(number)
+                results[number] = ("not_found", None) if doc is None else ("conflict", doc)
+        return results
+
+    @on_loop
+    async def delete_all(self):
+        """Deletes all documents in the current collection."""
+        collection = await self.get_collection()
+        result = await collection.delete_many({})
+        await self.invalidate()
+        print(
+            f"Deleted {result.deleted_count} existing document(s) from MongoDB."
+        )
+
+    def stream(self, query, projection=None, batch_size=1000):
+        """Yields documents to synchronous code, such as a streamed response, one batch at a time."""
+        cursor = loop_thread.run_sync(
+            self._open_cursor(query, projection, batch_size))
+        while True:
+            batch = loop_thread.run_sync(cursor.to_list(batch_size))
+            if not batch:
+                return
+            yield from batch
+
+    async def _open_cursor(self, query, projection, batch_size):
+        collection = await self.get_collection()
+        return collection.find(query, projection).batch_size(batch_size)
@@ -0,0 +1,140 @@
+# Conditional GETs and cached, compressed bodies for pages that only change with the collection
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+try:
+    import brotli
+except ImportError:
+    # brotli is optional, clients that accept it get gzip instead
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed, compressing them saves nothing
+COMPRESS_MIN_BYTES = 512
+# Compression levels, chosen for speed since bodies are compressed once per collection version
+BROTLI_QUALITY = 5
+GZIP_LEVEL = 6
+
+
+def choose_encoding(request):
+    """Returns the best content coding the client accepts: br, gzip or None for none."""
+    offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    return request.accept_encodings.best_match(offered)
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        compressor = zlib.compressobj(GZIP_LEVEL, wbits=31)
+        return compressor.compress(data) + compressor.flush()
+    return data
+
+
+def compress_stream(chunks, encoding):
+    """Compresses a stream of byte chunks as they are produced."""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            data = compressor.process(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+    elif encoding == "gzip":
+        compressor = zlib.compressobj(GZIP_LEVEL, wbits=31)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    else:
+        yield from chunks
+
+
+def make_etag(version_tag, scope, path, encoding):
+    """Strong ETag of one representation: the collection and its version, the URL and the content coding.
+
+    It is also the page cache key, so scope has to tell every collection apart.
+    """
+    url = hashlib.blake2b(f"{scope}\x1f{path}".encode("utf-8"), digest_size=6).hexdigest()
+    return f"{version_tag}-{url}-{encoding or 'identity'}"
+
+
+def last_modified(version, now):
+    """Returns the change time of a VersionStamp for Last-Modified, or None if it can't be used yet.
+
+    HTTP dates only have whole seconds, so a date is only handed out once its second is
+    over. Any later write then falls into a later second and gets a later date.
+    """
+    if int(version.modified) >= int(now):
+        return None
+    return datetime.fromtimestamp(int(version.modified), timezone.utc)
+
+
+def not_modified(request, etag, modified):
+    """True when the client's copy, named by ETag or by date, is still current."""
+    # If-None-Match wins when both are sent
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if modified is not None and request.if_modified_since is not None:
+        return modified <= request.if_modified_since
+    return False
+
+
+class BodyCache:
+    """Least-recently-used cache of response bodies, bounded by their total size in bytes.
+
+    Entries are keyed by ETag, so bodies of older collection versions are never served
+    again and just age out.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_entry_bytes=4 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the cached (body, mimetype, headers) or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, mimetype, headers=None):
+        """Caches a body unless it is larger than max_entry_bytes."""
+        if len(body) > self.max_entry_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self.entries[key] = (body, mimetype, headers or {})
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (evicted, _, _) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
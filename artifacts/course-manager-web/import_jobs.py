@@ -0,0 +1,176 @@
+# Background CSV import jobs run on a bounded worker pool
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobLimitError(Exception):
+    """Raised when the maximum number of queued and running imports is reached."""
+
+
+class ImportJob:
+    """Progress and outcome of one CSV import, updated by its worker thread."""
+
+    def __init__(self, filename, upload=None, owner=None):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        # tenant that queued the import, only it may see or cancel the job
+        self.owner = owner
+        # file-like object holding the uploaded body until the worker has read it
+        self.upload = upload
+        self.status = "queued"
+        self.message = ""
+        self.parsed = 0
+        self.inserted = 0
+        self.skipped = 0
+        self.rejected = 0
+        self.errors = 0
+        self.batches = 0
+        self.truncated = False
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.future = None
+        self.lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def start(self):
+        with self.lock:
+            self.status = "running"
+            self.started = time.time()
+
+    def add_batch(self, parsed, stats, rejected=0):
+        """Adds the counts of one written batch and the malformed rows read so far."""
+        with self.lock:
+            self.parsed += parsed
+            self.rejected = rejected
+            self.batches += 1
+            for batch in stats:
+                self.inserted += batch["inserted"]
+                self.skipped += batch["skipped"]
+                self.errors += batch["rejected"]
+
+    def finish(self, status, message=""):
+        with self.lock:
+            self.status = status
+            self.message = message
+            self.finished = time.time()
+        if self.upload is not None:
+            self.upload.close()
+            self.upload = None
+
+    def to_dict(self):
+        with self.lock:
+            end = self.finished or time.time()
+            elapsed = end - self.started if self.started else 0
+            return {
+                "id": self.id,
+                "filename": self.filename,
+                "status": self.status,
+                "message": self.message,
+                "parsed": self.parsed,
+                "inserted": self.inserted,
+                "skipped": self.skipped,
+                "rejected": self.rejected,
+                "errors": self.errors,
+                "batches": self.batches,
+                "truncated": self.truncated,
+                "created": self.created,
+                "started": self.started,
+                "finished": self.finished,
+                "rows_per_second": self.parsed / elapsed if elapsed else 0
+            }
+
+
+class ImportJobs:
+    """Runs import jobs on a fixed number of worker threads and keeps their progress.
+
+    Each owner may have at most max_jobs imports queued or running at once, so one owner
+    can't lock the others out, and max_total caps all owners together unless it is 0.
+    Finished jobs are kept for keep_seconds so their results can still be fetched, then
+    dropped.
+    """
+
+    def __init__(self, workers=2, max_jobs=8, keep_seconds=3600, max_total=0):
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix="course-import")
+        self.max_jobs = max_jobs
+        self.max_total = max_total
+        self.keep_seconds = keep_seconds
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, job, run):
+        """Queues run(job), raising JobLimitError when too many imports are in progress."""
+        with self.lock:
+            self.prune()
+            active = [queued for queued in self.jobs.values() if not queued.done]
+            own = sum(1 for queued in active if queued.owner == job.owner)
+            if own >= self.max_jobs:
+                raise JobLimitError(
+                    f"You already have {own} import(s) in progress, try again later."
+                )
+            if self.max_total and len(active) >= self.max_total:
+                raise JobLimitError(
+                    f"{len(active)} import(s) are already in progress, try again later."
+                )
+            self.jobs[job.id] = job
+        job.future = self.executor.submit(self.run, job, run)
+        return job
+
+    def run(self, job, run):
+        if job.cancelled:
+            job.finish("cancelled", "Cancelled before it started.")
+            return
+        job.start()
+        try:
+            run(job)
+        except Exception as e:
+            job.finish("failed", str(e))
+            return
+        if job.cancelled:
+            job.finish("cancelled", "Cancelled, courses already written were kept.")
+        else:
+            job.finish("done")
+
+    def get(self, job_id, owner=None):
+        """Returns a job, or None if it is unknown or was queued by a different owner."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None or (owner is not None and job.owner != owner):
+            return None
+        return job
+
+    def list(self, owner=None):
+        """Returns the jobs of one owner, or of everyone when owner is None, oldest first."""
+        with self.lock:
+            jobs = [job for job in self.jobs.values()
+                    if owner is None or job.owner == owner]
+        return sorted(jobs, key=lambda job: job.created)
+
+    def cancel(self, job_id, owner=None):
+        """Asks a job to stop after its current batch. Returns the job or None."""
+        job = self.get(job_id, owner)
+        if job is None or job.done:
+            return job
+        job.cancel_event.set()
+        # a job that has not started yet is dropped from the queue straight away
+        if job.future is not None and job.future.cancel():
+            job.finish("cancelled", "Cancelled before it started.")
+        return job
+
+    def prune(self):
+        """Drops finished jobs older than keep_seconds. Called with the lock held."""
+        cutoff = time.time() - self.keep_seconds
+        for job_id, job in list(self.jobs.items()):
+            if job.done and job.finished < cutoff:
+                del self.jobs[job_id]
@@ -0,0 +1,219 @@
+# Lightweight latency and error metrics, rendered in the Prometheus text format
+import threading
+import time
+from functools import wraps
+from pymongo import monitoring
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1, 2.5, 5, 10)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace(
+        "\n", "\\n")
+
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"'
+                          for name, value in pairs) + "}"
+
+
+class Counter:
+    """Monotonic count per label combination."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, labels, None, value)
+                    for labels, value in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    """Value per label combination that can go up and down."""
+
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram:
+    """Bucketed latency distribution per label combination."""
+
+    kind = "histogram"
+
+    def __init__(self,
+                 name,
+                 help_text,
+                 labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [bucket counts..., sum, count, max]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [0] * len(self.buckets) + [
+                    0.0, 0, 0.0
+                ]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-3] += value
+            entry[-2] += 1
+            entry[-1] = max(entry[-1], value)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for labels, entry in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, entry):
+                    samples.append((f"{self.name}_bucket", labels,
+                                    ("le", repr(float(bound))), count))
+                samples.append((f"{self.name}_bucket", labels, ("le", "+Inf"),
+                                entry[-2]))
+                samples.append((f"{self.name}_sum", labels, None, entry[-3]))
+                samples.append((f"{self.name}_count", labels, None, entry[-2]))
+        return samples
+
+    def totals(self):
+        """Returns (labels, count, total seconds, max seconds) for each label combination."""
+        with self.lock:
+            return [(labels, entry[-2], entry[-3], entry[-1])
+                    for labels, entry in sorted(self.values.items())]
+
+
+class Registry:
+    """Holds every metric of the process and renders them for /metrics."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self.register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=()):
+        return self.register(Histogram(name, help_text, labelnames))
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, extra, value in metric.samples():
+                lines.append(
+                    f"{name}{format_labels(metric.labelnames, labels, extra)} {value}"
+                )
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Returns a plain-text table of every histogram for printing in the CLI."""
+        lines = []
+        for metric in self.metrics:
+            if not isinstance(metric, Histogram):
+                continue
+            for labels, count, total, slowest in metric.totals():
+                if not count:
+                    continue
+                name = f"{metric.name}[{','.join(map(str, labels))}]"
+                lines.append(
+                    f"{name:<60} {count:>8} calls  {total:>9.4f}s total  "
+                    f"{total / count * 1000:>9.3f}ms avg  {slowest * 1000:>9.3f}ms max"
+                )
+        return "\n".join(lines) if lines else "No timings recorded yet."
+
+
+registry = Registry()
+
+crud_latency = registry.histogram("course_crud_operation_seconds",
+                                  "Latency of CRUD operations.",
+                                  ["operation"])
+crud_errors = registry.counter("course_crud_errors_total",
+                               "CRUD operations that failed.",
+                               ["operation", "error"])
+mongo_command_latency = registry.histogram(
+    "course_mongo_command_seconds",
+    "Latency of MongoDB commands from pymongo command monitoring.",
+    ["command"])
+mongo_command_failures = registry.counter(
+    "course_mongo_command_failures_total", "MongoDB commands that failed.",
+    ["command"])
+
+
+def timed(operation):
+    """Records the latency of a CRUD method under operation, and counts the errors it raises."""
+
+    def decorator(method):
+
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            except Exception as error:
+                crud_errors.inc(operation, type(error).__name__)
+                raise
+            finally:
+                crud_latency.observe(time.perf_counter() - start, operation)
+
+        return wrapper
+
+    return decorator
+
+
+def record_error(operation, error, message=None):
+    """Counts a failed CRUD operation and reports it."""
+    crud_errors.inc(operation, type(error).__name__)
+    print(message or f"Error during {operation}: {error}")
+
+
+class CommandTimer(monitoring.CommandListener):
+    """pymongo command listener that feeds the MongoDB command metrics."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_command_latency.observe(event.duration_micros / 1e6,
+                                      event.command_name)
+
+    def failed(self, event):
+        mongo_command_latency.observe(event.duration_micros / 1e6,
+                                      event.command_name)
+        mongo_command_failures.inc(event.command_name)
+
+
+command_timer = CommandTimer()
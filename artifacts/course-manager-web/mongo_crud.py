@@ -1,5 +1,295 @@
+import atexit
+import hashlib
 import os
-from pymongo import MongoClient
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from storage_backends import DEFAULT_KEY, get_backend, keyed_collection, open_collection
+from metrics import command_timer, record_error, timed
+
+
+class LRUCache:
+    """Bounded least-recently-used cache whose entries expire after ttl seconds."""
+
+    def __init__(self, max_size=1024, ttl=30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the cached value or None if it is missing or expired."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            # evicts the least recently used entries once the cache is full
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+# Connection pool and timeout settings shared by every MongoClient, in milliseconds where timed
+CLIENT_OPTIONS = {
+    "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", 50)),
+    "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", 0)),
+    "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 300000)),
+    "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 10000)),
+    "serverSelectionTimeoutMS":
+    int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000)),
+}
+
+# Seconds an unused client is kept open before close_idle() shuts it down
+CLIENT_IDLE_TIMEOUT = float(os.getenv("MONGO_CLIENT_IDLE_TIMEOUT", 600))
+
+
+class ClientRegistry:
+    """Process-wide MongoClients keyed by connection URI, shared by every CRUD.
+
+    Reusing a client reuses its connection pool, so reconnecting to the same database
+    skips the TCP/TLS and authentication handshakes.
+    """
+
+    def __init__(self, idle_timeout=CLIENT_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        # key -> {"client", "users", "last_used"}
+        self.clients = {}
+        # (key, database, collection) pairs whose indexes were already created
+        self.indexed = set()
+        self.lock = threading.Lock()
+
+    def acquire(self, uri, **options):
+        """Returns the shared client for uri, creating it the first time."""
+        settings = dict(CLIENT_OPTIONS, **options)
+        key = (uri, tuple(sorted(settings.items())))
+
+        with self.lock:
+            entry = self.clients.get(key)
+            if entry is None:
+                # every command the client sends is timed for /metrics
+                entry = {
+                    "client":
+                    MongoClient(uri,
+                                event_listeners=[command_timer],
+                                **settings),
+                    "users": 0,
+                    "last_used": time.monotonic()
+                }
+                self.clients[key] = entry
+            entry["users"] += 1
+            entry["last_used"] = time.monotonic()
+
+        self.close_idle()
+        return key, entry["client"]
+
+    def release(self, key):
+        """Marks one user of a client as finished with it."""
+        with self.lock:
+            entry = self.clients.get(key)
+            if entry is not None and entry["users"] > 0:
+                entry["users"] -= 1
+                entry["last_used"] = time.monotonic()
+
+    def ensure_index(self, key, collection):
+        """Creates the course_number index once per collection instead of on every connect."""
+        index_key = (key, collection.database.name, collection.name)
+        with self.lock:
+            if index_key in self.indexed:
+                return
+        collection.create_index("course_number", unique=True)
+        with self.lock:
+            self.indexed.add(index_key)
+
+    async def ensure_async_index(self, key, collection):
+        """ensure_index() for a pymongo AsyncCollection, sharing the same record."""
+        index_key = (key, collection.database.name, collection.name)
+        with self.lock:
+            if index_key in self.indexed:
+                return
+        await collection.create_index("course_number", unique=True)
+        with self.lock:
+            self.indexed.add(index_key)
+
+    def forget_index(self, key, db_name, collection_name):
+        """Forgets that a dropped collection was indexed, so a new one with its name is again."""
+        with self.lock:
+            self.indexed.discard((key, db_name, collection_name))
+
+    def close_idle(self):
+        """Closes clients nobody has used for longer than idle_timeout."""
+        now = time.monotonic()
+        idle = []
+        with self.lock:
+            for key, entry in list(self.clients.items()):
+                if entry["users"] == 0 and now - entry[
+                        "last_used"] > self.idle_timeout:
+                    idle.append(self.clients.pop(key)["client"])
+                    self.indexed = {
+                        index_key
+                        for index_key in self.indexed if index_key[0] != key
+                    }
+        for client in idle:
+            client.close()
+        return len(idle)
+
+    def close_all(self):
+        """Closes every client, e.g. when the process shuts down."""
+        with self.lock:
+            clients = [entry["client"] for entry in self.clients.values()]
+            self.clients.clear()
+            self.indexed.clear()
+        for client in clients:
+            client.close()
+
+
+registry = ClientRegistry()
+atexit.register(registry.close_all)
+
+
+def build_uri(username, password, db_name, host="localhost", port=27017):
+    """Returns the MONGO_URI environment variable if set, otherwise a local connection URI."""
+    # Checks if MONGO_URI environment variable is set
+    mongo_uri = os.getenv("MONGO_URI")
+
+    if mongo_uri:
+        print("Using MongoDB Atlas connection from environment variable.")
+        return mongo_uri
+
+    # Fallback for local MongoDB setup
+    print("Using local MongoDB connection.")
+    return f"mongodb://{username}:{password}@{host}:{port}/{db_name}"
+
+
+# Collection counting the writes made to each course collection, shared with the CLI.
+# Its documents are keyed by _id, holding the collection name.
+COLLECTION_VERSIONS = "collection_versions"
+
+# A collection's version as read at one moment, see CollectionVersion.read()
+VersionStamp = namedtuple("VersionStamp", ["tag", "modified"])
+
+
+class CollectionVersion:
+    """Counts the writes made to one collection in a document of COLLECTION_VERSIONS.
+
+    Pages and exports built from the collection are tagged with the count, so a client
+    holding an older copy can be told it is current without reading the collection. The
+    count lives in the database, so every worker process and the CLI share it.
+
+    scope identifies the collection, source being its URI or storage backend. Counts of
+    different collections can be equal, so tags are only compared within one scope.
+    """
+
+    def __init__(self, versions, collection_name, source):
+        self.versions = versions
+        self.name = collection_name
+        # hashed, as the URI may hold a password
+        self.scope = hashlib.blake2b(
+            "\x1f".join([source, versions.database.name, collection_name]).encode("utf-8"),
+            digest_size=8).hexdigest()
+
+    def bump(self):
+        # the epoch is new whenever the version document is, so a restarted count never repeats
+        self.versions.update_one({"_id": self.name}, {
+            "$inc": {
+                "count": 1
+            },
+            "$set": {
+                "modified": time.time()
+            },
+            "$setOnInsert": {
+                "epoch": uuid.uuid4().hex[:8]
+            }
+        },
+                                 upsert=True)
+
+    def read(self):
+        """Returns the current VersionStamp, or None for a collection this app never wrote to.
+
+        Such a collection may still hold courses written by other tools, so there is no
+        count a copy of it could be checked against.
+        """
+        doc = self.versions.find_one({"_id": self.name}, {"_id": 0})
+        if doc is None:
+            return None
+        return VersionStamp(f"{doc['epoch']}.{doc['count']}", doc["modified"])
+
+    def drop(self):
+        """Forgets the count of a dropped collection."""
+        self.versions.delete_one({"_id": self.name})
+
+
+# Field counting the edits made to a course, so an edit based on an older read is refused
+VERSION_FIELD = "version"
+
+
+def course_query(course_number, expected_version=None):
+    """Matches one course, and only while it is at expected_version when one is given."""
+    query = {"course_number": course_number}
+    if expected_version is not None:
+        # courses written before edits were counted have no version, which matches null
+        query[VERSION_FIELD] = expected_version or None
+    return query
+
+
+def edit_update(changes):
+    """Returns the update that sets changes on a course and counts the edit."""
+    # the CLI's stored content hash no longer matches, so its next sync rewrites the course
+    return {
+        "$set": changes,
+        "$inc": {
+            VERSION_FIELD: 1
+        },
+        "$unset": {
+            "content_hash": ""
+        }
+    }
+
+
+def insert_operations(documents):
+    """Upserts writing each document only when no course with its number exists yet."""
+    return [
+        UpdateOne({"course_number": doc["course_number"]},
+                  {"$setOnInsert": doc},
+                  upsert=True) for doc in documents
+    ]
+
+
+def upserted_indexes(details):
+    """The operations a failed bulk_write upserted, as BulkWriteResult.upserted_ids has them."""
+    return {item["index"]: item["_id"] for item in details.get("upserted", [])}
 
 
 class CRUD:
@@ -10,72 +300,294 @@ class CRUD:
                  db_name="coursesDB",
                  collection_name="courses",
                  host="localhost",
-                 port=27017):
+                 port=27017,
+                 cache_size=0,
+                 cache_ttl=30,
+                 backend=None,
+                 create_index=True,
+                 key=DEFAULT_KEY):
+        # Optional read-through caches, one for single courses and one for listings
+        if cache_size:
+            self.course_cache = LRUCache(cache_size, cache_ttl)
+            self.listing_cache = LRUCache(cache_size, cache_ttl)
+        else:
+            self.course_cache = None
+            self.listing_cache = None
+
+        self.client_key = None
+        self.uri = None
+        self.db_name = db_name
+        self.collection_name = collection_name
+        self.version = None
+        # True until ensure_index() runs for a CRUD opened with create_index=False
+        self.lazy_index = not create_index
         try:
-            # Checks if MONGO_URI environment variable is set
-            mongo_uri = os.getenv("MONGO_URI")
-
-            if mongo_uri:
-                print(
-                    "Using MongoDB Atlas connection from environment variable."
-                )
-                self.client = MongoClient(mongo_uri)
-            else:
-                # Fallback for local MongoDB setup
-                print("Using local MongoDB connection.")
-                uri = f"mongodb://{username}:{password}@{host}:{port}/{db_name}"
-                self.client = MongoClient(uri)
+            # Runs on the in-memory or SQLite backend instead of MongoDB when one is selected
+            self.backend = get_backend(backend)
+            if self.backend != "mongo":
+                self.client = None
+                # key "_id" opens a collection holding something other than courses
+                self.collection = open_collection(self.backend, db_name,
+                                                  collection_name, key)
+                self.db = self.collection.database
+                self.version = CollectionVersion(
+                    keyed_collection(self.db, COLLECTION_VERSIONS),
+                    collection_name, self.backend)
+                print(f"Using the {self.backend} storage backend.")
+                return
+
+            uri = build_uri(username, password, db_name, host, port)
+            self.uri = uri
+
+            # Reuses a pooled client for these connection details if one is open
+            self.client_key, self.client = registry.acquire(uri)
 
             # Select database and collection
             self.db = self.client[db_name]
             self.collection = self.db[collection_name]
+            self.version = CollectionVersion(
+                keyed_collection(self.db, COLLECTION_VERSIONS), collection_name,
+                uri)
 
-            # Ensure an index on course_number for faster lookups
-            self.collection.create_index("course_number", unique=True)
+            # Ensure an index on course_number for faster lookups, unless the caller
+            # defers it, and with it the collection, to the first write (see ensure_index())
+            if create_index:
+                registry.ensure_index(self.client_key, self.collection)
             print("MongoDB connection established successfully!")
 
         except Exception as e:
             print(f"Error connecting to MongoDB: {e}")
             self.client = None
 
+    def close(self):
+        """Hands the pooled client back to the registry."""
+        if self.client_key is not None:
+            registry.release(self.client_key)
+            self.client_key = None
+
+    def ensure_index(self):
+        """Creates the course_number index of a CRUD opened with create_index=False."""
+        self.lazy_index = False
+        if self.client_key is not None:
+            registry.ensure_index(self.client_key, self.collection)
+
+    def drop(self):
+        """Drops the whole collection along with its cached results, index record and version."""
+        self.db.drop_collection(self.collection_name)
+        if self.course_cache is not None:
+            self.course_cache.clear()
+            self.listing_cache.clear()
+        if self.version is not None:
+            self.version.drop()
+        if self.client_key is not None:
+            registry.forget_index(self.client_key, self.db_name,
+                                  self.collection_name)
+            # AsyncCRUD records its index by URI
+            registry.forget_index(self.uri, self.db_name, self.collection_name)
+
+    @timed("find_course")
+    def find_course(self, course_number):
+        """Finds one course by its course number, going through the cache when enabled."""
+        if self.course_cache is not None:
+            cached = self.course_cache.get(course_number)
+            if cached is not None:
+                return cached
+
+        course = self.collection.find_one({"course_number": course_number})
+        if course is not None and self.course_cache is not None:
+            self.course_cache.put(course_number, course)
+        return course
+
+    def cached_listing(self, key, load):
+        """Returns a cached listing for key, calling load() to read it on a miss."""
+        if self.listing_cache is None:
+            return load()
+
+        cached = self.listing_cache.get(key)
+        if cached is not None:
+            return cached
+        listing = load()
+        self.listing_cache.put(key, listing)
+        return listing
+
+    def invalidate(self, query=None):
+        """Records a write matching query and drops the cached results it affects."""
+        self.bump_version()
+        self.drop_cached(query)
+
+    def bump_version(self):
+        """Counts a write in the collection's stored version, so pages built before it go stale."""
+        if self.version is None:
+            return
+        try:
+            self.version.bump()
+        except Exception as e:
+            record_error("bump_version", e, f"Couldn't record the write: {e}")
+
+    def drop_cached(self, query=None):
+        """Drops the cached results a write matching query affects.
+
+        Always drops listings. Single courses are dropped by course number when the query
+        names one, otherwise all of them are.
+        """
+        if self.listing_cache is None:
+            return
+        self.listing_cache.clear()
+
+        course_number = (query or {}).get("course_number")
+        if isinstance(course_number, str):
+            self.course_cache.invalidate(course_number)
+        else:
+            self.course_cache.clear()
+
+    def cache_stats(self):
+        """Returns hit and miss counters for both caches, or None when caching is off."""
+        if self.course_cache is None:
+            return None
+        return {
+            "courses": self.course_cache.stats(),
+            "listings": self.listing_cache.stats()
+        }
+
+    @timed("create")
     def create(self, document):
         """Insert a document into the collection."""
         try:
             result = self.collection.insert_one(document)
+            self.invalidate({"course_number": document.get("course_number")})
             return result.inserted_id is not None
         except Exception as e:
-            print(f"Couldn't insert: {e}")
+            record_error("create", e, f"Couldn't insert: {e}")
             return False
 
+    @timed("bulk_create")
+    def bulk_create(self, documents, batch_size=500, inserted=None):
+        """Inserts documents in unordered batches, skipping existing course numbers.
+
+        Returns a list with the inserted, skipped and rejected counts of each batch.
+        inserted, when given a list, gets every document that was written.
+        """
+        stats = []
+        batch = []
+        for doc in documents:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                stats.append(self._write_batch(batch, inserted))
+                batch = []
+
+        if batch:
+            stats.append(self._write_batch(batch, inserted))
+
+        # $setOnInsert never changes an existing course, so only listings go stale
+        if any(batch_stats["inserted"] for batch_stats in stats):
+            self.bump_version()
+            if self.listing_cache is not None:
+                self.listing_cache.clear()
+        return stats
+
+    def _write_batch(self, documents, inserted=None):
+        """Sends one bulk_write of documents and counts what happened to each."""
+        try:
+            result = self.collection.bulk_write(insert_operations(documents),
+                                                ordered=False)
+            upserted = result.upserted_ids
+            rejected = 0
+        except BulkWriteError as e:
+            # Unordered writes keep going after an error, so the rest of the batch still counts
+            upserted = upserted_indexes(e.details)
+            rejected = len(e.details.get("writeErrors", []))
+        except Exception as e:
+            record_error("bulk_create", e, f"Couldn't write batch: {e}")
+            upserted = {}
+            rejected = len(documents)
+
+        if inserted is not None:
+            inserted.extend(documents[index] for index in sorted(upserted))
+        return {
+            "inserted": len(upserted),
+            "skipped": len(documents) - len(upserted) - rejected,
+            "rejected": rejected
+        }
+
+    @timed("read")
     def read(self, query):
         """Find documents that match a given query."""
         try:
             return list(self.collection.find(query))
         except Exception as e:
-            print(f"Error reading documents: {e}")
+            record_error("read", e, f"Error reading documents: {e}")
             return []
 
+    @timed("update")
     def update(self, query, new_data):
         """Update documents in the collection."""
         try:
-            result = self.collection.update_many(query, {"$set": new_data})
+            result = self.collection.update_many(query, edit_update(new_data))
+            self.invalidate(query)
             return result.modified_count
         except Exception as e:
-            print(f"Error updating documents: {e}")
+            record_error("update", e, f"Error updating documents: {e}")
             return 0
 
+    @timed("update_course")
+    def update_course(self, course_number, changes, expected_version=None):
+        """Updates one course with a single find_one_and_update and returns (status, course).
+
+        With expected_version the edit only applies if nobody changed the course since that
+        version was read. status is "updated" with the new course, "conflict" with the
+        course as it is now, or "not_found" with None.
+        """
+        course = self.collection.find_one_and_update(
+            course_query(course_number, expected_version),
+            edit_update(changes),
+            return_document=ReturnDocument.AFTER)
+        if course is None:
+            return self._missed(course_number)
+        self.invalidate({"course_number": course_number})
+        if self.course_cache is not None:
+            self.course_cache.put(course_number, course)
+        return "updated", course
+
+    @timed("delete_course")
+    def delete_course(self, course_number, expected_version=None):
+        """Deletes one course with a single find_one_and_delete and returns (status, course).
+
+        status is "deleted" with the removed course, or "conflict" or "not_found" as for
+        update_course().
+        """
+        course = self.collection.find_one_and_delete(
+            course_query(course_number, expected_version))
+        if course is None:
+            return self._missed(course_number)
+        self.invalidate({"course_number": course_number})
+        return "deleted", course
+
+    def _missed(self, course_number):
+        """Tells a version conflict from a missing course after a guarded write matched nothing."""
+        # a cached copy is what an out of date editor read, so it is dropped either way
+        if self.course_cache is not None:
+            self.course_cache.invalidate(course_number)
+        course = self.collection.find_one({"course_number": course_number})
+        if course is None:
+            return "not_found", None
+        return "conflict", course
+
+    @timed("delete")
     def delete(self, query):
         """Delete documents that match a given query."""
         try:
             result = self.collection.delete_many(query)
+            self.invalidate(query)
             return result.deleted_count
         except Exception as e:
-            print(f"Error deleting documents: {e}")
+            record_error("delete", e, f"Error deleting documents: {e}")
             return 0
 
+    @timed("delete_all")
     def delete_all(self):
         """Deletes all documents in the current collection."""
         result = self.collection.delete_many({})
+        self.invalidate()
         print(
             f"Deleted {result.deleted_count} existing document(s) from MongoDB."
         )
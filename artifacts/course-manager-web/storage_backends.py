@@ -0,0 +1,736 @@
+# Storage backends that stand in for a pymongo collection, so the app runs without a MongoDB server
+# Select one with the COURSE_BACKEND environment variable: mongo (default), memory or sqlite
+#
+# Both backends keep documents keyed by a unique field, course_number unless a collection is
+# opened with another (see keyed_collection()), and support the part of the pymongo
+# collection API this project uses: equality, $gt/$gte/$lt/$lte/$in/$ne/$exists queries
+# on top-level fields, projections, sort/skip/limit, $set/$setOnInsert/$unset/$inc updates and
+# the atomic find_one_and_update/find_one_and_delete.
+
+import bisect
+import copy
+import itertools
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from bson import ObjectId, json_util
+from pymongo import ASCENDING, DESCENDING, DeleteMany, DeleteOne, InsertOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+BACKENDS = ("mongo", "memory", "sqlite")
+
+# Field course collections are keyed by
+DEFAULT_KEY = "course_number"
+
+# Folder the sqlite backend keeps one <db_name>.sqlite3 file per database in
+SQLITE_DIR = os.getenv("COURSE_SQLITE_DIR", ".")
+
+# Number of documents read per step while walking a range of keys
+SCAN_CHUNK = 256
+
+
+def get_backend(backend=None):
+    """Returns the backend to use, from the argument or the COURSE_BACKEND environment variable."""
+    backend = (backend or os.getenv("COURSE_BACKEND") or "mongo").lower()
+    if backend not in BACKENDS:
+        raise ValueError(
+            f"Unknown storage backend '{backend}', expected one of {BACKENDS}")
+    return backend
+
+
+def open_collection(backend, db_name, collection_name, key=DEFAULT_KEY):
+    """Returns a collection of the memory or sqlite backend, sharing databases across callers."""
+    with databases_lock:
+        database = databases.get((backend, db_name))
+        if database is None:
+            if backend == "memory":
+                database = MemoryDatabase(db_name)
+            else:
+                database = SQLiteDatabase(
+                    db_name, os.path.join(SQLITE_DIR, f"{db_name}.sqlite3"))
+            databases[(backend, db_name)] = database
+    return database.get_collection(collection_name, key)
+
+
+def keyed_collection(database, name):
+    """Returns collection name of a pymongo or backend database, keyed by _id.
+
+    Collections holding something other than courses use this. MongoDB keys every
+    collection by _id already, a backend collection is stored by the key it is opened with.
+    """
+    if isinstance(database, (MemoryDatabase, SQLiteDatabase)):
+        return database.get_collection(name, "_id")
+    return database[name]
+
+
+# (backend, db_name) -> open database
+databases = {}
+databases_lock = threading.Lock()
+
+
+class WriteResult:
+    """Carries the same counters as pymongo's result objects."""
+
+    def __init__(self, **counts):
+        self.acknowledged = True
+        self.__dict__.update(counts)
+
+
+def matches(doc, query):
+    """Checks a document against a query of top-level fields."""
+    for field, condition in query.items():
+        value = doc.get(field)
+        if isinstance(condition, dict) and any(
+                key.startswith("$") for key in condition):
+            for op, operand in condition.items():
+                if not compare(op, value, field in doc, operand):
+                    return False
+        elif isinstance(value, list) and not isinstance(condition, list):
+            # like MongoDB, a list field matches any of its elements
+            if condition not in value:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def compare(op, value, present, operand):
+    try:
+        if op == "$gt":
+            return value is not None and value > operand
+        if op == "$gte":
+            return value is not None and value >= operand
+        if op == "$lt":
+            return value is not None and value < operand
+        if op == "$lte":
+            return value is not None and value <= operand
+    except TypeError:
+        return False
+    if op == "$in":
+        if isinstance(value, list):
+            return any(item in operand for item in value)
+        return value in operand
+    if op == "$ne":
+        return value != operand
+    if op == "$exists":
+        return present == bool(operand)
+    raise OperationFailure(f"Unsupported query operator: {op}")
+
+
+def project(doc, projection):
+    """Returns a copy of doc limited by a MongoDB-style projection."""
+    if not projection:
+        return copy.deepcopy(doc)
+
+    included = [
+        field for field, keep in projection.items()
+        if keep and field != "_id"
+    ]
+    if included:
+        result = {
+            field: copy.deepcopy(doc[field])
+            for field in included if field in doc
+        }
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+
+    return {
+        field: copy.deepcopy(value)
+        for field, value in doc.items() if projection.get(field, 1)
+    }
+
+
+def apply_update(doc, update, inserting):
+    """Applies update operators to doc in place."""
+    for op, fields in update.items():
+        if op == "$set" or (op == "$setOnInsert" and inserting):
+            doc.update(copy.deepcopy(fields))
+        elif op == "$setOnInsert":
+            continue
+        elif op == "$unset":
+            for field in fields:
+                doc.pop(field, None)
+        elif op == "$inc":
+            for field, amount in fields.items():
+                doc[field] = doc.get(field, 0) + amount
+        else:
+            raise OperationFailure(f"Unsupported update operator: {op}")
+
+
+def sort_key(value):
+    # sorts missing values first and keeps mixed types from raising
+    return (value is not None, type(value).__name__, value)
+
+
+class Cursor:
+    """Lazy cursor over a backend collection with pymongo's sort/skip/limit chaining."""
+
+    def __init__(self, collection, query, projection):
+        self.collection = collection
+        self.query = query or {}
+        self.projection = projection
+        self.sort_spec = None
+        self.skip_count = 0
+        self.limit_count = 0
+        self.results = None
+
+    def sort(self, key_or_list, direction=ASCENDING):
+        if isinstance(key_or_list, str):
+            self.sort_spec = [(key_or_list, direction)]
+        else:
+            self.sort_spec = list(key_or_list)
+        return self
+
+    def skip(self, count):
+        self.skip_count = count
+        return self
+
+    def limit(self, count):
+        self.limit_count = count
+        return self
+
+    def batch_size(self, size):
+        # documents are read in SCAN_CHUNK steps already
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.results is None:
+            self.results = self._run()
+        return next(self.results)
+
+    def _run(self):
+        key = self.collection.key
+        spec = self.sort_spec or [(key, ASCENDING)]
+        if len(spec) == 1 and spec[0][0] == key:
+            # the key order comes straight from the index, so limit stops the walk early
+            docs = self.collection._scan(self.query,
+                                         descending=spec[0][1] == DESCENDING)
+        else:
+            docs = list(self.collection._scan(self.query))
+            for field, direction in reversed(spec):
+                docs.sort(key=lambda doc: sort_key(doc.get(field)),
+                          reverse=direction == DESCENDING)
+
+        stop = self.skip_count + self.limit_count if self.limit_count else None
+        docs = itertools.islice(docs, self.skip_count, stop)
+        return (project(doc, self.projection) for doc in docs)
+
+
+class BackendCollection:
+    """Shared pymongo-style operations on top of a few storage primitives.
+
+    Subclasses provide _get, _range, _insert, _replace, _remove, _count, _clear and _transaction.
+    """
+
+    def __init__(self, database, name, key=DEFAULT_KEY):
+        self.database = database
+        self.name = name
+        self.key = key
+
+    def create_index(self, keys, unique=False, **kwargs):
+        # documents are already stored in a unique index on their key
+        return f"{self.key}_1"
+
+    def find(self, filter=None, projection=None, **kwargs):
+        return Cursor(self, filter, projection)
+
+    def find_one(self, filter=None, projection=None, **kwargs):
+        return next(self.find(filter, projection).limit(1), None)
+
+    def count_documents(self, filter, **kwargs):
+        if not filter:
+            return self._count()
+        return sum(1 for _ in self._scan(filter))
+
+    def estimated_document_count(self, **kwargs):
+        return self._count()
+
+    def insert_one(self, document, **kwargs):
+        with self._transaction():
+            self._add(document)
+        return WriteResult(inserted_id=document["_id"])
+
+    def insert_many(self, documents, ordered=True, **kwargs):
+        result = self.bulk_write([InsertOne(doc) for doc in documents],
+                                 ordered)
+        return WriteResult(inserted_ids=[doc["_id"] for doc in documents],
+                           inserted_count=result.inserted_count)
+
+    def update_one(self, filter, update, upsert=False, **kwargs):
+        with self._transaction():
+            return self._update(filter, update, upsert, many=False)
+
+    def update_many(self, filter, update, upsert=False, **kwargs):
+        with self._transaction():
+            return self._update(filter, update, upsert, many=True)
+
+    def delete_one(self, filter, **kwargs):
+        with self._transaction():
+            return self._delete(filter, many=False)
+
+    def delete_many(self, filter, **kwargs):
+        with self._transaction():
+            return self._delete(filter, many=True)
+
+    def find_one_and_update(self,
+                            filter,
+                            update,
+                            projection=None,
+                            upsert=False,
+                            return_document=ReturnDocument.BEFORE,
+                            **kwargs):
+        """Updates the first matching document and returns it from before or after the update."""
+        with self._transaction():
+            before = next(self._scan(filter), None)
+            if before is None and not upsert:
+                return None
+            self._update(filter, update, upsert, many=False)
+            if return_document == ReturnDocument.BEFORE:
+                return None if before is None else project(before, projection)
+            key = filter.get(self.key) if before is None else before[self.key]
+            after = self._get(key)
+            return None if after is None else project(after, projection)
+
+    def find_one_and_delete(self, filter, projection=None, **kwargs):
+        """Deletes the first matching document and returns it."""
+        with self._transaction():
+            doc = next(self._scan(filter), None)
+            if doc is None:
+                return None
+            self._remove(doc[self.key])
+            return project(doc, projection)
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        """Runs InsertOne/UpdateOne/UpdateMany/DeleteOne/DeleteMany requests in one transaction."""
+        counts = {
+            "nInserted": 0,
+            "nUpserted": 0,
+            "nMatched": 0,
+            "nModified": 0,
+            "nRemoved": 0,
+            "upserted": [],
+            "writeErrors": [],
+            "writeConcernErrors": []
+        }
+        with self._transaction():
+            for index, request in enumerate(requests):
+                try:
+                    self._bulk_request(request, index, counts)
+                except (DuplicateKeyError, OperationFailure) as e:
+                    counts["writeErrors"].append({
+                        "index": index,
+                        "code": e.code,
+                        "errmsg": str(e),
+                        "op": request
+                    })
+                    if ordered:
+                        break
+
+        if counts["writeErrors"]:
+            raise BulkWriteError(counts)
+        return WriteResult(inserted_count=counts["nInserted"],
+                           upserted_count=counts["nUpserted"],
+                           matched_count=counts["nMatched"],
+                           modified_count=counts["nModified"],
+                           deleted_count=counts["nRemoved"],
+                           upserted_ids={
+                               item["index"]: item["_id"]
+                               for item in counts["upserted"]
+                           })
+
+    def _bulk_request(self, request, index, counts):
+        # pymongo's request classes keep their arguments in these attributes
+        if isinstance(request, InsertOne):
+            self._add(request._doc)
+            counts["nInserted"] += 1
+        elif isinstance(request, (UpdateOne, UpdateMany)):
+            result = self._update(request._filter, request._doc,
+                                  request._upsert,
+                                  isinstance(request, UpdateMany))
+            counts["nMatched"] += result.matched_count
+            counts["nModified"] += result.modified_count
+            if result.upserted_id is not None:
+                counts["nUpserted"] += 1
+                counts["upserted"].append({
+                    "index": index,
+                    "_id": result.upserted_id
+                })
+        elif isinstance(request, (DeleteOne, DeleteMany)):
+            result = self._delete(request._filter,
+                                  isinstance(request, DeleteMany))
+            counts["nRemoved"] += result.deleted_count
+        else:
+            raise OperationFailure(
+                f"Unsupported bulk request: {type(request).__name__}")
+
+    def _add(self, document):
+        if self.key not in document:
+            raise OperationFailure(f"Documents need a {self.key}", 2)
+        document.setdefault("_id", ObjectId())
+        self._insert(copy.deepcopy(document))
+
+    def _update(self, filter, update, upsert, many):
+        targets = list(self._scan(filter))
+        if not many:
+            targets = targets[:1]
+
+        if not targets:
+            if not upsert:
+                return WriteResult(matched_count=0,
+                                   modified_count=0,
+                                   upserted_id=None)
+            # builds the new document from the equality parts of the filter
+            doc = {
+                field: copy.deepcopy(value)
+                for field, value in filter.items()
+                if not isinstance(value, dict)
+            }
+            apply_update(doc, update, inserting=True)
+            self._add(doc)
+            return WriteResult(matched_count=0,
+                               modified_count=0,
+                               upserted_id=doc["_id"])
+
+        modified = 0
+        for target in targets:
+            doc = copy.deepcopy(target)
+            apply_update(doc, update, inserting=False)
+            if doc != target:
+                self._replace(target[self.key], doc)
+                modified += 1
+        return WriteResult(matched_count=len(targets),
+                           modified_count=modified,
+                           upserted_id=None)
+
+    def _delete(self, filter, many):
+        if many and not filter:
+            return WriteResult(deleted_count=self._clear())
+
+        targets = list(self._scan(filter))
+        if not many:
+            targets = targets[:1]
+        for target in targets:
+            self._remove(target[self.key])
+        return WriteResult(deleted_count=len(targets))
+
+    def _scan(self, query, descending=False):
+        """Yields stored documents matching query in key order.
+
+        Conditions on the key are answered from the index; the rest are filtered here.
+        """
+        query = query or {}
+        condition = query.get(self.key)
+
+        if self.key in query and not isinstance(condition, dict):
+            keys = [condition]
+        elif isinstance(condition, dict) and "$in" in condition:
+            keys = sorted(set(condition["$in"]), reverse=descending)
+        else:
+            keys = None
+
+        if keys is not None:
+            for key in keys:
+                doc = self._get(key)
+                if doc is not None and matches(doc, query):
+                    yield doc
+            return
+
+        condition = condition or {}
+        low, low_inclusive = condition.get("$gte"), True
+        if low is None:
+            low, low_inclusive = condition.get("$gt"), False
+        high, high_inclusive = condition.get("$lte"), True
+        if high is None:
+            high, high_inclusive = condition.get("$lt"), False
+
+        # Walks the range a chunk at a time, restarting after the last key seen so that
+        # writes made while a cursor is open never invalidate it
+        while True:
+            chunk = self._range(low, low_inclusive, high, high_inclusive,
+                                descending, SCAN_CHUNK)
+            for doc in chunk:
+                if matches(doc, query):
+                    yield doc
+            if len(chunk) < SCAN_CHUNK:
+                return
+            if descending:
+                high, high_inclusive = chunk[-1][self.key], False
+            else:
+                low, low_inclusive = chunk[-1][self.key], False
+
+
+class MemoryDatabase:
+    """In-process database of MemoryCollections, shared by everything in the process."""
+
+    def __init__(self, name):
+        self.name = name
+        self.collections = {}
+        self.lock = threading.Lock()
+
+    def __getitem__(self, name):
+        return self.get_collection(name)
+
+    def get_collection(self, name, key=DEFAULT_KEY):
+        with self.lock:
+            if name not in self.collections:
+                self.collections[name] = MemoryCollection(self, name, key)
+            return check_key(self.collections[name], key)
+
+    def list_collection_names(self):
+        return sorted(self.collections)
+
+    def drop_collection(self, name):
+        with self.lock:
+            self.collections.pop(name, None)
+
+
+class MemoryCollection(BackendCollection):
+    """Documents in a dict by their key plus a sorted list of the keys."""
+
+    def __init__(self, database, name, key=DEFAULT_KEY):
+        super().__init__(database, name, key)
+        self.docs = {}
+        self.keys = []
+        self.lock = threading.RLock()
+
+    @contextmanager
+    def _transaction(self):
+        with self.lock:
+            yield
+
+    def _get(self, key):
+        return self.docs.get(key)
+
+    def _range(self, low, low_inclusive, high, high_inclusive, descending,
+               limit):
+        with self.lock:
+            keys = self.keys
+            if low is None:
+                start = 0
+            elif low_inclusive:
+                start = bisect.bisect_left(keys, low)
+            else:
+                start = bisect.bisect_right(keys, low)
+            if high is None:
+                stop = len(keys)
+            elif high_inclusive:
+                stop = bisect.bisect_right(keys, high)
+            else:
+                stop = bisect.bisect_left(keys, high)
+
+            if descending:
+                selected = keys[max(start, stop - limit):stop][::-1]
+            else:
+                selected = keys[start:min(stop, start + limit)]
+            return [self.docs[key] for key in selected]
+
+    def _insert(self, doc):
+        key = doc[self.key]
+        with self.lock:
+            if key in self.docs:
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error {self.key}: {key}", 11000)
+            self.docs[key] = doc
+            bisect.insort(self.keys, key)
+
+    def _replace(self, old_key, doc):
+        with self.lock:
+            if doc[self.key] != old_key:
+                self._insert(doc)
+                self._remove(old_key)
+            else:
+                self.docs[old_key] = doc
+
+    def _remove(self, key):
+        with self.lock:
+            if self.docs.pop(key, None) is not None:
+                del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def _count(self):
+        return len(self.docs)
+
+    def _clear(self):
+        with self.lock:
+            count = len(self.docs)
+            self.docs.clear()
+            self.keys.clear()
+            return count
+
+
+class SQLiteDatabase:
+    """One SQLite file holding a table per collection."""
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.connection = sqlite3.connect(path,
+                                          check_same_thread=False,
+                                          isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.lock = threading.RLock()
+        self.collections = {}
+
+    def __getitem__(self, name):
+        return self.get_collection(name)
+
+    def get_collection(self, name, key=DEFAULT_KEY):
+        with self.lock:
+            if name not in self.collections:
+                self.collections[name] = SQLiteCollection(self, name, key)
+            return check_key(self.collections[name], key)
+
+    def list_collection_names(self):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def drop_collection(self, name):
+        with self.lock:
+            self.connection.execute(
+                f"DROP TABLE IF EXISTS {quote_identifier(name)}")
+            collection = self.collections.pop(name, None)
+            if collection is not None:
+                collection.created = False
+
+
+def check_key(collection, key):
+    if collection.key != key:
+        raise ValueError(
+            f"Collection '{collection.name}' is keyed by {collection.key}, not {key}")
+    return collection
+
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SQLiteCollection(BackendCollection):
+    """Documents stored as extended JSON in a table clustered on their key as primary key."""
+
+    def __init__(self, database, name, key=DEFAULT_KEY):
+        self.lock = database.lock
+        self.connection = database.connection
+        # a table written before keeps the key column it was created with
+        with self.lock:
+            columns = self.connection.execute(
+                f"PRAGMA table_info({quote_identifier(name)})").fetchall()
+        key = next((column[1] for column in columns if column[5]), key)
+        super().__init__(database, name, key)
+        self.table = quote_identifier(name)
+        self.column = quote_identifier(key)
+        # the table is created by the first write, so a collection that is only read leaves none
+        self.created = False
+
+    def _exists(self):
+        """True once the table exists, which another connection to the file may have done."""
+        if not self.created:
+            with self.lock:
+                self.created = self.connection.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                    (self.name, )).fetchone() is not None
+        return self.created
+
+    @contextmanager
+    def _transaction(self):
+        with self.lock:
+            # nested calls (bulk_write -> update) join the outer transaction
+            if self.connection.in_transaction:
+                yield
+                return
+            self.connection.execute("BEGIN")
+            if not self.created:
+                self.connection.execute(
+                    f"CREATE TABLE IF NOT EXISTS {self.table} "
+                    f"({self.column} TEXT PRIMARY KEY, doc TEXT NOT NULL) WITHOUT ROWID"
+                )
+                self.created = True
+            try:
+                yield
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                # a table created by this transaction is gone again, _exists() rechecks
+                self.created = False
+                raise
+            # a bulk_write that raises BulkWriteError still keeps its successful writes
+            self.connection.execute("COMMIT")
+
+    def _get(self, key):
+        if not self._exists():
+            return None
+        with self.lock:
+            row = self.connection.execute(
+                f"SELECT doc FROM {self.table} WHERE {self.column} = ?",
+                (key, )).fetchone()
+        return json_util.loads(row[0]) if row else None
+
+    def _range(self, low, low_inclusive, high, high_inclusive, descending,
+               limit):
+        if not self._exists():
+            return []
+        where = []
+        params = []
+        if low is not None:
+            where.append(f"{self.column} >= ?" if low_inclusive else
+                         f"{self.column} > ?")
+            params.append(low)
+        if high is not None:
+            where.append(f"{self.column} <= ?" if high_inclusive else
+                         f"{self.column} < ?")
+            params.append(high)
+
+        sql = f"SELECT doc FROM {self.table}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {self.column}" + (" DESC" if descending else "")
+        sql += " LIMIT ?"
+        params.append(limit)
+
+        with self.lock:
+            rows = self.connection.execute(sql, params).fetchall()
+        return [json_util.loads(row[0]) for row in rows]
+
+    def _insert(self, doc):
+        try:
+            with self.lock:
+                self.connection.execute(
+                    f"INSERT INTO {self.table} ({self.column}, doc) VALUES (?, ?)",
+                    (doc[self.key], json_util.dumps(doc)))
+        except sqlite3.IntegrityError:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error {self.key}: {doc[self.key]}",
+                11000)
+
+    def _replace(self, old_key, doc):
+        if doc[self.key] != old_key:
+            self._insert(doc)
+            self._remove(old_key)
+            return
+        with self.lock:
+            self.connection.execute(
+                f"UPDATE {self.table} SET doc = ? WHERE {self.column} = ?",
+                (json_util.dumps(doc), old_key))
+
+    def _remove(self, key):
+        with self.lock:
+            self.connection.execute(
+                f"DELETE FROM {self.table} WHERE {self.column} = ?", (key, ))
+
+    def _count(self):
+        if not self._exists():
+            return 0
+        with self.lock:
+            return self.connection.execute(
+                f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def _clear(self):
+        with self.lock:
+            return self.connection.execute(
+                f"DELETE FROM {self.table}").rowcount
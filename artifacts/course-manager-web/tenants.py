@@ -0,0 +1,279 @@
+# Per-session tenants for the web app
+# Every browser session gets its own collection in the default database and its own
+# connection state, so visitors never see, wipe or switch each other's courses
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from pymongo import UpdateOne
+
+# Seconds a tenant may go unused before its collection is dropped
+TENANT_TTL = float(os.getenv("TENANT_TTL", 24 * 3600))
+# Seconds between background sweeps for expired tenants
+TENANT_SWEEP_INTERVAL = float(os.getenv("TENANT_SWEEP_INTERVAL", 300))
+# Most tenants one process keeps open, the least recently used are closed beyond it
+TENANT_MAX_ACTIVE = int(os.getenv("TENANT_MAX_ACTIVE", 10000))
+# Tenant collections are named with this prefix and the tenant id
+TENANT_PREFIX = "courses_"
+# Collection of the default database recording when each claimed tenant was last seen.
+# Its documents are keyed by _id, holding the tenant id.
+LEDGER_COLLECTION = "tenants"
+
+
+def new_tenant_id():
+    return secrets.token_hex(8)
+
+
+def is_tenant_id(value):
+    """True for ids made by new_tenant_id(), so a cookie can't name any other collection."""
+    return (isinstance(value, str) and len(value) == 16
+            and all(c in "0123456789abcdef" for c in value))
+
+
+class Tenant:
+    """Connection state and catalog structures of one browser session.
+
+    home is the CRUD of the tenant's own collection. mongo is the connection in use, which
+    is home unless the session connected to its own database through /connect.
+
+    A tenant is claimed by its first write. Until then home has no index on the server
+    and the tenant is not in the ledger, so sessions that only read cost no storage.
+    """
+
+    def __init__(self, tenant_id, home, claimed=False):
+        self.id = tenant_id
+        self.home = home
+        self.mongo = home
+        # built from mongo on first use, see get_async_mongo(), get_graph() and get_search_index()
+        self.async_mongo = None
+        self.graph = None
+        self.search_index = None
+        self.claimed = claimed
+        self.last_seen = time.time()
+        # last_seen as last written to the ledger
+        self.touched = self.last_seen if claimed else 0
+        self.lock = threading.Lock()
+
+    def connect(self, mongo):
+        """Switches to another connection, or back home when mongo is None."""
+        with self.lock:
+            previous = self.mongo
+            self.mongo = mongo or self.home
+            self.async_mongo = None
+            self.graph = None
+            self.search_index = None
+        if previous is not self.home and previous is not self.mongo:
+            previous.close()
+
+    def forget(self, source):
+        """Drops the graph and search index if they were built from source."""
+        with self.lock:
+            if self.mongo is source:
+                self.graph = None
+                self.search_index = None
+
+    def close(self):
+        self.connect(None)
+        self.home.close()
+
+
+class TenantRegistry:
+    """Tenants open in this process by id, with a background thread dropping expired ones.
+
+    open_home(collection_name, create_index, key=...) opens a collection of the default database.
+    When a tenant is claimed it gets a document in the ledger collection, whose last_seen
+    each process's sweeper keeps up to date for the tenants it serves. A collection is only
+    dropped once its ledger entry is older than ttl, so a tenant another process still
+    serves, or whose session comes back after a restart, keeps its courses. Collections
+    without a ledger entry are never dropped.
+
+    At most max_active tenants stay open, the least recently used are closed beyond that.
+    Their collections stay until their ledger entry expires.
+    """
+
+    def __init__(self,
+                 open_home,
+                 ttl=TENANT_TTL,
+                 sweep_interval=TENANT_SWEEP_INTERVAL,
+                 max_active=TENANT_MAX_ACTIVE):
+        self.open_home = open_home
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.max_active = max_active
+        # least recently used first
+        self.tenants = OrderedDict()
+        self.ledger = None
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.sweeper = None
+
+    def get_ledger(self):
+        """Returns the ledger collection, opening it the first time."""
+        with self.lock:
+            if self.ledger is None:
+                self.ledger = self.open_home(LEDGER_COLLECTION, False, key="_id")
+            return self.ledger.collection
+
+    def get(self, tenant_id, new=False):
+        """Returns the tenant with that id, opening its collection the first time.
+
+        new says the id was just made for a new session, so the ledger can't know it yet.
+        """
+        now = time.time()
+        with self.lock:
+            tenant = self.tenants.get(tenant_id)
+            if tenant is not None:
+                self.tenants.move_to_end(tenant_id)
+                tenant.last_seen = now
+        if tenant is not None:
+            # a tenant idle here for long may have expired in another process's sweep
+            if not tenant.claimed or now - tenant.touched < self.ttl / 2 or self.touch(tenant):
+                return tenant
+            with self.lock:
+                if self.tenants.get(tenant_id) is tenant:
+                    del self.tenants[tenant_id]
+            self.release(tenant)
+
+        claimed = False
+        if not new:
+            claimed = self.get_ledger().find_one_and_update(
+                {"_id": tenant_id}, {"$set": {"last_seen": now}},
+                projection={"_id": 0}) is not None
+
+        # opened outside the lock, it may create an index on the server
+        home = self.open_home(TENANT_PREFIX + tenant_id, claimed)
+        with self.lock:
+            tenant = self.tenants.get(tenant_id)
+            if tenant is None:
+                tenant = self.tenants[tenant_id] = Tenant(tenant_id, home, claimed)
+                home = None
+            evicted = []
+            while len(self.tenants) > self.max_active:
+                evicted.append(self.tenants.popitem(last=False)[1])
+        if home is not None:
+            home.close()
+        for old in evicted:
+            self.release(old)
+        self.start()
+        return tenant
+
+    def claim(self, tenant):
+        """Records a tenant in the ledger and indexes its collection before its first write."""
+        if tenant.claimed:
+            return
+        now = time.time()
+        self.get_ledger().update_one({"_id": tenant.id},
+                                     {"$set": {"last_seen": now}},
+                                     upsert=True)
+        tenant.home.ensure_index()
+        with tenant.lock:
+            tenant.claimed = True
+            tenant.touched = now
+            # the async twin was built without the index, the next request rebuilds it
+            if tenant.mongo is tenant.home:
+                tenant.async_mongo = None
+
+    def touch(self, tenant):
+        """Writes when a claimed tenant was last seen. False if its entry has expired since."""
+        seen = tenant.last_seen
+        found = self.get_ledger().update_one({"_id": tenant.id},
+                                             {"$set": {"last_seen": seen}})
+        tenant.touched = seen
+        return found.matched_count > 0
+
+    def release(self, tenant):
+        """Closes a tenant this process no longer keeps open, leaving its collection."""
+        tenant.close()
+        if not tenant.claimed and tenant.home.backend == "memory":
+            # nothing was written, and the memory backend's collection lives in this process
+            tenant.home.drop()
+
+    def forget(self, source):
+        """Drops the graph and search index built from source in every tenant using it."""
+        with self.lock:
+            tenants = list(self.tenants.values())
+        for tenant in tenants:
+            tenant.forget(source)
+
+    def start(self):
+        """Starts the sweeper thread once this process serves its first tenant.
+
+        Starting on first use keeps processes that never serve, like the reloader's
+        watcher, from sweeping at all.
+        """
+        with self.lock:
+            if self.sweeper is not None or self.sweep_interval <= 0:
+                return
+            self.sweeper = threading.Thread(target=self.run,
+                                            name="tenant-sweeper",
+                                            daemon=True)
+        self.sweeper.start()
+
+    def run(self):
+        while not self.stop_event.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Could not drop expired tenants: {e}")
+
+    def stop(self):
+        self.stop_event.set()
+
+    def sweep(self, now=None):
+        """Drops the collections of tenants unused for longer than ttl. Returns how many.
+
+        First writes to the ledger when this process last saw each of its tenants and
+        closes the ones idle for longer than ttl.
+        """
+        now = time.time() if now is None else now
+        cutoff = now - self.ttl
+        with self.lock:
+            seen = [
+                tenant for tenant in self.tenants.values()
+                if tenant.claimed and tenant.last_seen > tenant.touched
+            ]
+            idle = [
+                self.tenants.pop(tenant_id)
+                for tenant_id, tenant in list(self.tenants.items())
+                if tenant.last_seen < cutoff
+            ]
+
+        ledger = self.get_ledger()
+        if seen:
+            ledger.bulk_write([
+                UpdateOne({"_id": tenant.id},
+                          {"$set": {"last_seen": tenant.last_seen}})
+                for tenant in seen
+            ], ordered=False)
+            for tenant in seen:
+                tenant.touched = tenant.last_seen
+        for tenant in idle:
+            self.release(tenant)
+
+        expired = [
+            doc["_id"] for doc in ledger.find({"last_seen": {"$lt": cutoff}}, {"_id": 1})
+        ]
+        dropped = 0
+        for tenant_id in expired:
+            # only one sweeper wins each entry, and none once a process has seen it again
+            if ledger.find_one_and_delete({
+                    "_id": tenant_id,
+                    "last_seen": {"$lt": cutoff}
+            }) is None:
+                continue
+            with self.lock:
+                tenant = self.tenants.pop(tenant_id, None)
+            if tenant is not None:
+                tenant.close()
+            home = self.open_home(TENANT_PREFIX + tenant_id, False)
+            home.drop()
+            home.close()
+            dropped += 1
+        if dropped:
+            print(f"Dropped {dropped} expired tenant collection(s)")
+        return dropped
+
+    def __len__(self):
+        with self.lock:
+            return len(self.tenants)
@@ -0,0 +1,99 @@
+# Tests for the conditional GETs and page cache of app.py on the in-memory backend
+# Run from this directory with: python -m pytest -q
+import os
+import uuid
+import pytest
+
+os.environ["COURSE_BACKEND"] = "memory"
+import app as webapp
+from mongo_crud import CRUD
+
+
+@pytest.fixture
+def private_db():
+    """A database holding one collection with a course the app never wrote."""
+    db_name = f"private_{uuid.uuid4().hex}"
+    crud = CRUD(db_name=db_name, backend="memory")
+    crud.collection.insert_one({
+        "course_number": "SECRET101",
+        "course_title": "Secret Course",
+        "prerequisites": []
+    })
+    yield db_name
+    crud.drop()
+
+
+def client():
+    webapp.app.config["TESTING"] = True
+    return webapp.app.test_client()
+
+
+def connect(session, db_name):
+    session.post("/connect",
+                 data={
+                     "username": "user",
+                     "password": "secret",
+                     "db_name": db_name,
+                     "collection_name": "courses"
+                 })
+
+
+def pages(session, headers=None):
+    """The index page and CSV export as (status, ETag, body)."""
+    results = []
+    for path in ("/", "/export"):
+        response = session.get(path, headers=headers or {})
+        results.append((response.status_code, response.headers.get("ETag"),
+                        response.get_data()))
+    return results
+
+
+def test_sessions_never_share_pages_of_an_unwritten_collection(private_db):
+    first = client()
+    connect(first, private_db)
+    first_pages = pages(first)
+    assert all(b"SECRET101" in body for _, _, body in first_pages)
+
+    second = client()
+    second.get("/")
+    for status, etag, body in pages(second):
+        assert b"SECRET101" not in body
+        assert etag is None or etag not in [page[1] for page in first_pages]
+
+
+def test_sessions_never_share_cached_pages_or_validators(private_db):
+    first = client()
+    connect(first, private_db)
+    # a write through the app gives the collection a version, so its pages are cached
+    first.post("/use-sample")
+    first.get("/")
+    first_pages = pages(first)
+    assert all(etag is not None and b"SECRET101" in body for _, etag, body in first_pages)
+
+    second = client()
+    second.post("/use-sample")
+    second.get("/")
+    for status, etag, body in pages(second):
+        assert b"SECRET101" not in body
+        assert etag not in [page[1] for page in first_pages]
+
+    for (_, first_etag, _), path in zip(first_pages, ("/", "/export")):
+        response = second.get(path, headers={"If-None-Match": first_etag})
+        assert response.status_code != 304
+        assert b"SECRET101" not in response.get_data()
+
+
+def test_sessions_on_the_same_collection_keep_their_own_pages(private_db):
+    first = client()
+    connect(first, private_db)
+    first.post("/use-sample")
+    first.get("/")
+    first_pages = pages(first)
+
+    second = client()
+    connect(second, private_db)
+    second.get("/")
+    for (_, first_etag, _), path in zip(first_pages, ("/", "/export")):
+        response = second.get(path, headers={"If-None-Match": first_etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != first_etag
@@ -0,0 +1,132 @@
+# Tests for the bulk operations of async_crud.AsyncCRUD on the in-memory backend
+# Run from this directory with: python -m pytest -q
+import asyncio
+import uuid
+import pytest
+from async_crud import AsyncCRUD
+from mongo_crud import CRUD
+
+COURSES = [
+    {"course_number": "CS101", "course_title": "Intro", "prerequisites": []},
+    {"course_number": "CS102", "course_title": "Programming", "prerequisites": ["CS101"]},
+    {"course_number": "CS201", "course_title": "Data Structures", "prerequisites": ["CS102"]},
+]
+
+
+@pytest.fixture
+def crud():
+    """A CRUD on its own in-memory database, so tests never see each other's courses."""
+    crud = CRUD(db_name=f"test_{uuid.uuid4().hex}", backend="memory", cache_size=16)
+    yield crud
+    crud.drop()
+
+
+@pytest.fixture
+def mongo(crud):
+    mongo = AsyncCRUD.from_crud(crud)
+    asyncio.run(mongo.bulk_create([dict(course) for course in COURSES]))
+    return mongo
+
+
+def test_bulk_create_skips_existing_courses(crud):
+    mongo = AsyncCRUD.from_crud(crud)
+    first = asyncio.run(mongo.bulk_create([dict(course) for course in COURSES], batch_size=2))
+    assert [batch["inserted"] for batch in first] == [2, 1]
+
+    again = [dict(COURSES[0], course_title="Changed"), {"course_number": "CS301"}]
+    stats = asyncio.run(mongo.bulk_create(again))
+    assert stats == [{"inserted": 1, "skipped": 1, "rejected": 0}]
+    assert crud.find_course("CS101")["course_title"] == "Intro"
+    assert crud.collection.count_documents({}) == 4
+
+
+def test_find_courses_returns_found_courses_with_their_version(mongo):
+    found = asyncio.run(mongo.find_courses(["CS101", "CS201", "NOPE"], ["course_title"]))
+    assert found == {
+        "CS101": {"course_number": "CS101", "course_title": "Intro", "version": 0},
+        "CS201": {"course_number": "CS201", "course_title": "Data Structures", "version": 0},
+    }
+
+
+def test_patch_courses_reports_every_status(mongo):
+    results = asyncio.run(
+        mongo.patch_courses(
+            {
+                "CS101": {"course_title": "Introduction"},
+                "CS102": {"course_title": "Programming"},
+                "CS201": {"course_title": "Algorithms"},
+                "NOPE": {"course_title": "Missing"},
+            },
+            versions={"CS201": 3}))
+    assert results == {
+        "CS101": ("updated", 1),
+        "CS102": ("unchanged", 0),
+        "CS201": ("conflict", 0),
+        "NOPE": ("not_found", None),
+    }
+    found = asyncio.run(mongo.find_courses(["CS101", "CS201"]))
+    assert found["CS101"]["course_title"] == "Introduction"
+    assert found["CS101"]["version"] == 1
+    assert found["CS201"]["course_title"] == "Data Structures"
+
+
+def test_patch_courses_checks_the_version_it_was_given(mongo):
+    asyncio.run(mongo.patch_courses({"CS101": {"course_title": "First"}}))
+    stale = asyncio.run(mongo.patch_courses({"CS101": {"course_title": "Second"}}, {"CS101": 0}))
+    current = asyncio.run(mongo.patch_courses({"CS101": {"course_title": "Second"}}, {"CS101": 1}))
+    assert stale == {"CS101": ("conflict", 1)}
+    assert current == {"CS101": ("updated", 2)}
+
+
+def test_delete_courses_reports_every_status(crud, mongo):
+    asyncio.run(mongo.patch_courses({"CS201": {"course_title": "Algorithms"}}))
+    results = asyncio.run(mongo.delete_courses(["CS101", "CS201", "NOPE"], versions={"CS201": 0}))
+
+    status, course = results["CS101"]
+    assert status == "deleted"
+    assert course["course_title"] == "Intro"
+    status, course = results["CS201"]
+    assert status == "conflict"
+    assert course["version"] == 1
+    assert results["NOPE"] == ("not_found", None)
+    assert crud.find_course("CS101") is None
+    assert crud.find_course("CS201") is not None
+
+
+def test_bulk_writes_drop_cached_reads(crud, mongo):
+    assert crud.find_course("CS102")["course_title"] == "Programming"
+    asyncio.run(mongo.patch_courses({"CS102": {"course_title": "Programming II"}}))
+    assert crud.find_course("CS102")["course_title"] == "Programming II"
+    asyncio.run(mongo.delete_courses(["CS102"]))
+    assert crud.find_course("CS102") is None
+
+
+def test_delete_courses_reports_courses_a_concurrent_request_deleted_as_not_found(mongo):
+
+    async def both():
+        return await asyncio.gather(mongo.delete_courses(["CS101", "CS102"]),
+                                    mongo.delete_courses(["CS102", "CS101"]))
+
+    first, second = asyncio.run(both())
+    for number in ("CS101", "CS102"):
+        statuses = sorted([first[number][0], second[number][0]])
+        assert statuses == ["deleted", "not_found"]
+
+
+def test_bulk_create_keeps_the_version_when_nothing_is_inserted(crud, mongo):
+    stamp = crud.version.read()
+    stats = asyncio.run(mongo.bulk_create([dict(course) for course in COURSES]))
+    assert stats == [{"inserted": 0, "skipped": 3, "rejected": 0}]
+    crud.bulk_create([dict(course) for course in COURSES])
+    assert crud.version.read() == stamp
+
+
+def test_bulk_create_lists_only_the_courses_it_inserted(crud, mongo):
+    inserted = []
+    asyncio.run(mongo.bulk_create([dict(COURSES[0], course_title="Changed"), {"course_number": "CS301"}],
+                                  inserted=inserted))
+    assert [course["course_number"] for course in inserted] == ["CS301"]
+
+    inserted = []
+    crud.bulk_create([dict(COURSES[1]), {"course_number": "CS302"}], inserted=inserted)
+    assert [course["course_number"] for course in inserted] == ["CS302"]
@@ -0,0 +1,30 @@
+# Tests for the per-owner and overall limits of import_jobs.ImportJobs
+# Run from this directory with: python -m pytest -q
+import threading
+import pytest
+from import_jobs import ImportJob, ImportJobs, JobLimitError
+
+
+@pytest.fixture
+def blocked():
+    """Jobs that keep running until the test releases them."""
+    release = threading.Event()
+    yield lambda job: release.wait(5)
+    release.set()
+
+
+def test_one_owner_at_its_limit_leaves_others_room(blocked):
+    jobs = ImportJobs(workers=1, max_jobs=2)
+    for _ in range(2):
+        jobs.submit(ImportJob("a.csv", owner="a"), blocked)
+    with pytest.raises(JobLimitError):
+        jobs.submit(ImportJob("a.csv", owner="a"), blocked)
+    assert jobs.submit(ImportJob("b.csv", owner="b"), blocked).owner == "b"
+
+
+def test_overall_cap_applies_across_owners(blocked):
+    jobs = ImportJobs(workers=1, max_jobs=2, max_total=3)
+    for owner in ("a", "a", "b"):
+        jobs.submit(ImportJob("x.csv", owner=owner), blocked)
+    with pytest.raises(JobLimitError):
+        jobs.submit(ImportJob("c.csv", owner="c"), blocked)
@@ -0,0 +1,101 @@
+# Reads CSV uploads incrementally from the request body instead of saving them to disk first
+import codecs
+from werkzeug.exceptions import BadRequest
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+# Bytes read from the request body at a time
+CHUNK_SIZE = 64 * 1024
+
+
+def read_chunks(stream, chunk_size=CHUNK_SIZE):
+    """Yields a stream chunk by chunk until it is exhausted."""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+class MultipartFile:
+    """One file field of a multipart/form-data body, decoded as the body arrives.
+
+    open() reads up to the file's part headers and returns its filename. Iterating then
+    yields the file's bytes chunk by chunk, so only one chunk is held in memory at a time.
+    """
+
+    def __init__(self, chunks, boundary, field_name="file"):
+        self.chunks = iter(chunks)
+        self.decoder = MultipartDecoder(boundary.encode("latin-1"))
+        self.field_name = field_name
+        self.filename = None
+
+    def next_event(self):
+        """Returns the next multipart event, reading more of the body when needed."""
+        while True:
+            try:
+                event = self.decoder.next_event()
+            except ValueError as e:
+                raise BadRequest(f"The upload is not a valid form: {e}")
+            if not isinstance(event, NeedData):
+                return event
+            if self.decoder.complete:
+                raise BadRequest("The upload ended before the form was complete.")
+            self.decoder.receive_data(next(self.chunks, None))
+
+    def open(self):
+        """Skips ahead to the file field and returns its filename, or None if there is none."""
+        while True:
+            event = self.next_event()
+            if isinstance(event, File) and event.name == self.field_name:
+                self.filename = event.filename
+                return self.filename
+            if isinstance(event, Epilogue):
+                return None
+
+    def __iter__(self):
+        while True:
+            event = self.next_event()
+            if isinstance(event, Data):
+                if event.data:
+                    yield event.data
+                if not event.more_data:
+                    return
+
+
+def open_csv_upload(request, field_name="file"):
+    """Returns the filename and byte chunks of an uploaded CSV without touching request.files.
+
+    Reading request.files would make Werkzeug parse, and spool to disk, the whole body first.
+    Accepts a multipart/form-data form or a raw text/csv body, whose filename is upload.csv.
+    """
+    chunks = read_chunks(request.stream)
+
+    if request.mimetype == "multipart/form-data":
+        boundary = request.mimetype_params.get("boundary")
+        if not boundary:
+            raise BadRequest("The form has no multipart boundary.")
+        upload = MultipartFile(chunks, boundary, field_name)
+        return upload.open(), upload
+
+    if request.mimetype == "text/csv":
+        return "upload.csv", chunks
+
+    return None, iter(())
+
+
+def iter_lines(chunks, encoding="utf-8-sig"):
+    """Decodes byte chunks and yields whole lines, line endings included, for csv.reader.
+
+    A character or line split across two chunks is held back until the rest arrives.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    carry = ""
+    for chunk in chunks:
+        lines = (carry + decoder.decode(chunk)).split("\n")
+        carry = lines.pop()
+        for line in lines:
+            yield line + "\n"
+
+    carry += decoder.decode(b"", final=True)
+    if carry:
+        yield carry